@@ -0,0 +1,115 @@
+"""流式增量微批合并的效果
+
+用几种典型的上游节奏生成逐字的 content 事件，分别直接编码和经过
+services/delta_batch 合并后编码成 full 格式的 SSE 帧，输出：
+    帧/秒（合并前 → 合并后）和每秒省下的帧数
+    传输字节（full 格式每帧带 full_content，帧越少字节越少）
+    首帧延迟和单个字符的最大额外延迟
+
+节奏：
+    steady   每 2ms 一个字符（快速模型逐字输出）
+    bursty   每 40ms 一次网络读，一次带 20 个字符事件
+    slow     每 80ms 一个字符（慢速模型，不应增加延迟）
+
+用法：
+    cd backend
+    python benchmarks/delta_batching.py
+    python benchmarks/delta_batching.py --chars 500 --window-ms 16 --json result.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services.delta_batch import DeltaBatchSettings, batch_deltas  # noqa: E402
+from services.sse import FullStreamEncoder  # noqa: E402
+
+PATTERNS = {
+    # 名称: (每次读取的事件数, 读取间隔秒)
+    "steady": (1, 0.002),
+    "bursty": (20, 0.04),
+    "slow": (1, 0.08),
+}
+
+
+async def upstream(chars: int, burst: int, gap: float, arrivals: deque):
+    """逐字输出，每个事件的内容是一个字符，记录到达时间"""
+    sent = 0
+    while sent < chars:
+        await asyncio.sleep(gap)
+        for _ in range(min(burst, chars - sent)):
+            arrivals.append(time.perf_counter())
+            sent += 1
+            yield {"type": "content", "content": "字"}
+
+
+async def measure(pattern: str, chars: int, settings: DeltaBatchSettings) -> dict:
+    burst, gap = PATTERNS[pattern]
+    arrivals: deque = deque()
+    source = upstream(chars, burst, gap, arrivals)
+    if settings.enabled:
+        source = batch_deltas(source, settings, "benchmark")
+    encoder = FullStreamEncoder()
+    frames = 0
+    size = 0
+    first_delay = None
+    max_delay = 0.0
+    started = time.perf_counter()
+    async for chunk in source:
+        now = time.perf_counter()
+        frame = encoder.encode(chunk)
+        frames += 1
+        size += len(frame)
+        # 这一帧包含的字符按到达顺序出队，最早到达的那个决定额外延迟
+        oldest = arrivals[0]
+        for _ in range(len(chunk["content"])):
+            arrivals.popleft()
+        if first_delay is None:
+            first_delay = now - oldest
+        max_delay = max(max_delay, now - oldest)
+    elapsed = time.perf_counter() - started
+    return {
+        "frames": frames,
+        "frames_per_second": round(frames / elapsed),
+        "bytes": size,
+        "first_frame_delay_ms": round(first_delay * 1000, 2),
+        "max_added_delay_ms": round(max_delay * 1000, 2),
+    }
+
+
+async def main(args) -> list:
+    batched = DeltaBatchSettings(window=args.window_ms / 1000, max_bytes=args.max_bytes)
+    results = []
+    for pattern in PATTERNS:
+        before = await measure(pattern, args.chars, DeltaBatchSettings(window=0))
+        after = await measure(pattern, args.chars, batched)
+        result = {
+            "pattern": pattern,
+            "window_ms": args.window_ms,
+            "before": before,
+            "after": after,
+            "frames_per_second_saved": before["frames_per_second"] - after["frames_per_second"],
+        }
+        results.append(result)
+        print(f"{pattern:>7} frames/s {before['frames_per_second']:>5} -> {after['frames_per_second']:>4} "
+              f"(省 {result['frames_per_second_saved']:>5}/s)  bytes {before['bytes']:>8} -> {after['bytes']:>7}  "
+              f"首帧 {after['first_frame_delay_ms']:>5} ms  最大额外延迟 {after['max_added_delay_ms']:>6} ms")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="流式增量微批合并的效果")
+    parser.add_argument("--chars", type=int, default=1000, help="每个流的字符事件数")
+    parser.add_argument("--window-ms", type=float, default=25, help="合并窗口（毫秒）")
+    parser.add_argument("--max-bytes", type=int, default=512, help="攒够多少字节立即发出")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    arguments = parser.parse_args()
+    output = asyncio.run(main(arguments))
+    if arguments.json:
+        with open(arguments.json, "w", encoding="utf-8") as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
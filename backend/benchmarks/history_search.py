@@ -0,0 +1,162 @@
+"""聊天历史全文检索的写入吞吐和查询延迟
+
+生成 --messages 条消息（每轮问答两条：提问 + 回复，中英混合，词频按 Zipf 分布），
+按后台写入的批量方式写进 services/history 的索引，然后对不同命中量的关键词
+（常见字、常见词、罕见词、多关键词、带过滤条件）分别按 relevance / recent
+排序查询，输出每类查询的 p50/p95 延迟和命中页大小。
+
+数据库较大（一百万条消息约 1GB），默认写在临时目录，--db 可以复用已生成的库。
+
+用法：
+    cd backend
+    python benchmarks/history_search.py --messages 100000
+    python benchmarks/history_search.py --messages 1000000 --db /tmp/history.sqlite3 --json result.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services.history import HistoryIndex, HistorySettings  # noqa: E402
+
+CHINESE = ("流式 输出 模型 上下文 缓存 数据库 性能 优化 延迟 吞吐 配置 密钥 请求 响应 错误 重试 连接 服务器 "
+           "前端 后端 会话 历史 搜索 索引 分词 排序 分页 测试 部署 容器 网络 代理 证书 日志 指标 队列 并发 "
+           "线程 进程 内存 磁盘 文件 函数 变量 参数 接口 文档 示例 问题 答案 方法 结果 原因 步骤 建议").split()
+ENGLISH = ("python fastapi uvicorn sqlite index query latency throughput token stream cache config key request "
+           "response error retry connection server client session history search rank cursor page test deploy "
+           "docker network proxy certificate log metric queue thread process memory disk file function").split()
+FILLER = list("的了是在和有我你这就也都而及与着或一个我们可以需要如果因为所以但是") + ["the", "a", "to", "of", "and", "is"]
+RARE = ["量子纠缠", "xylophone", "拓扑排序", "zeppelin"]
+PROVIDERS = [("openai", "gpt-4o-mini"), ("anthropic", "claude-3-5-sonnet"), ("custom", "qwen-max"), ("demo", "demo-model")]
+
+QUERIES = {
+    # 名称: (关键词, 额外过滤)
+    "common_char": ("的", {}),
+    "common_word": ("缓存", {}),
+    "two_words": ("流式 输出", {}),
+    "english": ("latency", {}),
+    "mixed": ("sqlite 索引", {}),
+    "rare": ("量子纠缠", {}),
+    "provider_filter": ("缓存", {"provider": "anthropic"}),
+    "date_filter": ("缓存", {"since_fraction": 0.9}),
+}
+
+
+def zipf_choice(rng: random.Random, words, skew: float = 1.1) -> str:
+    weights = getattr(zipf_choice, "_weights", {}).get((len(words), skew))
+    if weights is None:
+        weights = [1 / (rank + 1) ** skew for rank in range(len(words))]
+        zipf_choice.__dict__.setdefault("_weights", {})[(len(words), skew)] = weights
+    return rng.choices(words, weights)[0]
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    parts = []
+    for _ in range(words):
+        roll = rng.random()
+        if roll < 0.45:
+            parts.append(zipf_choice(rng, CHINESE))
+        elif roll < 0.65:
+            parts.append(" " + zipf_choice(rng, ENGLISH) + " ")
+        elif roll < 0.9999:
+            parts.append(rng.choice(FILLER))
+        else:
+            parts.append(rng.choice(RARE))
+    return "".join(parts)
+
+
+def build(index: HistoryIndex, messages: int, batch: int, seed: int, start: float) -> dict:
+    rng = random.Random(seed)
+    exchanges = messages // 2
+    step = 30 * 24 * 3600 / max(1, exchanges)  # 均匀分布在 30 天里
+    written = 0
+    started = time.perf_counter()
+    while written < exchanges:
+        rows = []
+        for offset in range(min(batch, exchanges - written)):
+            provider, model = rng.choice(PROVIDERS)
+            rows.append((start + (written + offset) * step, None, provider, model,
+                         sentence(rng, rng.randint(5, 25)), sentence(rng, rng.randint(40, 160))))
+        index._write(rows)
+        written += len(rows)
+        if written % 100000 < batch:
+            print(f"  已写入 {written * 2} 条消息", flush=True)
+    elapsed = time.perf_counter() - started
+    return {"messages": written * 2, "seconds": round(elapsed, 1), "messages_per_second": round(written * 2 / elapsed)}
+
+
+async def measure(index: HistoryIndex, repeat: int, first: float, last: float) -> list:
+    results = []
+    for name, (query, extra) in QUERIES.items():
+        filters = {key: value for key, value in extra.items() if key != "since_fraction"}
+        if "since_fraction" in extra:
+            filters["since"] = first + (last - first) * extra["since_fraction"]
+        for sort in ("relevance", "recent"):
+            timings = []
+            page = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                page = await index.search(query, sort=sort, limit=20, **filters)
+                timings.append((time.perf_counter() - started) * 1000)
+            # 第二页（游标）
+            second = None
+            if page["next_cursor"]:
+                started = time.perf_counter()
+                await index.search(query, sort=sort, limit=20, cursor=page["next_cursor"], **filters)
+                second = round((time.perf_counter() - started) * 1000, 2)
+            timings.sort()
+            result = {
+                "query": name,
+                "sort": sort,
+                "p50_ms": round(statistics.median(timings), 2),
+                "p95_ms": round(timings[int(len(timings) * 0.95) - 1] if len(timings) > 1 else timings[0], 2),
+                "page_2_ms": second,
+                "results": len(page["results"]),
+            }
+            results.append(result)
+            print(f"{name:>16} {sort:>9}  p50 {result['p50_ms']:>7} ms  p95 {result['p95_ms']:>7} ms  "
+                  f"第二页 {second} ms  结果 {result['results']}")
+    return results
+
+
+async def main(args) -> dict:
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="history-bench-"), "history.sqlite3")
+    index = HistoryIndex(HistorySettings(db_path=path, search_candidates=args.candidates))
+    start = 1_700_000_000.0
+    build_stats = None
+    db = index._connect()
+    existing = db.execute("SELECT count(*) FROM exchanges").fetchone()[0] * 2
+    if existing < args.messages:
+        print(f"生成 {args.messages - existing} 条消息到 {path}")
+        build_stats = build(index, args.messages - existing, args.batch, args.seed + existing, start)
+        print(f"写入 {build_stats['messages_per_second']} 条/秒")
+    first, last = db.execute("SELECT min(created_at), max(created_at) FROM exchanges").fetchone()
+    total = db.execute("SELECT count(*) FROM exchanges").fetchone()[0] * 2
+    print(f"索引中共 {total} 条消息，数据库 {os.path.getsize(path) / 1e6:.0f} MB")
+    queries = await measure(index, args.repeat, first, last)
+    await index.aclose()
+    return {"messages": total, "candidates": args.candidates, "build": build_stats, "queries": queries}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="聊天历史全文检索的写入吞吐和查询延迟")
+    parser.add_argument("--messages", type=int, default=100000, help="消息条数（每轮问答两条）")
+    parser.add_argument("--batch", type=int, default=500, help="每个写入事务的问答数")
+    parser.add_argument("--candidates", type=int, default=HistorySettings().search_candidates,
+                        help="relevance 排序最多打分的命中数")
+    parser.add_argument("--repeat", type=int, default=20, help="每个查询重复次数")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db", help="数据库路径（已存在时复用，不足 --messages 时补齐）")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    arguments = parser.parse_args()
+    output = asyncio.run(main(arguments))
+    if arguments.json:
+        with open(arguments.json, "w", encoding="utf-8") as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,230 @@
+"""HTTP/1.1 与 HTTP/2 并发流吞吐对比
+
+在本地启动一个同时支持 HTTP/1.1 和 HTTP/2（h2c，明文先验知识）的 SSE 替身
+服务器，分别用 HTTP/1.1 和 HTTP/2 客户端在 1/10/100 路并发下拉取流式响应，
+输出吞吐、首字节延迟和服务端建立的连接数。
+
+--connect-delay 模拟每个新连接的握手开销（TLS 往返），HTTP/1.1 下每路并发
+都需要自己的连接，这部分开销会随并发数增长；HTTP/2 只建立一个连接。
+
+用法（需要 h2：pip install h2）：
+    cd backend
+    python benchmarks/http2_streams.py
+    python benchmarks/http2_streams.py --levels 1,10,100 --chunks 50 --connect-delay 0.05 --json result.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+import httpx
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+except ImportError:
+    sys.exit("需要安装 h2：pip install h2")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services.http_clients import PoolSettings  # noqa: E402
+
+H2_PREFACE = b"PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n"
+
+
+class StandInServer:
+    """按连接前言区分 HTTP/1.1 和 h2c 的 SSE 替身服务器"""
+
+    def __init__(self, chunks: int, interval: float, connect_delay: float):
+        self.chunks = chunks
+        self.interval = interval
+        self.connect_delay = connect_delay
+        self.connections = 0
+        self._server = None
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    def _event(self, index: int) -> bytes:
+        payload = {"choices": [{"delta": {"content": f"token{index} "}}]}
+        return f"data: {json.dumps(payload)}\n\n".encode()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        if self.connect_delay:
+            await asyncio.sleep(self.connect_delay)
+        try:
+            data = await reader.read(65536)
+            while data and len(data) < len(H2_PREFACE) and H2_PREFACE.startswith(data):
+                data += await reader.read(65536)
+            if data.startswith(H2_PREFACE):
+                await self._serve_h2(reader, writer, data)
+            elif data:
+                await self._serve_http1(reader, writer, data)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    # ---- HTTP/2 ----
+    async def _serve_h2(self, reader, writer, data: bytes) -> None:
+        conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False))
+        conn.initiate_connection()
+        tasks = set()
+        while data:
+            for event in conn.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    task = asyncio.ensure_future(self._h2_stream(conn, writer, event.stream_id))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                elif isinstance(event, h2.events.DataReceived):
+                    conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                elif isinstance(event, h2.events.ConnectionTerminated):
+                    data = b""
+            writer.write(conn.data_to_send())
+            await writer.drain()
+            if data:
+                data = await reader.read(65536)
+        for task in tasks:
+            task.cancel()
+
+    async def _h2_stream(self, conn, writer, stream_id: int) -> None:
+        conn.send_headers(stream_id, [(":status", "200"), ("content-type", "text/event-stream")])
+        writer.write(conn.data_to_send())
+        for index in range(self.chunks):
+            await asyncio.sleep(self.interval)
+            conn.send_data(stream_id, self._event(index))
+            writer.write(conn.data_to_send())
+        conn.send_data(stream_id, b"data: [DONE]\n\n", end_stream=True)
+        writer.write(conn.data_to_send())
+
+    # ---- HTTP/1.1（keep-alive + chunked） ----
+    async def _serve_http1(self, reader, writer, data: bytes) -> None:
+        buffer = data
+        while True:
+            while b"\r\n\r\n" not in buffer:
+                more = await reader.read(65536)
+                if not more:
+                    return
+                buffer += more
+            head, buffer = buffer.split(b"\r\n\r\n", 1)
+            length = 0
+            for line in head.split(b"\r\n")[1:]:
+                name, _, value = line.partition(b":")
+                if name.strip().lower() == b"content-length":
+                    length = int(value)
+            while len(buffer) < length:
+                buffer += await reader.readexactly(length - len(buffer))
+            buffer = buffer[length:]
+
+            writer.write(b"HTTP/1.1 200 OK\r\ncontent-type: text/event-stream\r\ntransfer-encoding: chunked\r\n\r\n")
+            for index in range(self.chunks):
+                await asyncio.sleep(self.interval)
+                event = self._event(index)
+                writer.write(b"%x\r\n%s\r\n" % (len(event), event))
+            done = b"data: [DONE]\n\n"
+            writer.write(b"%x\r\n%s\r\n0\r\n\r\n" % (len(done), done))
+            await writer.drain()
+
+
+async def consume(client: httpx.AsyncClient, url: str) -> tuple:
+    """拉取一路流，返回 (首字节延迟, 事件数)"""
+    started = time.perf_counter()
+    first = None
+    events = 0
+    async with client.stream("POST", url, json={"model": "bench", "stream": True}) as response:
+        async for line in response.aiter_lines():
+            if line.startswith("data: "):
+                if first is None:
+                    first = time.perf_counter() - started
+                if line != "data: [DONE]":
+                    events += 1
+    return first or 0.0, events
+
+
+async def run_level(protocol: str, concurrency: int, streams: int, url: str, server: StandInServer) -> dict:
+    settings = PoolSettings.from_env()
+    client = httpx.AsyncClient(
+        http1=protocol == "http1",
+        http2=protocol == "h2",
+        limits=settings.limits(),
+        timeout=settings.timeout(),
+    )
+    queue = asyncio.Queue()
+    for _ in range(streams):
+        queue.put_nowait(None)
+    ttfbs = []
+    events = 0
+
+    async def worker():
+        nonlocal events
+        while not queue.empty():
+            queue.get_nowait()
+            ttfb, count = await consume(client, url)
+            ttfbs.append(ttfb)
+            events += count
+
+    connections_before = server.connections
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    await client.aclose()
+
+    ttfbs.sort()
+    return {
+        "protocol": protocol,
+        "concurrency": concurrency,
+        "streams": streams,
+        "seconds": round(elapsed, 3),
+        "streams_per_second": round(streams / elapsed, 1),
+        "events_per_second": round(events / elapsed, 1),
+        "ttfb_p50_ms": round(statistics.median(ttfbs) * 1000, 2),
+        "ttfb_p95_ms": round(ttfbs[min(len(ttfbs) - 1, int(len(ttfbs) * 0.95))] * 1000, 2),
+        "connections_opened": server.connections - connections_before,
+    }
+
+
+async def main(args) -> list:
+    server = StandInServer(args.chunks, args.interval, args.connect_delay)
+    port = await server.start()
+    url = f"http://127.0.0.1:{port}/v1/chat/completions"
+    results = []
+    try:
+        for concurrency in [int(level) for level in args.levels.split(",")]:
+            streams = max(concurrency * args.rounds, concurrency)
+            for protocol in ("http1", "h2"):
+                result = await run_level(protocol, concurrency, streams, url, server)
+                results.append(result)
+                print(
+                    f"{protocol:>5} c={concurrency:<4} streams={streams:<5} "
+                    f"{result['streams_per_second']:>8} streams/s {result['events_per_second']:>10} events/s "
+                    f"ttfb p50={result['ttfb_p50_ms']}ms p95={result['ttfb_p95_ms']}ms "
+                    f"connections={result['connections_opened']}"
+                )
+    finally:
+        await server.stop()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP/1.1 vs HTTP/2 并发流吞吐对比")
+    parser.add_argument("--levels", default="1,10,100", help="并发数列表，逗号分隔")
+    parser.add_argument("--rounds", type=int, default=3, help="每个并发级别跑 并发数×rounds 路流")
+    parser.add_argument("--chunks", type=int, default=20, help="每路流的事件数")
+    parser.add_argument("--interval", type=float, default=0.005, help="事件间隔（秒）")
+    parser.add_argument("--connect-delay", type=float, default=0.05, help="每个新连接的模拟握手延迟（秒）")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    arguments = parser.parse_args()
+    output = asyncio.run(main(arguments))
+    if arguments.json:
+        with open(arguments.json, "w", encoding="utf-8") as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
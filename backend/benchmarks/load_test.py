@@ -0,0 +1,358 @@
+"""后端负载测试
+
+在子进程中启动 mock_upstream.py 和后端（生产模式），按设定的并发压 /api/chat 和
+/api/chat/stream，测量后端自身的开销：
+    吞吐（请求/秒、token/秒）
+    首 token 延迟（流式）和端到端延迟的 p50/p95/p99
+    后端进程 CPU（每千 token 的 CPU 毫秒）和内存（RSS 峰值/结束值）
+CPU 和内存读取 /proc，只在 Linux 上可用；--backend 指向已运行的后端时需要
+--backend-pid 才能测量。
+
+--provider demo 不启动模拟上游，由后端的演示提供商按同样的参数在进程内生成回复
+（rate 和 ttft 都为 0 时不做任何等待），只测后端自身的链路。
+
+结果写成 JSON，--compare 与之前的结果对比，便于发现性能回退。
+
+用法：
+    cd backend
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --provider anthropic --concurrency 1,16,64 --requests 500 \\
+        --ttft 0.1 --rate 200 --json result.json
+    python benchmarks/load_test.py --json new.json --compare result.json
+    python benchmarks/load_test.py --backend-env ADMISSION_CONCURRENCY=0 --backend-env LOG_LEVEL=ERROR
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from dataclasses import asdict
+from functools import partial
+from typing import Dict, List, Optional
+
+import httpx
+
+from mock_upstream import add_arguments, settings_from
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+API_KEYS = {"openai": "sk-loadtest", "anthropic": "sk-ant-loadtest", "custom": "sk-loadtest", "demo": ""}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    ordered = sorted(values)
+
+    def rank(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 2)
+
+    return {"p50": rank(50), "p95": rank(95), "p99": rank(99)}
+
+
+class ProcessProbe:
+    """读取 /proc 中的进程 CPU 时间和 RSS"""
+
+    def __init__(self, pid: Optional[int]):
+        self.pid = pid
+        self.available = pid is not None and os.path.exists(f"/proc/{pid}/stat")
+        self.ticks = os.sysconf("SC_CLK_TCK") if self.available else 100
+
+    def cpu_seconds(self) -> Optional[float]:
+        if not self.available:
+            return None
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime 和 stime 是第 14、15 个字段（去掉 pid 和 comm 后下标 11、12）
+        return (int(fields[11]) + int(fields[12])) / self.ticks
+
+    def rss_mb(self) -> Optional[float]:
+        if not self.available:
+            return None
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+        return None
+
+
+async def wait_ready(client: httpx.AsyncClient, url: str, process: Optional[subprocess.Popen], timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"进程启动失败（退出码 {process.returncode}）: {' '.join(process.args)}")
+        try:
+            if (await client.get(url)).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f"等待 {url} 就绪超时")
+
+
+def start_mock(args, port: int) -> subprocess.Popen:
+    command = [sys.executable, os.path.join(BENCHMARK_DIR, "mock_upstream.py"), "--port", str(port),
+               "--ttft", str(args.ttft), "--rate", str(args.rate), "--tokens", str(args.tokens),
+               "--chunk-size", str(args.chunk_size), "--error-rate", str(args.error_rate),
+               "--error-status", str(args.error_status), "--abort-rate", str(args.abort_rate),
+               "--seed", str(args.seed)]
+    return subprocess.Popen(command)
+
+
+def start_backend(args, port: int) -> subprocess.Popen:
+    # 与桌面端相同的启动方式（生产模式），--backend-env BACKEND_WORKERS=4 等可以覆盖
+    env = {**os.environ, "LOG_LEVEL": "WARNING", "BACKEND_MODE": "production", "BACKEND_HOST": "127.0.0.1",
+           "BACKEND_PORT": str(port), "BACKEND_LOG_LEVEL": "warning"}
+    for item in args.backend_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    return subprocess.Popen([sys.executable, os.path.join("src", "main.py")], cwd=BACKEND_DIR, env=env)
+
+
+def chat_body(args, upstream_url: Optional[str]) -> dict:
+    if args.provider == "demo":
+        # 演示提供商在后端进程内按同样的参数生成回复，不经过网络
+        api_config = {"demo": {
+            "seed": args.seed, "tokens": args.tokens, "rate": args.rate or 1.0, "ttft": args.ttft,
+            "chunk_size": args.chunk_size, "jitter": 0, "failure_rate": args.error_rate,
+            "no_sleep": not args.rate and not args.ttft,
+        }}
+    else:
+        base_url = upstream_url if args.provider == "anthropic" else f"{upstream_url}/v1"
+        api_config = {"api_key": API_KEYS[args.provider], "base_url": base_url, "model": args.model}
+    return {
+        "messages": [{"role": "user", "content": "请写一段用于负载测试的回复"}],
+        "provider": args.provider,
+        "model": args.model,
+        # 非零温度避开响应缓存和在途合并，每个请求都真正经过上游
+        "temperature": 0.7,
+        "max_tokens": args.tokens,
+        "api_config": api_config,
+    }
+
+
+def completion_tokens(usage: Optional[dict]) -> int:
+    if not usage:
+        return 0
+    return usage.get("completion_tokens") or usage.get("output_tokens") or 0
+
+
+async def one_chat(client: httpx.AsyncClient, body: dict) -> dict:
+    started = time.perf_counter()
+    response = await client.post("/api/chat", json=body)
+    elapsed = time.perf_counter() - started
+    if response.status_code != 200:
+        return {"ok": False, "latency": elapsed, "status": response.status_code}
+    return {"ok": True, "latency": elapsed, "tokens": completion_tokens(response.json().get("usage"))}
+
+
+async def one_stream(client: httpx.AsyncClient, body: dict, stream_format: str) -> dict:
+    started = time.perf_counter()
+    first = None
+    tokens = 0
+    ok = True
+    async with client.stream("POST", "/api/chat/stream", json=body, params={"format": stream_format}) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return {"ok": False, "latency": time.perf_counter() - started, "status": response.status_code}
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            data = line[6:]
+            if data == "[DONE]":
+                break
+            frame = json.loads(data)
+            if frame.get("error"):
+                ok = False
+            elif frame.get("type") == "content" and first is None:
+                first = time.perf_counter() - started
+            elif frame.get("type") in ("usage", "final") and frame.get("usage"):
+                tokens = completion_tokens(frame["usage"])
+    return {"ok": ok, "latency": time.perf_counter() - started, "ttft": first, "tokens": tokens}
+
+
+async def run_level(client: httpx.AsyncClient, mode: str, concurrency: int, args, body: dict,
+                    probe: ProcessProbe) -> dict:
+    if mode == "stream":
+        send = partial(one_stream, stream_format=args.stream_format)
+    else:
+        send = one_chat
+    for _ in range(args.warmup):
+        await send(client, body)
+
+    remaining = args.requests
+    results: List[dict] = []
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            try:
+                results.append(await send(client, body))
+            except httpx.HTTPError as e:
+                results.append({"ok": False, "latency": 0.0, "error": type(e).__name__})
+
+    rss_samples: List[float] = []
+
+    async def sample_rss():
+        while True:
+            rss = probe.rss_mb()
+            if rss is not None:
+                rss_samples.append(rss)
+            await asyncio.sleep(0.1)
+
+    sampler = asyncio.ensure_future(sample_rss())
+    cpu_before = probe.cpu_seconds()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = time.perf_counter() - started
+    cpu_after = probe.cpu_seconds()
+    sampler.cancel()
+
+    succeeded = [r for r in results if r["ok"]]
+    tokens = sum(r.get("tokens", 0) for r in succeeded)
+    cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    return {
+        "mode": mode,
+        "provider": args.provider,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(results) - len(succeeded),
+        "duration_s": round(duration, 3),
+        "requests_per_second": round(len(succeeded) / duration, 1),
+        "tokens_per_second": round(tokens / duration, 1),
+        "ttft_ms": percentiles([r["ttft"] for r in succeeded if r.get("ttft") is not None]),
+        "latency_ms": percentiles([r["latency"] for r in succeeded]),
+        "backend_cpu_s": round(cpu, 3) if cpu is not None else None,
+        "cpu_ms_per_1k_tokens": round(cpu * 1000 / tokens * 1000, 2) if cpu is not None and tokens else None,
+        "rss_mb_peak": round(max(rss_samples), 1) if rss_samples else None,
+        "rss_mb_end": round(probe.rss_mb(), 1) if probe.available else None,
+    }
+
+
+def print_result(result: dict) -> None:
+    print(f"{result['mode']:>6} c={result['concurrency']:<4} {result['requests_per_second']:>8} req/s "
+          f"{result['tokens_per_second']:>10} tok/s  ttft p50/p95/p99 {result['ttft_ms']['p50']}/"
+          f"{result['ttft_ms']['p95']}/{result['ttft_ms']['p99']} ms  latency p50/p95/p99 "
+          f"{result['latency_ms']['p50']}/{result['latency_ms']['p95']}/{result['latency_ms']['p99']} ms  "
+          f"cpu {result['cpu_ms_per_1k_tokens']} ms/1k tok  rss {result['rss_mb_peak']} MB  "
+          f"errors {result['errors']}")
+
+
+COMPARED = (
+    ("requests_per_second", "吞吐", True),
+    (("ttft_ms", "p95"), "TTFT p95", False),
+    (("latency_ms", "p95"), "延迟 p95", False),
+    ("cpu_ms_per_1k_tokens", "CPU/1k tok", False),
+    ("rss_mb_peak", "RSS 峰值", False),
+)
+
+
+def compare(results: List[dict], baseline_path: str) -> None:
+    """按 (mode, provider, concurrency) 对比基线，打印变化百分比"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["mode"], r["provider"], r["concurrency"]): r for r in json.load(f)["runs"]}
+    print(f"\n与 {baseline_path} 对比（正值表示变好）：")
+    for result in results:
+        old = baseline.get((result["mode"], result["provider"], result["concurrency"]))
+        if old is None:
+            continue
+        changes = []
+        for key, label, higher_is_better in COMPARED:
+            if isinstance(key, tuple):
+                new_value, old_value = result[key[0]][key[1]], old[key[0]][key[1]]
+            else:
+                new_value, old_value = result[key], old[key]
+            if not new_value or not old_value:
+                continue
+            change = (new_value - old_value) / old_value * 100
+            changes.append(f"{label} {change if higher_is_better else -change:+.1f}%")
+        print(f"{result['mode']:>6} c={result['concurrency']:<4} " + "  ".join(changes))
+
+
+async def main(args) -> dict:
+    processes: List[subprocess.Popen] = []
+    mock = backend = None
+    upstream_url = None
+    if args.provider != "demo":
+        upstream_port = args.upstream_port or free_port()
+        mock = start_mock(args, upstream_port)
+        processes.append(mock)
+        upstream_url = f"http://127.0.0.1:{upstream_port}"
+    backend_url = args.backend
+    backend_pid = args.backend_pid
+    if backend_url is None:
+        backend_port = free_port()
+        backend = start_backend(args, backend_port)
+        processes.append(backend)
+        backend_url = f"http://127.0.0.1:{backend_port}"
+        backend_pid = backend.pid
+    try:
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(base_url=backend_url, timeout=120, limits=limits) as client:
+            if mock is not None:
+                await wait_ready(client, f"{upstream_url}/stats", mock)
+            await wait_ready(client, "/ready", backend)
+            startup = (await client.get("/ready")).json()
+            print(f"后端启动耗时 {startup['total_ms']} ms {startup['phases_ms']}")
+            probe = ProcessProbe(backend_pid)
+            body = chat_body(args, upstream_url)
+            runs = []
+            for concurrency in args.concurrency:
+                for mode in args.modes:
+                    result = await run_level(client, mode, concurrency, args, body, probe)
+                    print_result(result)
+                    runs.append(result)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+    return {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpu_count": os.cpu_count(), "backend_env": args.backend_env},
+        "upstream": asdict(settings_from(args)),
+        "startup": startup,
+        "runs": runs,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="后端负载测试")
+    parser.add_argument("--provider", choices=sorted(API_KEYS), default="openai")
+    parser.add_argument("--model", default="mock-gpt")
+    parser.add_argument("--modes", type=lambda v: v.split(","), default=["chat", "stream"],
+                        help="逗号分隔：chat,stream")
+    parser.add_argument("--concurrency", type=lambda v: [int(x) for x in v.split(",")], default=[1, 16, 64],
+                        help="逗号分隔的并发级别")
+    parser.add_argument("--stream-format", choices=("delta", "full"), default="delta",
+                        help="流式帧格式（full 格式不返回用量，token/秒 为 0）")
+    parser.add_argument("--requests", type=int, default=300, help="每个并发级别的请求数")
+    parser.add_argument("--warmup", type=int, default=5, help="每个级别正式测量前的预热请求数")
+    parser.add_argument("--backend", help="使用已运行的后端（如 http://127.0.0.1:8000），不自动启动")
+    parser.add_argument("--backend-pid", type=int, help="已运行后端的进程号，用于测量 CPU 和内存")
+    parser.add_argument("--backend-env", action="append", default=[], help="自动启动后端时的环境变量 KEY=VALUE")
+    parser.add_argument("--upstream-port", type=int, help="模拟上游端口，默认随机")
+    add_arguments(parser)
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    parser.add_argument("--compare", help="与之前保存的 JSON 结果对比")
+    arguments = parser.parse_args()
+    output = asyncio.run(main(arguments))
+    if arguments.json:
+        with open(arguments.json, "w", encoding="utf-8") as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+    if arguments.compare:
+        compare(output["runs"], arguments.compare)
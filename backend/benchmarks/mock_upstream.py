@@ -0,0 +1,223 @@
+"""本地模拟上游：OpenAI /v1/chat/completions、Anthropic /v1/messages 和 /v1/models
+
+回复内容由种子确定，节奏可调：
+    --ttft          首个 token 前的等待（秒）
+    --rate          每秒 token 数，0 表示不等待（只测后端自身开销）
+    --tokens        每个回复的 token 数
+    --chunk-size    每个流式事件携带的 token 数
+    --error-rate    按比例直接返回 --error-status（默认 500，429 时带 Retry-After）
+    --abort-rate    按比例在流的中途断开连接
+GET /stats 返回请求数、错误数和已发出的 token 数，POST /stats/reset 清零。
+
+单独运行：
+    cd backend
+    python benchmarks/mock_upstream.py --port 9100 --ttft 0.2 --rate 50
+然后把提供商的 base_url 配置为 http://127.0.0.1:9100/v1（Anthropic 为 http://127.0.0.1:9100）。
+load_test.py 会自动在子进程中启动它。
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from dataclasses import asdict, dataclass
+from typing import AsyncIterator, List
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = ["the", " quick", " brown", " fox", "，", "你好", "世界", " jumps", " over", "\n", " lazy", " dog", "。"]
+
+
+@dataclass
+class MockSettings:
+    """回复节奏和错误注入"""
+    ttft: float = 0.0
+    rate: float = 0.0
+    tokens: int = 200
+    chunk_size: int = 1
+    error_rate: float = 0.0
+    error_status: int = 500
+    abort_rate: float = 0.0
+    seed: int = 1
+
+
+class MockUpstream:
+    """模拟上游应用，统计数据保存在进程内"""
+
+    def __init__(self, settings: MockSettings):
+        self.settings = settings
+        self.rng = random.Random(settings.seed)
+        self.stats = {"requests": 0, "streams": 0, "errors": 0, "aborted": 0, "tokens": 0}
+        self.app = FastAPI()
+        self.app.post("/v1/chat/completions")(self.openai_chat)
+        self.app.post("/v1/messages")(self.anthropic_messages)
+        self.app.get("/v1/models")(self.models)
+        self.app.get("/stats")(self.get_stats)
+        self.app.post("/stats/reset")(self.reset_stats)
+
+    # ---- 公共部分 ----
+
+    def reply_tokens(self) -> List[str]:
+        return [self.rng.choice(WORDS) for _ in range(self.settings.tokens)]
+
+    def injected_error(self):
+        """按 error_rate 返回错误响应，否则返回 None"""
+        if self.settings.error_rate and self.rng.random() < self.settings.error_rate:
+            self.stats["errors"] += 1
+            headers = {"Retry-After": "1"} if self.settings.error_status == 429 else None
+            return JSONResponse({"error": {"message": "injected error", "type": "mock_error"}},
+                                status_code=self.settings.error_status, headers=headers)
+        return None
+
+    async def paced(self, tokens: List[str]) -> AsyncIterator[str]:
+        """按 ttft/rate 节奏产出每个事件的文本，按 abort_rate 中途断开"""
+        settings = self.settings
+        abort_at = -1
+        if settings.abort_rate and self.rng.random() < settings.abort_rate:
+            abort_at = self.rng.randrange(max(1, len(tokens)))
+        if settings.ttft:
+            await asyncio.sleep(settings.ttft)
+        size = max(1, settings.chunk_size)
+        for start in range(0, len(tokens), size):
+            if 0 <= abort_at <= start:
+                self.stats["aborted"] += 1
+                raise ConnectionAbortedError("injected abort")
+            if start and settings.rate:
+                await asyncio.sleep(size / settings.rate)
+            self.stats["tokens"] += min(size, len(tokens) - start)
+            yield "".join(tokens[start:start + size])
+
+    async def complete_after_delay(self, tokens: List[str]) -> str:
+        settings = self.settings
+        delay = settings.ttft + (len(tokens) / settings.rate if settings.rate else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        self.stats["tokens"] += len(tokens)
+        return "".join(tokens)
+
+    # ---- OpenAI ----
+
+    async def openai_chat(self, request: Request):
+        body = await request.json()
+        self.stats["requests"] += 1
+        error = self.injected_error()
+        if error is not None:
+            return error
+        tokens = self.reply_tokens()
+        model = body.get("model", "mock-model")
+        usage = {"prompt_tokens": 20, "completion_tokens": len(tokens), "total_tokens": len(tokens) + 20}
+        if not body.get("stream"):
+            content = await self.complete_after_delay(tokens)
+            return {"id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()),
+                    "model": model, "usage": usage,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                 "finish_reason": "stop"}]}
+
+        self.stats["streams"] += 1
+        base = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+        # 与 OpenAI 一致：只有请求了 stream_options.include_usage 才在最后单独发一帧用量
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+        async def generate():
+            async for text in self.paced(tokens):
+                chunk = {**base, "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            final = {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            yield f"data: {json.dumps(final)}\n\n"
+            if include_usage:
+                yield f"data: {json.dumps({**base, 'choices': [], 'usage': usage})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    # ---- Anthropic ----
+
+    async def anthropic_messages(self, request: Request):
+        body = await request.json()
+        self.stats["requests"] += 1
+        error = self.injected_error()
+        if error is not None:
+            return error
+        tokens = self.reply_tokens()
+        model = body.get("model", "mock-model")
+        if not body.get("stream"):
+            content = await self.complete_after_delay(tokens)
+            return {"id": "msg_mock", "type": "message", "role": "assistant", "model": model,
+                    "content": [{"type": "text", "text": content}], "stop_reason": "end_turn",
+                    "usage": {"input_tokens": 20, "output_tokens": len(tokens)}}
+
+        self.stats["streams"] += 1
+
+        def event(name: str, data: dict) -> str:
+            return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+        async def generate():
+            yield event("message_start", {"type": "message_start", "message": {
+                "id": "msg_mock", "type": "message", "role": "assistant", "model": model, "content": [],
+                "usage": {"input_tokens": 20, "output_tokens": 1}}})
+            yield event("content_block_start", {"type": "content_block_start", "index": 0,
+                                                "content_block": {"type": "text", "text": ""}})
+            async for text in self.paced(tokens):
+                yield event("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                    "delta": {"type": "text_delta", "text": text}})
+            yield event("content_block_stop", {"type": "content_block_stop", "index": 0})
+            yield event("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                                          "usage": {"output_tokens": len(tokens)}})
+            yield event("message_stop", {"type": "message_stop"})
+
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    # ---- 其他 ----
+
+    async def models(self):
+        return {"object": "list", "data": [
+            {"id": name, "object": "model", "created": 1718000000, "owned_by": "mock"}
+            for name in ("mock-gpt", "mock-claude", "mock-embedding")
+        ]}
+
+    async def get_stats(self):
+        return {**self.stats, "settings": asdict(self.settings)}
+
+    async def reset_stats(self):
+        for key in self.stats:
+            self.stats[key] = 0
+        return self.stats
+
+
+class _HideInjectedAborts(logging.Filter):
+    """注入的中途断开是预期行为，不打印异常堆栈"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return not (record.exc_info and isinstance(record.exc_info[1], ConnectionAbortedError))
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = MockSettings()
+    parser.add_argument("--ttft", type=float, default=defaults.ttft, help="首个 token 前的等待（秒）")
+    parser.add_argument("--rate", type=float, default=defaults.rate, help="每秒 token 数，0 表示不等待")
+    parser.add_argument("--tokens", type=int, default=defaults.tokens, help="每个回复的 token 数")
+    parser.add_argument("--chunk-size", type=int, default=defaults.chunk_size, help="每个流式事件的 token 数")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="直接返回错误的比例")
+    parser.add_argument("--error-status", type=int, default=defaults.error_status, help="注入错误的状态码")
+    parser.add_argument("--abort-rate", type=float, default=defaults.abort_rate, help="流中途断开的比例")
+    parser.add_argument("--seed", type=int, default=defaults.seed, help="回复内容的随机种子")
+
+
+def settings_from(args: argparse.Namespace) -> MockSettings:
+    return MockSettings(ttft=args.ttft, rate=args.rate, tokens=args.tokens, chunk_size=args.chunk_size,
+                        error_rate=args.error_rate, error_status=args.error_status,
+                        abort_rate=args.abort_rate, seed=args.seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地模拟上游")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    add_arguments(parser)
+    arguments = parser.parse_args()
+    upstream = MockUpstream(settings_from(arguments))
+    logging.getLogger("uvicorn.error").addFilter(_HideInjectedAborts())
+    uvicorn.run(upstream.app, host=arguments.host, port=arguments.port, log_level="warning", access_log=False)
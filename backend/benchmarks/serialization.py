@@ -0,0 +1,174 @@
+"""出站序列化微基准
+
+两部分：
+    frame      每个 SSE 帧的编码开销
+               before  旧实现：f"data: {json.dumps(...)}\n\n"，再由 StreamingResponse 逐帧 encode
+               after   services/sse.encode_frame：字节常量拼接 + 当前 JSON 后端直接产出字节
+               full 格式的 full_content 随回答增长，所以同时测 full 和 delta 两种帧
+    response   非流式响应（ChatResponse / ModelsResponse）的序列化
+               before  FastAPI response_model 路径：再校验一次 + jsonable_encoder + json.dumps
+               after   FastJSONResponse：pydantic-core 直接输出字节
+after 会对每个已安装的后端（json / orjson / msgspec）各测一次。
+
+用法：
+    cd backend
+    python benchmarks/serialization.py
+    python benchmarks/serialization.py --tokens 2000 --rounds 5 --json result.json
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import APIRoute, serialize_response  # noqa: E402
+
+import services.sse as sse  # noqa: E402
+from main import ChatMessage, ChatResponse, ModelInfo, ModelsResponse  # noqa: E402
+from services.serialization import FastJSONResponse, select_backend  # noqa: E402
+
+WORDS = ["the", " quick", " brown", " fox", "，", "你好", "世界", " jumps", " over", "\n", " lazy", " dog", "。"]
+
+
+def content_chunks(tokens: int) -> list:
+    rng = random.Random(1)
+    return [rng.choice(WORDS) for _ in range(tokens)]
+
+
+def frames_full(chunks: list) -> list:
+    text = ""
+    payloads = []
+    for content in chunks:
+        text += content
+        payloads.append({"type": "content", "content": content, "full_content": text})
+    return payloads
+
+
+def frames_delta(chunks: list) -> list:
+    return [{"type": "content", "content": content} for content in chunks]
+
+
+def encode_before(payloads: list) -> int:
+    size = 0
+    for payload in payloads:
+        size += len(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+    return size
+
+
+def encode_after(payloads: list) -> int:
+    encode_frame = sse.encode_frame
+    size = 0
+    for payload in payloads:
+        size += len(encode_frame(payload))
+    return size
+
+
+def best_of(func, rounds: int) -> float:
+    func()  # 预热
+    best = float("inf")
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def installed_backends() -> list:
+    names = ["json"] + [name for name in ("orjson", "msgspec") if importlib.util.find_spec(name)]
+    return [select_backend(name) for name in names]
+
+
+def bench_frames(args) -> list:
+    chunks = content_chunks(args.tokens)
+    results = []
+    for stream_format, payloads in (("full", frames_full(chunks)), ("delta", frames_delta(chunks))):
+        variants = [("before", encode_before, None)]
+        variants += [(f"after/{name}", encode_after, dumps) for name, dumps, _ in installed_backends()]
+        for label, func, dumps in variants:
+            if dumps is not None:
+                # 替换 sse 模块里的 dumps，测量该后端下的 encode_frame
+                sse.dumps = dumps
+            seconds = best_of(lambda: func(payloads), args.rounds)
+            result = {
+                "part": "frame",
+                "format": stream_format,
+                "variant": label,
+                "frames": len(payloads),
+                "ns_per_frame": round(seconds / len(payloads) * 1e9),
+            }
+            results.append(result)
+            print(f"frame    {stream_format:>5} {label:>14} {result['ns_per_frame']:>8} ns/frame")
+    return results
+
+
+def sample_responses(tokens: int) -> list:
+    text = "".join(content_chunks(tokens))
+    chat = ChatResponse(
+        message=ChatMessage(role="assistant", content=text),
+        usage={"prompt_tokens": 20, "completion_tokens": tokens, "total_tokens": tokens + 20},
+    )
+    models = ModelsResponse(data=[
+        ModelInfo(id=f"model-{index}", created=1718000000 + index, owned_by="provider",
+                  description=f"示例模型 {index}")
+        for index in range(200)
+    ])
+    return [("chat", ChatResponse, chat), ("models", ModelsResponse, models)]
+
+
+def bench_responses(args) -> list:
+    results = []
+    for name, model, content in sample_responses(args.tokens):
+        field = APIRoute("/bench", lambda: None, response_model=model).response_field
+
+        def before():
+            for _ in range(args.repeat):
+                # serialize_response 内部已做 jsonable_encoder，JSONResponse 再 json.dumps
+                JSONResponse(_serialize(field, content))
+
+        def after():
+            for _ in range(args.repeat):
+                FastJSONResponse(content)
+
+        for label, func in (("before", before), ("after", after)):
+            seconds = best_of(func, args.rounds)
+            result = {
+                "part": "response",
+                "model": name,
+                "variant": label,
+                "us_per_response": round(seconds / args.repeat * 1e6, 1),
+            }
+            results.append(result)
+            print(f"response {name:>6} {label:>14} {result['us_per_response']:>8} us/response")
+    return results
+
+
+def _serialize(field, content):
+    """同步执行 FastAPI 的 serialize_response（其中没有真正的 await）"""
+    coroutine = serialize_response(field=field, response_content=content)
+    try:
+        coroutine.send(None)
+    except StopIteration as done:
+        return done.value
+    raise RuntimeError("serialize_response 意外挂起")
+
+
+def main(args) -> list:
+    return bench_frames(args) + bench_responses(args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="出站序列化微基准")
+    parser.add_argument("--tokens", type=int, default=2000, help="每个回答的 token 帧数")
+    parser.add_argument("--rounds", type=int, default=5, help="重复次数，取最快一次")
+    parser.add_argument("--repeat", type=int, default=200, help="每轮序列化响应的次数")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    arguments = parser.parse_args()
+    output = main(arguments)
+    if arguments.json:
+        with open(arguments.json, "w", encoding="utf-8") as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,158 @@
+"""上游 SSE 解析微基准
+
+按 OpenAI 和 Anthropic 的真实流格式生成录制样本（OpenAI 每个 token 一行
+data；Anthropic 带 event 行、ping 和 message_start/delta/stop），切成网络
+大小的随机字节块，分别用两种方式解析并解出 JSON：
+    lines   旧实现：response.aiter_lines() + startswith("data: ") + json.loads
+    bytes   services/sse_parser：aiter_bytes() 增量解码，data 以字节交给 JSON 解码器
+输出 MB/s 和事件/秒。安装 orjson 或 msgspec 后 bytes 一栏会自动使用（JSON_BACKEND 可指定）。
+
+用法：
+    cd backend
+    python benchmarks/sse_parse.py
+    python benchmarks/sse_parse.py --tokens 20000 --rounds 5 --json result.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services.serialization import BACKEND  # noqa: E402
+from services.sse_parser import aiter_sse  # noqa: E402
+
+WORDS = ["the", " quick", " brown", " fox", "，", "你好", "世界", " jumps", " over", "\n", " lazy", " dog", "。"]
+
+
+def openai_stream(tokens: int) -> bytes:
+    rng = random.Random(1)
+    parts = []
+    base = {"id": "chatcmpl-9x8y7z", "object": "chat.completion.chunk", "created": 1718000000,
+            "model": "gpt-4o-2024-05-13", "system_fingerprint": "fp_abc123"}
+    parts.append({**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""},
+                                       "logprobs": None, "finish_reason": None}]})
+    for _ in range(tokens):
+        parts.append({**base, "choices": [{"index": 0, "delta": {"content": rng.choice(WORDS)},
+                                           "logprobs": None, "finish_reason": None}]})
+    parts.append({**base, "choices": [{"index": 0, "delta": {}, "logprobs": None, "finish_reason": "stop"}],
+                  "usage": {"prompt_tokens": 20, "completion_tokens": tokens, "total_tokens": tokens + 20}})
+    body = "".join(f"data: {json.dumps(p, ensure_ascii=False)}\n\n" for p in parts)
+    return (body + "data: [DONE]\n\n").encode()
+
+
+def anthropic_stream(tokens: int) -> bytes:
+    rng = random.Random(2)
+    events = [("message_start", {"type": "message_start", "message": {
+        "id": "msg_01XYZ", "type": "message", "role": "assistant", "content": [],
+        "model": "claude-3-5-sonnet-20240620", "stop_reason": None, "stop_sequence": None,
+        "usage": {"input_tokens": 25, "output_tokens": 1}}}),
+        ("content_block_start", {"type": "content_block_start", "index": 0,
+                                 "content_block": {"type": "text", "text": ""}}),
+        ("ping", {"type": "ping"})]
+    for index in range(tokens):
+        events.append(("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                               "delta": {"type": "text_delta", "text": rng.choice(WORDS)}}))
+        if index % 500 == 499:
+            events.append(("ping", {"type": "ping"}))
+    events += [("content_block_stop", {"type": "content_block_stop", "index": 0}),
+               ("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                                  "usage": {"output_tokens": tokens}}),
+               ("message_stop", {"type": "message_stop"})]
+    body = "".join(f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n" for name, data in events)
+    return body.encode()
+
+
+class RecordedStream(httpx.AsyncByteStream):
+    """把录制的流按随机大小（16B~4KB，近似网络读）切块回放"""
+
+    def __init__(self, body: bytes, seed: int):
+        rng = random.Random(seed)
+        self.chunks = []
+        offset = 0
+        while offset < len(body):
+            size = rng.choice((16, 64, 256, 1024, 1400, 2800, 4096))
+            self.chunks.append(body[offset:offset + size])
+            offset += size
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def response_for(body: bytes) -> httpx.Response:
+    return httpx.Response(200, headers={"content-type": "text/event-stream"}, stream=RecordedStream(body, 7))
+
+
+async def parse_lines(body: bytes) -> int:
+    events = 0
+    async for line in response_for(body).aiter_lines():
+        if line.startswith("data: "):
+            data_str = line[6:]
+            if data_str.strip() == "[DONE]":
+                break
+            try:
+                json.loads(data_str)
+            except json.JSONDecodeError:
+                continue
+            events += 1
+    return events
+
+
+async def parse_bytes(body: bytes) -> int:
+    events = 0
+    async for sse in aiter_sse(response_for(body)):
+        if sse.event == "ping":
+            continue
+        if sse.data.strip() == b"[DONE]":
+            break
+        sse.json()
+        events += 1
+    return events
+
+
+async def measure(name: str, parser, body: bytes, rounds: int) -> dict:
+    await parser(body)  # 预热
+    best = float("inf")
+    events = 0
+    for _ in range(rounds):
+        started = time.perf_counter()
+        events = await parser(body)
+        best = min(best, time.perf_counter() - started)
+    return {
+        "parser": name,
+        "bytes": len(body),
+        "events": events,
+        "seconds": round(best, 4),
+        "mb_per_second": round(len(body) / best / 1e6, 1),
+        "events_per_second": round(events / best),
+    }
+
+
+async def main(args) -> list:
+    print(f"JSON 解码器: {BACKEND}")
+    results = []
+    for stream_name, body in (("openai", openai_stream(args.tokens)), ("anthropic", anthropic_stream(args.tokens))):
+        for parser_name, parser in (("lines", parse_lines), ("bytes", parse_bytes)):
+            result = {"stream": stream_name, **await measure(parser_name, parser, body, args.rounds)}
+            results.append(result)
+            print(f"{stream_name:>9} {parser_name:>5} {result['bytes'] / 1e6:6.2f} MB "
+                  f"{result['mb_per_second']:>7} MB/s {result['events_per_second']:>9} events/s")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="上游 SSE 解析微基准")
+    parser.add_argument("--tokens", type=int, default=20000, help="每个录制流的 token 事件数")
+    parser.add_argument("--rounds", type=int, default=5, help="重复次数，取最快一次")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    arguments = parser.parse_args()
+    output = asyncio.run(main(arguments))
+    if arguments.json:
+        with open(arguments.json, "w", encoding="utf-8") as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
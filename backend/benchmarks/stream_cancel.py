@@ -0,0 +1,165 @@
+"""客户端断开后上游取消的检查
+
+启动一个慢速的本地 OpenAI 兼容上游（每个 token 间隔 --gap 秒）和后端，
+客户端读到几帧后断开，检查上游连接多久后被关闭、断开后上游又多生成了多少
+token，并确认 chat_stream_cancellations_total 计数和部分回复的保存。
+
+分别在两种 ASGI 语义下运行：
+    asgi-2.3   uvicorn 当前的行为，Starlette 自己监听断开
+    asgi-2.4   Starlette 依赖 send 抛错（uvicorn 向断开的连接 send 时不报错），
+               只能靠 services/disconnect.py 的断开检测
+任一场景上游没有在 --limit 秒内关闭时以非零状态退出。
+
+用法：
+    cd backend
+    python benchmarks/stream_cancel.py
+    python benchmarks/stream_cancel.py --gap 0.02 --limit 0.5 --json result.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# 会话写到临时库，并开启部分回复保存
+os.environ["CONVERSATION_DB"] = os.path.join(tempfile.mkdtemp(), "conversations.sqlite3")
+os.environ["CONVERSATION_SAVE_PARTIAL"] = "true"
+
+import main  # noqa: E402
+from services import metrics  # noqa: E402
+
+
+class SlowUpstream:
+    """逐个 token 慢速输出的 OpenAI 兼容上游，记录发出的 token 数和关闭时间"""
+
+    def __init__(self, gap: float, tokens: int = 1000):
+        self.gap = gap
+        self.tokens = tokens
+        self.sent = 0
+        self.closed_at = None
+        self.app = FastAPI()
+        self.app.post("/v1/chat/completions")(self.completions)
+
+    async def completions(self):
+        self.sent = 0
+        self.closed_at = None
+
+        async def generate():
+            try:
+                for index in range(self.tokens):
+                    chunk = {"choices": [{"index": 0, "delta": {"content": f"t{index} "}}]}
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    self.sent += 1
+                    await asyncio.sleep(self.gap)
+                yield "data: [DONE]\n\n"
+            finally:
+                self.closed_at = time.perf_counter()
+
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+
+class ForceSpec24:
+    """把 scope 的 ASGI spec_version 改成 2.4，模拟不再监听断开的 Starlette 行为"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            scope = {**scope, "asgi": {**scope.get("asgi", {}), "spec_version": "2.4"}}
+        await self.app(scope, receive, send)
+
+
+async def serve(app) -> tuple:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning", lifespan="off"))
+    task = asyncio.ensure_future(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, task, f"http://127.0.0.1:{port}"
+
+
+def cancellations() -> float:
+    return sum(metrics.stream_cancellations.values.values())
+
+
+async def scenario(name: str, app, upstream: SlowUpstream, args) -> dict:
+    server, task, base_url = await serve(app)
+    api_config = {"api_key": "sk-local", "base_url": f"{args.upstream}/v1", "model": "slow"}
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+            conversation = (await client.post("/api/conversations")).json()["id"]
+            before = cancellations()
+            body = {"messages": [{"role": "user", "content": "hi"}], "provider": "custom",
+                    "api_config": api_config, "conversation_id": conversation}
+            frames = 0
+            async with client.stream("POST", "/api/chat/stream", json=body) as response:
+                async for line in response.aiter_lines():
+                    if line.startswith("data: ") and '"content"' in line:
+                        frames += 1
+                        if frames >= args.frames:
+                            break
+            disconnected = time.perf_counter()
+            sent_at_disconnect = upstream.sent
+            deadline = disconnected + args.limit
+            while upstream.closed_at is None and time.perf_counter() < deadline:
+                await asyncio.sleep(0.005)
+            await asyncio.sleep(0.1)  # 等部分回复在后台写完
+            history = (await client.get(f"/api/conversations/{conversation}")).json()
+    finally:
+        server.should_exit = True
+        await task
+
+    closed = upstream.closed_at
+    saved = [m for m in history.get("messages", []) if m["role"] == "assistant"]
+    result = {
+        "scenario": name,
+        "frames_read": frames,
+        "upstream_closed": closed is not None,
+        "close_latency_ms": round((closed - disconnected) * 1000, 1) if closed else None,
+        "tokens_after_disconnect": upstream.sent - sent_at_disconnect,
+        "cancellations_recorded": cancellations() - before,
+        "partial_reply_chars": len(saved[0]["content"]) if saved else 0,
+    }
+    print(f"{name:>9} closed={result['upstream_closed']!s:5} latency={result['close_latency_ms']} ms "
+          f"extra_tokens={result['tokens_after_disconnect']} cancellations={result['cancellations_recorded']:g} "
+          f"partial_chars={result['partial_reply_chars']}")
+    return result
+
+
+async def run(args) -> list:
+    upstream = SlowUpstream(args.gap)
+    upstream_server, upstream_task, args.upstream = await serve(upstream.app)
+    try:
+        async with main.app.router.lifespan_context(main.app):
+            return [
+                await scenario("asgi-2.3", main.app, upstream, args),
+                await scenario("asgi-2.4", ForceSpec24(main.app), upstream, args),
+            ]
+    finally:
+        upstream_server.should_exit = True
+        await upstream_task
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="客户端断开后上游取消的检查")
+    parser.add_argument("--gap", type=float, default=0.05, help="上游 token 间隔（秒）")
+    parser.add_argument("--frames", type=int, default=5, help="客户端读到多少个内容帧后断开")
+    parser.add_argument("--limit", type=float, default=1.0, help="断开后上游必须在多少秒内关闭")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    arguments = parser.parse_args()
+    output = asyncio.run(run(arguments))
+    if arguments.json:
+        with open(arguments.json, "w", encoding="utf-8") as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+    if not all(item["upstream_closed"] for item in output):
+        sys.exit(1)
@@ -1,22 +1,84 @@
-from fastapi import FastAPI, HTTPException
+# 最先导入：启动耗时从这里开始计
+from services.server import run_server, startup
+
+from fastapi import FastAPI, HTTPException, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError, model_validator
 from typing import Optional, List, AsyncGenerator
+from datetime import datetime
+from contextlib import asynccontextmanager
 import os
 from dotenv import load_dotenv
 import httpx
 import asyncio
-import json
 import logging
+import time
 
 # 加载环境变量
 load_dotenv()
 
+from services.log import setup_logging
+
+# 配置日志（队列 + 后台写出线程，见 services/log.py）
+setup_logging()
+logger = logging.getLogger(__name__)
+
+from services import metrics
+from services.admission import AdmissionRejected, Ticket, admission_controller, used_tokens
+from services.balancer import EndpointPool, InvalidEndpoints, NoEndpointAvailable, load_balancer, send_via
+from services.batch import batch_registry, jsonl_lines, spool_upload
+from services.coalescing import request_coalescer
+from services.demo import DemoFailure, DemoOptions, DemoReply
+from services.delta_batch import batch_deltas, delta_batch_settings
+from services.diagnostics import connection_diagnostics
+from services.disconnect import cancel_on_disconnect
+from services.config_store import config_store
+from services.context import context_assembler, get_tokenizer
+from services.conversations import conversation_store
+from services.history import SORTS, history_index
+from services.http_clients import http_clients
+from services.model_catalog import key_fingerprint, model_catalog
+from services.providers import ProviderAdapter, get_adapter
+from services.resilience import STREAM_RETRYABLE_ERRORS, RetryState, upstream_resilience
+from services.response_cache import replay_chunks, request_cache_key, response_cache
+from services.serialization import FastJSONResponse, dumps
+from services.sse import DONE_FRAME, create_stream_encoder, encode_frame, negotiate_stream_format
+from services.sse_parser import aiter_sse
+
+startup.mark("imports")
+
+# /metrics 抓取时刷新连接池仪表
+metrics.registry.add_collector(metrics.collect_pool_stats(http_clients.stats))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时预先打开本地数据库，关闭时释放共享的上游连接池"""
+    startup.mark("server")
+    stores = (("config", config_store), ("conversations", conversation_store), ("response_cache", response_cache),
+              ("history", history_index))
+    for name, store in stores:
+        try:
+            await store.open()
+        except Exception as e:
+            # 数据目录不可写等情况只影响对应功能，不阻止聊天
+            logger.warning("打开 %s 数据库失败: %s", name, e)
+    startup.mark("warmup")
+    startup.finish()
+    yield
+    startup.ready = False
+    await history_index.aclose()
+    await http_clients.aclose()
+    response_cache.close()
+    conversation_store.close()
+    config_store.close()
+
 app = FastAPI(
     title="AI Chat API",
     description="AI聊天桌面应用后端API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
 # 配置CORS
@@ -43,16 +105,41 @@ class ChatRequest(BaseModel):
     max_tokens: int = 2048
     stream: bool = False
     api_config: Optional[dict] = None
+    cache: Optional[bool] = None  # 是否使用响应缓存，None 表示按温度阈值自动决定
+    conversation_id: Optional[str] = None  # 设置后 messages 只需包含新的一轮，历史由服务端补全
+    context_window: Optional[int] = None  # 覆盖模型的上下文窗口（token），None 表示按模型名推断
 
 class ChatResponse(BaseModel):
     message: ChatMessage
     usage: Optional[dict] = None
+    context: Optional[dict] = None  # 上下文裁剪报告
+
+class ConversationCreate(BaseModel):
+    title: str = ""
+
+class EndpointConfig(BaseModel):
+    base_url: str
+    api_key: str
+    weight: float = 1.0
 
 class APIConfig(BaseModel):
     provider: str
-    api_key: str
-    base_url: str
+    api_key: str = ""
+    base_url: str = ""
     model: str
+    # 多个端点/密钥时按 balancer 策略（least_in_flight / ewma）分摊请求，见 services/balancer.py
+    endpoints: Optional[List[EndpointConfig]] = None
+    balancer: Optional[str] = None
+    # 演示模式的回复参数（种子、长度、速度等），见 services/demo.py
+    demo: Optional[dict] = None
+
+    @model_validator(mode="after")
+    def _fill_primary_endpoint(self):
+        # 只配置了端点池时，用第一个端点作为密钥校验、模型列表等单端点场景的默认值
+        if self.endpoints:
+            self.api_key = self.api_key or self.endpoints[0].api_key
+            self.base_url = self.base_url or self.endpoints[0].base_url
+        return self
 
 class ModelInfo(BaseModel):
     id: str
@@ -66,9 +153,6 @@ class ModelsResponse(BaseModel):
     object: str = "list"
     data: List[ModelInfo]
 
-# API配置存储（生产环境中应该使用数据库）
-api_configs = {}
-
 @app.get("/")
 async def root():
     """根路径，返回API信息"""
@@ -80,8 +164,24 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """健康检查端点"""
-    return {"status": "healthy", "timestamp": "2025-08-23T19:30:00Z"}
+    """健康检查端点（进程存活）"""
+    return {"status": "healthy", "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+
+@app.get("/ready")
+async def readiness_check():
+    """就绪检查：启动完成前和关闭过程中返回 503，附带各启动阶段耗时"""
+    stats = startup.stats()
+    return FastJSONResponse(stats, status_code=200 if stats["ready"] else 503)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus 文本格式的运行指标"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/upstream/pools")
+async def upstream_pools():
+    """上游连接池状态"""
+    return http_clients.stats()
 
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
@@ -89,118 +189,439 @@ async def chat(request: ChatRequest):
     if request.stream:
         raise HTTPException(status_code=400, detail="请使用 /api/chat/stream 端点进行流式请求")
     
-    # 原有的非流式处理逻辑
-    return await _process_chat_request(request)
+    # 响应在构造时已经校验过，直接序列化，跳过 response_model 的二次校验
+    return FastJSONResponse(await _complete_chat(request))
+
+async def _complete_chat(request: ChatRequest) -> ChatResponse:
+    """非流式聊天：补全会话历史、裁剪上下文、经缓存层调用上游"""
+    turn = request.messages
+    if request.conversation_id:
+        request = await _with_conversation_history(request)
+    request, report = _fit_context(request)
+    
+    try:
+        response = await _cached_chat_request(request)
+    except BaseException:
+        # 失败或取消时也保存用户消息，和客户端显示的对话保持一致
+        if request.conversation_id:
+            _run_in_background(_save_conversation_turn(request, turn, None))
+        raise
+    if request.conversation_id:
+        await _save_conversation_turn(request, turn, response.message.content)
+    _record_history(request, turn, response.message.content)
+    # 合并的请求共享同一个响应对象，复制后再附加报告
+    return response.model_copy(update={"context": report})
+
+@app.post("/api/chat/batch")
+async def chat_batch(
+    http_request: Request,
+    concurrency: Optional[int] = Query(None, ge=1, description="每个提供商的并发数")
+):
+    """批量聊天请求
+    
+    请求体为 JSON（{"requests": [...], "concurrency": n} 或数组），或 JSONL
+    （Content-Type: application/x-ndjson，每行一个 ChatRequest）。结果以 NDJSON
+    按完成顺序返回，每行带原始序号；单条失败不影响其他条目，最后一行为汇总。
+    """
+    content_type = http_request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonl" in content_type:
+        spool = await spool_upload(http_request.stream())
+        items = _parsed_batch_items(jsonl_lines(spool), ChatRequest.model_validate_json)
+    else:
+        try:
+            body = await http_request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="请求体不是有效的JSON")
+        entries = body.get("requests") if isinstance(body, dict) else body
+        if not isinstance(entries, list):
+            raise HTTPException(status_code=400, detail="请求体应为 ChatRequest 数组或包含 requests 字段的对象")
+        if isinstance(body, dict) and concurrency is None:
+            concurrency = body.get("concurrency")
+            # 和查询参数一样要求正整数
+            if concurrency is not None and (type(concurrency) is not int or concurrency < 1):
+                raise HTTPException(status_code=400, detail="concurrency 应为正整数")
+        items = _parsed_batch_items(enumerate(entries), ChatRequest.model_validate)
+    
+    run = batch_registry.create(concurrency)
+    
+    async def generate_results():
+        try:
+            yield dumps({"type": "start", "batch_id": run.id, "concurrency": run.concurrency}) + b"\n"
+            async for line in run.run(items, _batch_provider, _batch_item):
+                yield dumps(line) + b"\n"
+        finally:
+            batch_registry.finish(run)
+    
+    return StreamingResponse(
+        cancel_on_disconnect(generate_results(), http_request.is_disconnected),
+        media_type="application/x-ndjson",
+        headers={"X-Batch-Id": run.id, "Access-Control-Expose-Headers": "X-Batch-Id"}
+    )
+
+async def _parsed_batch_items(entries, parse) -> AsyncGenerator[tuple, None]:
+    """逐条校验批量输入；校验失败的条目作为错误结果返回，不中断批次"""
+    for index, entry in entries:
+        try:
+            yield index, parse(entry)
+        except ValidationError as e:
+            yield index, e
+
+def _batch_provider(item) -> str:
+    return item.provider if isinstance(item, ChatRequest) else ""
+
+async def _batch_item(index: int, item) -> dict:
+    """执行批次中的一条请求"""
+    if isinstance(item, ValidationError):
+        return {"type": "result", "index": index, "status": "error", "status_code": 422,
+                "error": item.errors(include_url=False, include_input=False, include_context=False)}
+    try:
+        # 批量请求总是非流式
+        response = await _complete_chat(item.model_copy(update={"stream": False}))
+    except HTTPException as e:
+        return {"type": "result", "index": index, "status": "error", "status_code": e.status_code, "error": e.detail}
+    except Exception as e:
+        logger.exception("批量请求第 %d 条失败: %s", index, e)
+        return {"type": "result", "index": index, "status": "error", "status_code": 500, "error": str(e)}
+    return {"type": "result", "index": index, "status": "ok", "response": response.model_dump()}
+
+@app.get("/api/chat/batch")
+async def list_batches():
+    """正在执行的批次及其进度"""
+    return {"batches": batch_registry.stats()}
+
+@app.delete("/api/chat/batch/{batch_id}")
+async def cancel_batch(batch_id: str):
+    """取消整个批次：停止读取输入并取消在途条目，结果流以汇总行结束"""
+    run = batch_registry.get(batch_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="批次不存在或已结束")
+    run.cancel()
+    return {"message": "批次已取消", "batch_id": batch_id}
+
+async def _cached_chat_request(request: ChatRequest) -> ChatResponse:
+    """非流式请求的缓存层"""
+    if not response_cache.enabled_for(request):
+        return await _coalesced_chat_request(request)
+    
+    # 确定性请求先查响应缓存
+    config = get_api_config(request.provider, request.api_config)
+    cache_key = request_cache_key(request, config)
+    cached = await response_cache.get(cache_key)
+    if cached is not None:
+        return ChatResponse(
+            message=ChatMessage(role="assistant", content=cached["content"]),
+            usage=cached.get("usage")
+        )
+    
+    response = await _coalesced_chat_request(request)
+    await response_cache.set(cache_key, {"content": response.message.content, "usage": response.usage})
+    return response
 
 @app.post("/api/chat/stream")
-async def chat_stream(request: ChatRequest):
+async def chat_stream(
+    request: ChatRequest,
+    http_request: Request,
+    stream_format_param: Optional[str] = Query(None, alias="format", description="帧格式: full（默认）或 delta"),
+    checkpoint: int = Query(0, ge=0, description="delta格式下每N帧发送一次完整文本"),
+    x_stream_format: Optional[str] = Header(None)
+):
     """处理流式聊天请求"""
     if not request.stream:
         request.stream = True
     
+    if request.provider != "demo":
+        # 排队已满时在推流之前直接返回 429，客户端可以按 Retry-After 重试
+        try:
+            admission_controller.check(request.provider)
+        except AdmissionRejected as e:
+            raise _rejected(e)
+        # 端点配置有误时同样在推流之前返回 400
+        _endpoint_pool(request.provider, get_api_config(request.provider, request.api_config))
+    
+    stream_format = negotiate_stream_format(stream_format_param, x_stream_format)
+    encoder = create_stream_encoder(stream_format, checkpoint)
+    
+    turn = request.messages
+    if request.conversation_id:
+        # 在开始推流之前补全历史，会话不存在时直接返回404
+        request = await _with_conversation_history(request)
+    request, report = _fit_context(request)
+    if request.conversation_id or history_index.enabled:
+        source = _persisted_streaming_chat(request, turn)
+    else:
+        source = _cached_streaming_chat(request)
+    if delta_batch_settings.enabled:
+        # 合并相邻的小增量，减少帧数和前端渲染次数
+        source = batch_deltas(source, delta_batch_settings, request.provider)
+    
     async def generate_stream():
+        # 第一帧告知客户端上下文裁剪情况
+        yield encode_frame({"type": "context", **report})
         try:
-            async for chunk in _process_streaming_chat(request):
+            async for chunk in source:
                 if chunk:
-                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                    frame = encoder.encode(chunk)
+                    if frame:
+                        yield frame
         except Exception as e:
             error_chunk = {
                 "error": True,
                 "message": str(e)
             }
-            yield f"data: {json.dumps(error_chunk, ensure_ascii=False)}\n\n"
-        finally:
-            yield "data: [DONE]\n\n"
+            yield encode_frame(error_chunk)
+        # 客户端断开时（取消）不再输出结尾帧
+        for frame in encoder.finish():
+            yield frame
+        yield DONE_FRAME
     
     return StreamingResponse(
-        generate_stream(),
+        cancel_on_disconnect(generate_stream(), http_request.is_disconnected),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
             "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Headers": "*",
+            "Access-Control-Expose-Headers": "X-Stream-Format",
+            "X-Stream-Format": stream_format,
         }
     )
 
+def _fit_context(request: ChatRequest) -> tuple:
+    """按模型上下文窗口裁剪消息，返回 (请求, 裁剪报告)"""
+    messages, report = context_assembler.fit(
+        request.messages, request.provider, request.model, request.max_tokens, request.context_window
+    )
+    if report.dropped_messages:
+        logger.info("上下文超出窗口，丢弃 %d 条历史消息（%d tokens）",
+                    report.dropped_messages, report.dropped_tokens,
+                    extra={"model": request.model, "window": report.window})
+        request = request.model_copy(update={"messages": messages})
+    return request, report.to_dict()
+
+def _endpoint_pool(provider: str, config: dict) -> Optional[EndpointPool]:
+    """取得端点池；endpoints 格式不对时返回 400"""
+    try:
+        return load_balancer.pool_for(provider, config)
+    except InvalidEndpoints as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _estimate_tokens(request: ChatRequest) -> int:
+    """准入控制预扣的 token 数：提示词估算 + max_tokens"""
+    tokenizer = get_tokenizer(request.provider)
+    prompt = sum(tokenizer.count_message(msg.role, msg.content) for msg in request.messages)
+    return prompt + request.max_tokens
+
+def _rejected(error: AdmissionRejected) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(error),
+                         headers={"Retry-After": str(max(1, round(error.retry_after)))})
+
+async def _with_conversation_history(request: ChatRequest) -> ChatRequest:
+    """用服务端保存的历史补全请求的上下文"""
+    assert request.conversation_id is not None
+    history = await conversation_store.history(request.conversation_id)
+    if history is None:
+        raise HTTPException(status_code=404, detail="会话不存在")
+    # 历史来自数据库，无需再次校验
+    messages = [ChatMessage.model_construct(role=role, content=content) for role, content in history]
+    return request.model_copy(update={"messages": messages + list(request.messages)})
+
+async def _save_conversation_turn(request: ChatRequest, turn: List[ChatMessage], reply: Optional[str]) -> None:
+    """把本轮的用户消息和助手回复写入会话；reply 为 None（失败、取消）时只写用户消息"""
+    assert request.conversation_id is not None
+    messages = [(msg.role, msg.content) for msg in turn]
+    if reply is not None:
+        messages.append(("assistant", reply))
+    if not await conversation_store.append(request.conversation_id, messages, request.provider, request.model):
+        logger.warning("会话已被删除，丢弃本轮消息: %s", request.conversation_id)
+
+def _record_history(request: ChatRequest, turn: List[ChatMessage], reply: str) -> None:
+    """把完成的一轮问答放进历史索引的写入队列（见 services/history.py）"""
+    prompt = next((msg.content for msg in reversed(turn) if msg.role == "user"), "")
+    history_index.record(request.provider, request.model, prompt, reply, request.conversation_id)
+
+async def _persisted_streaming_chat(request: ChatRequest, turn: List[ChatMessage]) -> AsyncGenerator[dict, None]:
+    """流式请求的持久化层：保存本轮消息（失败、取消时只保存用户消息），成功时写入历史索引"""
+    parts = []
+    failed = False
+    try:
+        async for chunk in _cached_streaming_chat(request):
+            if chunk.get("error"):
+                failed = True
+            elif chunk.get("type") == "content":
+                parts.append(chunk["content"])
+            yield chunk
+    except (GeneratorExit, asyncio.CancelledError):
+        # 客户端中途断开：保存用户消息，按配置保存已生成的部分；在后台写入，不受本次取消影响
+        if request.conversation_id:
+            partial = bool(parts) and not failed and conversation_store.settings.save_partial
+            _run_in_background(_save_conversation_turn(request, turn, "".join(parts) if partial else None))
+        raise
+    
+    reply = "".join(parts) if parts and not failed else None
+    if request.conversation_id:
+        await _save_conversation_turn(request, turn, reply)
+    if reply is not None:
+        _record_history(request, turn, reply)
+
+_background_tasks: set = set()
+
+def _run_in_background(coroutine) -> None:
+    """启动后台任务并保留引用，避免任务在完成前被回收"""
+    task = asyncio.ensure_future(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def _cached_streaming_chat(request: ChatRequest) -> AsyncGenerator[dict, None]:
+    """流式请求的缓存层：命中时直接回放缓存内容，未命中时在流结束后写入缓存"""
+    if not response_cache.enabled_for(request):
+        async for chunk in _coalesced_streaming_chat(request):
+            yield chunk
+        return
+    
+    config = get_api_config(request.provider, request.api_config)
+    cache_key = request_cache_key(request, config)
+    cached = await response_cache.get(cache_key)
+    if cached is not None:
+        for chunk in replay_chunks(cached["content"]):
+            yield chunk
+        if cached.get("usage"):
+            yield {"type": "usage", "usage": cached["usage"]}
+        return
+    
+    parts = []
+    usage = None
+    failed = False
+    async for chunk in _coalesced_streaming_chat(request):
+        if chunk.get("error"):
+            failed = True
+        elif chunk.get("type") == "content":
+            parts.append(chunk["content"])
+        elif chunk.get("type") == "usage":
+            usage = chunk.get("usage")
+        yield chunk
+    
+    if parts and not failed:
+        await response_cache.set(cache_key, {"content": "".join(parts), "usage": usage})
+
+def _coalescing_key(request: ChatRequest) -> tuple:
+    """在途合并的键：请求内容哈希 + API密钥指纹（不同密钥不合并）"""
+    config = get_api_config(request.provider, request.api_config)
+    return (request_cache_key(request, config), key_fingerprint(config.get("api_key", "")))
+
+async def _coalesced_chat_request(request: ChatRequest) -> ChatResponse:
+    """相同的并发非流式请求共享一次上游调用"""
+    if not request_coalescer.enabled_for(request):
+        return await _process_chat_request(request)
+    return await request_coalescer.run(_coalescing_key(request), lambda: _process_chat_request(request))
+
+async def _coalesced_streaming_chat(request: ChatRequest) -> AsyncGenerator[dict, None]:
+    """相同的并发流式请求共享一个上游流"""
+    if not request_coalescer.enabled_for(request):
+        async for chunk in _process_streaming_chat(request):
+            yield chunk
+        return
+    
+    async for chunk in request_coalescer.stream(_coalescing_key(request), lambda: _process_streaming_chat(request)):
+        yield chunk
+
+def _outcome_for_status(status_code: int) -> str:
+    """指标里的请求结果分类"""
+    if status_code < 400:
+        return "success"
+    if status_code < 500:
+        return "rejected"
+    return "error"
+
 async def _process_chat_request(request: ChatRequest) -> ChatResponse:
     """处理聊天请求"""
+    started = time.perf_counter()
     try:
         # 根据provider选择相应的API配置
         config = get_api_config(request.provider, request.api_config)
         
-        # 详细的配置验证和日志记录
-        print(f"\n=== 聊天请求调试信息 ===")
-        print(f"Provider: {request.provider}")
-        print(f"Model: {request.model}")
-        print(f"API Key存在: {'是' if config.get('api_key') else '否'}")
-        print(f"API Key长度: {len(config.get('api_key', ''))}")
-        print(f"Base URL: {config.get('base_url')}")
-        print(f"消息数量: {len(request.messages)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("聊天请求", extra={
+                "provider": request.provider,
+                "model": request.model,
+                "has_api_key": bool(config.get('api_key')),
+                "base_url": config.get('base_url'),
+                "messages": len(request.messages),
+            })
         
         # 如果是演示模式，直接调用演示API
         if request.provider == "demo":
-            print(f"使用演示模式...")
-            response = await call_demo_api(request, config)
-            print(f"演示模式响应成功，响应长度: {len(response.message.content)}")
-            return response
-        
-        # 验证配置
-        if not config.get('api_key'):
-            error_msg = f"未配置{request.provider}的API密钥，请先在设置中配置或选择演示模式"
-            print(f"错误: {error_msg}")
-            raise HTTPException(status_code=400, detail=error_msg)
-        
-        # 验证API密钥格式
-        api_key = config.get('api_key', '')
-        if request.provider == "openai" and not api_key.startswith('sk-'):
-            error_msg = "OpenAI API密钥格式不正确，应该以'sk-'开头"
-            print(f"错误: {error_msg}")
-            raise HTTPException(status_code=400, detail=error_msg)
-        
-        if request.provider == "anthropic" and not api_key.startswith('sk-ant-'):
-            error_msg = "Anthropic API密钥格式不正确，应该以'sk-ant-'开头"
-            print(f"错误: {error_msg}")
-            raise HTTPException(status_code=400, detail=error_msg)
-        
-        print(f"开始调用 {request.provider} API...")
-        
-        if request.provider == "openai":
-            response = await call_openai_api(request, config)
-        elif request.provider == "anthropic":
-            response = await call_anthropic_api(request, config)
-        elif request.provider == "demo":
             response = await call_demo_api(request, config)
         else:
-            response = await call_custom_api(request, config)
-        
-        print(f"API调用成功，响应长度: {len(response.message.content)}")
+            # 验证配置
+            if not config.get('api_key'):
+                error_msg = f"未配置{request.provider}的API密钥，请先在设置中配置或选择演示模式"
+                raise HTTPException(status_code=400, detail=error_msg)
+            
+            # 验证API密钥格式
+            adapter = get_adapter(request.provider, config)
+            error_msg = adapter.key_error()
+            if error_msg:
+                raise HTTPException(status_code=400, detail=error_msg)
+            
+            pool = _endpoint_pool(request.provider, config)
+            try:
+                ticket = await admission_controller.acquire(request.provider, request.model, _estimate_tokens(request))
+            except AdmissionRejected as e:
+                raise _rejected(e)
+            try:
+                response = await call_provider_api(adapter, request, pool, ticket)
+            except BaseException:
+                # 失败或取消：没有拿到回复，预扣的令牌全部退还
+                ticket.release(0)
+                raise
+            ticket.release(used_tokens(response.usage))
+        
+        logger.debug("API调用成功，响应长度: %d", len(response.message.content))
+        metrics.record_request(request.provider, request.model, "success", time.perf_counter() - started, response.usage)
         return response
     
     except HTTPException as e:
-        print(f"HTTP异常: {e.status_code} - {e.detail}")
+        logger.warning("聊天请求失败: %s - %s", e.status_code, e.detail)
+        metrics.record_request(request.provider, request.model, _outcome_for_status(e.status_code), time.perf_counter() - started)
         raise e
     except Exception as e:
         error_msg = f"聊天请求失败: {str(e)}"
-        print(f"未知错误: {error_msg}")
+        logger.exception("聊天请求未知错误: %s", e)
+        metrics.record_request(request.provider, request.model, "error", time.perf_counter() - started)
         raise HTTPException(status_code=500, detail=error_msg)
 
 async def _process_streaming_chat(request: ChatRequest) -> AsyncGenerator[dict, None]:
-    """处理流式聊天请求"""
+    """处理流式聊天请求，并采集首token延迟、token间隔等指标"""
+    observer = metrics.StreamObserver(request.provider, request.model)
+    outcome = None
+    try:
+        async for chunk in _stream_chat_chunks(request):
+            observer.on_chunk(chunk)
+            yield chunk
+    except (GeneratorExit, asyncio.CancelledError):
+        outcome = "cancelled"
+        raise
+    finally:
+        observer.finish(outcome)
+
+async def _stream_chat_chunks(request: ChatRequest) -> AsyncGenerator[dict, None]:
+    """按provider分发流式聊天请求"""
     try:
         # 根据provider选择相应的API配置
         config = get_api_config(request.provider, request.api_config)
         
-        print(f"\n=== 流式聊天请求调试信息 ===")
-        print(f"Provider: {request.provider}")
-        print(f"Model: {request.model}")
-        print(f"API Key存在: {'是' if config.get('api_key') else '否'}")
-        print(f"Base URL: {config.get('base_url')}")
-        print(f"消息数量: {len(request.messages)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("流式聊天请求", extra={
+                "provider": request.provider,
+                "model": request.model,
+                "has_api_key": bool(config.get('api_key')),
+                "base_url": config.get('base_url'),
+                "messages": len(request.messages),
+            })
         
         # 如果是演示模式，调用演示流式API
         if request.provider == "demo":
-            print(f"使用演示模式流式输出...")
             async for chunk in call_demo_streaming_api(request, config):
                 yield chunk
             return
@@ -208,32 +629,151 @@ async def _process_streaming_chat(request: ChatRequest) -> AsyncGenerator[dict,
         # 验证配置
         if not config.get('api_key'):
             error_msg = f"未配置{request.provider}的API密钥，请先在设置中配置或选择演示模式"
-            print(f"错误: {error_msg}")
+            logger.warning("流式聊天请求失败: %s", error_msg)
             yield {"error": True, "message": error_msg}
             return
         
-        print(f"开始流式调用 {request.provider} API...")
+        adapter = get_adapter(request.provider, config)
+        pool = load_balancer.pool_for(request.provider, config)
         
-        if request.provider == "openai":
-            async for chunk in call_openai_streaming_api(request, config):
-                yield chunk
-        elif request.provider == "anthropic":
-            async for chunk in call_anthropic_streaming_api(request, config):
-                yield chunk
-        else:
-            async for chunk in call_custom_streaming_api(request, config):
+        # 排队期间告知客户端当前位置
+        ticket = None
+        try:
+            async for item in admission_controller.admit(request.provider, request.model, _estimate_tokens(request)):
+                if isinstance(item, Ticket):
+                    ticket = item
+                else:
+                    yield {"type": "queue", "position": item}
+        except AdmissionRejected as e:
+            logger.warning("流式聊天请求被拒绝: %s", e)
+            yield {"error": True, "status": 429, "message": str(e), "retry_after": round(e.retry_after)}
+            return
+        assert ticket is not None
+        
+        usage = None
+        generated = False
+        try:
+            async for chunk in call_provider_streaming_api(adapter, request, pool, ticket):
+                if chunk.get("type") == "usage":
+                    usage = chunk.get("usage")
+                elif chunk.get("type") == "content":
+                    generated = True
                 yield chunk
+        finally:
+            # 有用量按用量结算；出错或取消时还没有输出任何内容，预扣的令牌全部退还
+            ticket.release(used_tokens(usage) if usage else (None if generated else 0))
                 
     except Exception as e:
         error_msg = f"流式聊天请求失败: {str(e)}"
-        print(f"流式处理错误: {error_msg}")
+        logger.exception("流式处理错误: %s", e)
         yield {"error": True, "message": error_msg}
 
+@app.get("/api/upstream/endpoints")
+async def upstream_endpoints():
+    """端点池状态：每个端点的在途请求、EWMA 延迟和摘除剩余时间（密钥只显示指纹）"""
+    return {"pools": load_balancer.stats()}
+
+@app.get("/api/upstream/admission")
+async def upstream_admission():
+    """准入控制状态：每个提供商/模型的排队数、在途请求、当前并发上限和 TPM"""
+    return admission_controller.stats()
+
+@app.get("/api/upstream/resilience")
+async def upstream_resilience_stats():
+    """重试/对冲配置和每个模型的延迟分位数"""
+    return upstream_resilience.stats()
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """响应缓存命中统计"""
+    return response_cache.stats()
+
+@app.delete("/api/cache")
+async def clear_cache():
+    """清空响应缓存"""
+    await response_cache.clear()
+    return {"message": "缓存已清空"}
+
+@app.get("/api/coalescing/stats")
+async def coalescing_stats():
+    """在途请求合并统计"""
+    return request_coalescer.stats()
+
+@app.get("/api/context/stats")
+async def context_stats():
+    """token 计数缓存统计"""
+    return context_assembler.stats()
+
+@app.get("/api/models/cache/stats")
+async def models_cache_stats():
+    """模型列表缓存统计"""
+    return model_catalog.stats()
+
+@app.post("/api/conversations")
+async def create_conversation(body: Optional[ConversationCreate] = None):
+    """新建会话"""
+    return await conversation_store.create(title=body.title if body else "")
+
+@app.get("/api/conversations")
+async def list_conversations(
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0)
+):
+    """会话列表，按最近更新时间倒序"""
+    conversations, total = await conversation_store.list(limit, offset)
+    return {"data": conversations, "total": total, "limit": limit, "offset": offset}
+
+@app.get("/api/conversations/{conversation_id}")
+async def get_conversation(
+    conversation_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    before: Optional[int] = Query(None, description="只返回id小于该值的消息，用于向前翻页")
+):
+    """会话详情和消息（最近的 limit 条，按时间正序）"""
+    conversation = await conversation_store.get(conversation_id, limit, before)
+    if conversation is None:
+        raise HTTPException(status_code=404, detail="会话不存在")
+    return conversation
+
+@app.get("/api/history/search")
+async def search_history(
+    q: str = Query(..., min_length=1, max_length=200, description="关键词，空格分隔，全部命中"),
+    provider: Optional[str] = Query(None),
+    model: Optional[str] = Query(None),
+    since: Optional[datetime] = Query(None, description="起始时间（ISO 8601）"),
+    until: Optional[datetime] = Query(None, description="结束时间（ISO 8601）"),
+    sort: str = Query("relevance", description="relevance（相关度）或 recent（时间倒序）"),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor")
+):
+    """全文检索历史问答：排序、摘要高亮、过滤和游标分页"""
+    if not history_index.enabled:
+        raise HTTPException(status_code=404, detail="历史记录未启用")
+    if sort not in SORTS:
+        raise HTTPException(status_code=400, detail=f"不支持的排序方式: {sort}")
+    try:
+        return await history_index.search(
+            q, provider, model, since.timestamp() if since else None, until.timestamp() if until else None,
+            sort, limit, cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.delete("/api/conversations/{conversation_id}")
+async def delete_conversation(conversation_id: str):
+    """删除会话及其消息"""
+    if not await conversation_store.delete(conversation_id):
+        raise HTTPException(status_code=404, detail="会话不存在")
+    return {"message": "会话已删除"}
+
 @app.post("/api/config")
 async def save_config(config: APIConfig):
     """保存API配置"""
     try:
-        api_configs[config.provider] = config.dict()
+        # 写入共享的配置库（密钥加密），所有工作进程几毫秒内可见
+        await config_store.save(config.provider, config.dict())
+        # 地址或密钥可能变了，旧的模型列表不再适用
+        model_catalog.invalidate(config.provider)
         return {"message": "配置保存成功"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"保存配置失败: {str(e)}")
@@ -241,7 +781,7 @@ async def save_config(config: APIConfig):
 @app.get("/api/config/{provider}")
 async def get_config(provider: str):
     """获取API配置"""
-    config = api_configs.get(provider)
+    config = config_store.get(provider)
     if not config:
         # 从环境变量获取默认配置
         config = get_default_config(provider)
@@ -255,17 +795,12 @@ async def get_config(provider: str):
 
 @app.post("/api/test-connection")
 async def test_connection(config: APIConfig):
-    """测试API连接"""
+    """测试API连接，返回各阶段耗时"""
     try:
-        print(f"\n=== 连接测试调试信息 ===")
-        print(f"Provider: {config.provider}")
-        print(f"API Key: {config.api_key[:10]}..." if config.api_key and len(config.api_key) > 10 else f"API Key: {config.api_key}")
-        print(f"Base URL: {config.base_url}")
-        print(f"Model: {config.model}")
+        logger.info("连接测试", extra={"provider": config.provider, "base_url": config.base_url, "model": config.model})
         
         # 如果是演示模式，直接返回成功
         if config.provider == "demo":
-            print("使用演示模式进行连接测试")
             await asyncio.sleep(0.5)  # 模拟轻微延迟
             return {
                 "status": "success", 
@@ -273,83 +808,53 @@ async def test_connection(config: APIConfig):
                 "response": "演示模式已准备就绪，可以开始使用聊天功能。"
             }
         
-        # 添加网络诊断
-        if config.provider == "custom":
-            try:
-                import socket
-                from urllib.parse import urlparse
-                
-                # 解析URL获取主机名和端口
-                parsed_url = urlparse(config.base_url)
-                hostname = parsed_url.hostname
-                port = parsed_url.port or (443 if parsed_url.scheme == 'https' else 80)
-                
-                print(f"正在测试到 {hostname}:{port} 的网络连接...")
-                
-                # 测试TCP连接
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(10)
-                result = sock.connect_ex((hostname, port))
-                sock.close()
-                
-                if result != 0:
-                    print(f"TCP连接失败: {hostname}:{port}")
-                    raise HTTPException(
-                        status_code=503, 
-                        detail=f"无法连接到服务器 {hostname}:{port}，请检查网络连接和服务器状态"
-                    )
-                else:
-                    print(f"TCP连接成功: {hostname}:{port}")
-                    
-            except Exception as e:
-                print(f"网络诊断失败: {e}")
+        test_config = {
+            "api_key": config.api_key,
+            "base_url": config.base_url,
+            "model": config.model
+        }
+        adapter = get_adapter(config.provider, test_config)
         
-        # 创建一个简单的测试请求
+        # 最小的补全请求
         test_request = ChatRequest(
             messages=[ChatMessage(role="user", content="Hello, this is a connection test.")],
             provider=config.provider,
             model=config.model,
             temperature=0.1,
-            max_tokens=50
+            max_tokens=16
         )
         
-        # 使用传入的配置进行测试
-        test_config = {
-            "api_key": config.api_key,
-            "base_url": config.base_url,
-            "model": config.model
-        }
+        async def complete() -> str:
+            response = await call_provider_api(adapter, test_request)
+            return response.message.content
         
-        if config.provider == "openai":
-            response = await call_openai_api(test_request, test_config)
-            return {"status": "success", "message": "OpenAI连接测试成功", "response": response.message.content[:100]}
-        elif config.provider == "anthropic":
-            response = await call_anthropic_api(test_request, test_config)
-            return {"status": "success", "message": "Anthropic连接测试成功", "response": response.message.content[:100]}
-        else:
-            response = await call_custom_api(test_request, test_config)
-            return {"status": "success", "message": "自定API连接测试成功", "response": response.message.content[:100]}
+        # DNS、TCP、TLS、/models 首字节和补全分阶段计时，返回结构化报告
+        client = http_clients.get_client(adapter.name, adapter.models_url)
+        report = await connection_diagnostics.run(adapter, client, complete)
+        if report["status"] != "success":
+            logger.warning("连接测试失败: %s", report["message"], extra={"provider": config.provider})
+        return report
     
     except HTTPException as e:
-        print(f"连接测试HTTP异常: {e.status_code} - {e.detail}")
+        logger.warning("连接测试失败: %s - %s", e.status_code, e.detail)
         raise e
     except Exception as e:
         error_msg = f"连接测试失败: {str(e)}"
-        print(f"连接测试未知异常: {error_msg}")
+        logger.exception("连接测试未知异常: %s", e)
         raise HTTPException(status_code=500, detail=error_msg)
 
-@app.post("/api/models")
-async def get_models(config: APIConfig) -> ModelsResponse:
+@app.post("/api/models", response_model=ModelsResponse)
+async def get_models(config: APIConfig, force_refresh: bool = Query(False, description="跳过缓存重新获取")):
     """获取可用模型列表"""
+    # 模型列表在构造时已经校验过（缓存命中时更是如此），直接序列化
+    return FastJSONResponse(await _get_models(config, force_refresh))
+
+async def _get_models(config: APIConfig, force_refresh: bool) -> ModelsResponse:
     try:
-        print(f"\n=== 获取模型列表调试信息 ===")
-        print(f"Provider: {config.provider}")
-        print(f"API Key存在: {'是' if config.api_key else '否'}")
-        print(f"Base URL: {config.base_url}")
+        logger.debug("获取模型列表", extra={"provider": config.provider, "base_url": config.base_url})
         
         # 演示模式返回模拟模型列表
         if config.provider == "demo":
-            print("使用演示模式获取模型列表")
             demo_models = [
                 ModelInfo(
                     id="demo-gpt-3.5-turbo",
@@ -373,34 +878,55 @@ async def get_models(config: APIConfig) -> ModelsResponse:
         if not config.api_key:
             raise HTTPException(status_code=400, detail="未配置API密钥")
         
-        if config.provider == "openai":
-            return await get_openai_models(config)
-        elif config.provider == "anthropic":
+        if config.provider == "anthropic":
             return await get_anthropic_models(config)
-        else:  # custom provider（包括硅基流动等）
+        
+        async def fetch_models() -> ModelsResponse:
+            if config.provider == "openai":
+                return await get_openai_models(config)
+            # custom provider（包括硅基流动等）
             return await get_custom_models(config)
+        
+        cache_key = model_catalog.key_for(config.provider, config.base_url, config.api_key)
+        return await model_catalog.get(cache_key, fetch_models, force_refresh=force_refresh)
             
     except HTTPException as e:
-        print(f"获取模型列表HTTP异常: {e.status_code} - {e.detail}")
+        logger.warning("获取模型列表失败: %s - %s", e.status_code, e.detail)
         raise e
     except Exception as e:
         error_msg = f"获取模型列表失败: {str(e)}"
-        print(f"获取模型列表未知异常: {error_msg}")
+        logger.exception("获取模型列表未知异常: %s", e)
         raise HTTPException(status_code=500, detail=error_msg)
 
 def get_api_config(provider: str, api_config: Optional[dict] = None) -> dict:
     """获取API配置"""
     # 优先使用请求中传入的配置
     if api_config:
-        return api_config
+        return _with_primary_endpoint(api_config)
     
-    # 其次使用存储的配置
-    if provider in api_configs:
-        return api_configs[provider]
+    # 其次使用存储的配置（进程内缓存，见 services/config_store.py）
+    stored = config_store.get(provider)
+    if stored is not None:
+        return stored
     
     # 最后使用默认配置
     return get_default_config(provider)
 
+def _with_primary_endpoint(config: dict) -> dict:
+    """请求里只带了端点池时，用第一个端点补上 api_key / base_url"""
+    endpoints = config.get("endpoints")
+    if not endpoints or (config.get("api_key") and config.get("base_url")):
+        return config
+    if not isinstance(endpoints, list) or not isinstance(endpoints[0], dict):
+        # 格式不对的 endpoints 在选择端点池时报错
+        return config
+    primary = endpoints[0]
+    return {
+        **config,
+        "api_key": config.get("api_key") or primary.get("api_key", ""),
+        "base_url": config.get("base_url") or primary.get("base_url", ""),
+    }
+
 def get_default_config(provider: str) -> dict:
     """从环境变量获取默认配置"""
     if provider == "openai":
@@ -428,573 +954,211 @@ def get_default_config(provider: str) -> dict:
             "model": "gpt-3.5-turbo"
         }
 
-async def call_openai_api(request: ChatRequest, config: dict) -> ChatResponse:
-    """调用OpenAI API"""
-    if not config.get('api_key'):
-        raise HTTPException(status_code=400, detail="未配置OpenAI API密钥")
+async def call_provider_api(adapter: ProviderAdapter, request: ChatRequest,
+                            pool: Optional[EndpointPool] = None, ticket: Optional[Ticket] = None) -> ChatResponse:
+    """通过提供商适配器调用上游聊天接口（非流式）"""
+    if not adapter.api_key:
+        raise HTTPException(status_code=400, detail=f"未配置{adapter.label} API密钥")
     
-    headers = {
-        "Authorization": f"Bearer {config['api_key']}",
-        "Content-Type": "application/json"
-    }
+    if not adapter.base_url:
+        raise HTTPException(status_code=400, detail=f"未配置{adapter.label} API地址")
     
-    payload = {
-        "model": request.model,
-        "messages": [{"role": msg.role, "content": msg.content} for msg in request.messages],
-        "temperature": request.temperature,
-        "max_tokens": request.max_tokens
-    }
+    payload = adapter.build_payload(request)
     
     try:
-        # 配置超时
-        timeout = httpx.Timeout(60.0)
-        
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            response = await client.post(
-                f"{config['base_url']}/chat/completions",
-                headers=headers,
-                json=payload
-            )
-        
-        if response.status_code != 200:
-            error_detail = f"OpenAI API错误 (状态码: {response.status_code})"
-            try:
-                error_data = response.json()
-                if 'error' in error_data:
-                    error_detail = f"OpenAI API错误: {error_data['error'].get('message', '未知错误')}"
-                    # 特别处理401错误
-                    if response.status_code == 401:
-                        error_detail += " - 请检查API密钥是否正确、有效且有余额"
-                print(f"OpenAI API详细错误: {error_data}")
-            except:
-                error_detail = f"OpenAI API错误: HTTP {response.status_code}"
-                if response.status_code == 401:
-                    error_detail += " - 认证失败，请检查API密钥"
-            
-            print(f"OpenAI API错误详情: {error_detail}")
-            raise HTTPException(status_code=response.status_code, detail=error_detail)
-        
-        data = response.json()
-        
-        if 'choices' not in data or len(data['choices']) == 0:
-            raise HTTPException(status_code=500, detail="OpenAI API返回了无效的响应")
-        
-        message_content = data["choices"][0]["message"]["content"]
-        
-        return ChatResponse(
-            message=ChatMessage(role="assistant", content=message_content),
-            usage=data.get("usage")
+        # 瞬时错误按退避重试，慢启动时可选对冲（见 services/resilience.py）
+        response = await upstream_resilience.send(
+            adapter.name, request.model, _upstream_sender(adapter, payload, pool, ticket=ticket)
         )
-        
+    except NoEndpointAvailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(max(1, round(e.retry_after)))})
+    except httpx.TimeoutException as e:
+        error_msg = f"请求{adapter.label} API超时: {str(e)} - 请检查网络连接或尝试稍后再试"
+        logger.warning("%s", error_msg)
+        raise HTTPException(status_code=408, detail=error_msg)
+    except httpx.ConnectError as e:
+        error_msg = f"连接{adapter.label} API失败: {str(e)} - 请检查Base URL是否正确或网络连接"
+        logger.warning("%s", error_msg)
+        raise HTTPException(status_code=503, detail=error_msg)
     except httpx.RequestError as e:
-        raise HTTPException(status_code=500, detail=f"请求OpenAI API失败: {str(e)}")
-
-async def call_anthropic_api(request: ChatRequest, config: dict) -> ChatResponse:
-    """调用Anthropic API"""
-    if not config.get('api_key'):
-        raise HTTPException(status_code=400, detail="未配置Anthropic API密钥")
-    
-    headers = {
-        "x-api-key": config['api_key'],
-        "Content-Type": "application/json",
-        "anthropic-version": "2023-06-01"
-    }
-    
-    # 转换消息格式为Anthropic格式
-    anthropic_messages = []
-    system_message = ""
+        raise HTTPException(status_code=500, detail=f"请求{adapter.label} API失败: {str(e)}")
     
-    for msg in request.messages:
-        if msg.role == "system":
-            system_message = msg.content
-        elif msg.role in ["user", "assistant"]:
-            anthropic_messages.append({
-                "role": msg.role,
-                "content": msg.content
-            })
-    
-    payload = {
-        "model": request.model,
-        "max_tokens": request.max_tokens,
-        "temperature": request.temperature,
-        "messages": anthropic_messages
-    }
-    
-    # 如果有系统消息，添加到payload中
-    if system_message:
-        payload["system"] = system_message
+    if response.status_code != 200:
+        error_detail = adapter.parse_error(response)
+        logger.warning("%s API错误详情: %s", adapter.label, error_detail)
+        raise HTTPException(status_code=response.status_code, detail=error_detail)
     
     try:
-        # 配置超时
-        timeout = httpx.Timeout(60.0)
-        
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            response = await client.post(
-                f"{config['base_url']}/v1/messages",
-                headers=headers,
-                json=payload
-            )
-        
-        if response.status_code != 200:
-            error_detail = f"Anthropic API错误 (状态码: {response.status_code})"
-            try:
-                error_data = response.json()
-                if 'error' in error_data:
-                    error_detail = f"Anthropic API错误: {error_data['error'].get('message', '未知错误')}"
-                    # 特别处理401错误
-                    if response.status_code == 401:
-                        error_detail += " - 请检查API密钥是否正确且有效"
-                print(f"Anthropic API详细错误: {error_data}")
-            except:
-                error_detail = f"Anthropic API错误: HTTP {response.status_code}"
-                if response.status_code == 401:
-                    error_detail += " - 认证失败，请检查API密钥格式"
-            
-            print(f"Anthropic API错误详情: {error_detail}")
-            raise HTTPException(status_code=response.status_code, detail=error_detail)
-        
-        data = response.json()
-        
-        if 'content' not in data or len(data['content']) == 0:
-            raise HTTPException(status_code=500, detail="Anthropic API返回了无效的响应")
-        
-        # Anthropic返回的content是一个数组，获取第一个text内容
-        message_content = data["content"][0]["text"]
-        
-        return ChatResponse(
-            message=ChatMessage(role="assistant", content=message_content),
-            usage=data.get("usage")
-        )
-        
-    except httpx.RequestError as e:
-        raise HTTPException(status_code=500, detail=f"请求Anthropic API失败: {str(e)}")
-
-async def call_demo_api(request: ChatRequest, config: dict) -> ChatResponse:
-    """演示API - 返回模拟回复"""
-    import random
-    
-    # 模拟一些延迟
-    await asyncio.sleep(1)
-    
-    # 获取用户最后一条消息
-    user_message = request.messages[-1].content if request.messages else "你好"
-    
-    # 预定义一些模拟回复
-    demo_responses = [
-        f"你好！我是演示AI助手。我收到了你的消息：\"{user_message}\"。这是一个模拟回复，用于测试应用功能。",
-        f"非常感谢你的问题：\"{user_message}\"。作为演示模式，我可以告诉你，这个应用的聊天功能工作正常！要使用真实的AI，请配置真实的API密钥。",
-        f"我正在演示模式下运行。你问了：\"{user_message}\"。如果这是真实的AI服务，我会给出更加智能和有用的回答。现在你可以体验应用的界面和基本功能。",
-        f"欢迎使用AI聊天应用！你刚才说：\"{user_message}\"。这是演示模式的回复。在真实模式下，AI会根据你的问题提供更加个性化和准确的答案。",
-        f"你好！我正在演示模式下工作。对于你的输入\"{user_message}\"，在真实环境下，我能够：\n1. 回答各种问题\n2. 协助写作和编程\n3. 分析和解决问题\n4. 进行创意讨论\n\n请配置真实的API密钥来解锁完整功能！"
-    ]
-    
-    # 随机选择一个回复
-    response_content = random.choice(demo_responses)
+        message_content, usage = adapter.parse_response(response.json())
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        raise HTTPException(status_code=500, detail=str(e))
     
     return ChatResponse(
-        message=ChatMessage(role="assistant", content=response_content),
-        usage={
-            "prompt_tokens": len(user_message),
-            "completion_tokens": len(response_content),
-            "total_tokens": len(user_message) + len(response_content)
-        }
+        message=ChatMessage(role="assistant", content=message_content),
+        usage=usage
     )
 
-async def call_custom_api(request: ChatRequest, config: dict) -> ChatResponse:
-    if not config.get('api_key'):
-        raise HTTPException(status_code=400, detail="未配置自定义API密钥")
-    
-    if not config.get('base_url'):
-        raise HTTPException(status_code=400, detail="未配置自定义API地址")
-    
-    headers = {
-        "Authorization": f"Bearer {config['api_key']}",
-        "Content-Type": "application/json",
-        "User-Agent": "AI-Chat-App/1.0"
-    }
-    
-    payload = {
-        "model": request.model,
-        "messages": [{"role": msg.role, "content": msg.content} for msg in request.messages],
-        "temperature": request.temperature,
-        "max_tokens": request.max_tokens
-    }
-    
-    try:
-        # 尝试使用标准的OpenAI兼容端点
-        base_url = config['base_url'].rstrip('/')
-        if not base_url.endswith('/chat/completions'):
-            api_url = f"{base_url}/chat/completions"
-        else:
-            api_url = base_url
-        
-        print(f"正在请求API: {api_url}")
-        print(f"请求头: {dict(headers)}")
-        print(f"请求体模型: {payload['model']}")
-        
-        # 配置更宽松的超时和重试设置
-        timeout = httpx.Timeout(
-            connect=30.0,  # 连接超时
-            read=120.0,    # 读取超时
-            write=30.0,    # 写入超时
-            pool=10.0      # 连接池超时
-        )
-        
-        # 创建客户端时添加更多配置
-        client_config = {
-            "timeout": timeout,
-            "verify": True,  # 验证SSL证书
-            "follow_redirects": True,  # 跟随重定向
-            "limits": httpx.Limits(
-                max_keepalive_connections=20,
-                max_connections=100,
-                keepalive_expiry=30.0
-            )
-        }
-        
+async def _send_chat(client: httpx.AsyncClient, adapter: ProviderAdapter, payload: dict,
+                     stream: bool = False) -> httpx.Response:
+    """向上游发送一次聊天请求；stream=True 时返回未读取正文的响应"""
+    upstream_request = client.build_request(
+        "POST",
+        adapter.chat_url,
+        headers=adapter.headers,
+        json=payload,
+        timeout=adapter.timeout,
+        extensions={"trace": metrics.connect_tracer(adapter.name)}
+    )
+    return await client.send(upstream_request, stream=stream, follow_redirects=adapter.follow_redirects)
 
+def _upstream_sender(adapter: ProviderAdapter, payload: dict, pool: Optional[EndpointPool],
+                     stream: bool = False, ticket: Optional[Ticket] = None):
+    """返回一次上游发送的协程工厂；有端点池时每次发送（包括重试、对冲）都重新选择端点，
+    有准入票据时用每个响应的限流头校准准入限制"""
+    if pool is None:
+        client = http_clients.get_client(adapter.name, adapter.chat_url)
+        send = lambda: _send_chat(client, adapter, payload, stream)
+    else:
+        async def send_to(endpoint) -> httpx.Response:
+            target = get_adapter(adapter.name, endpoint.config)
+            client = http_clients.get_client(target.name, target.chat_url)
+            return await _send_chat(client, target, payload, stream)
         
-        async with httpx.AsyncClient(**client_config) as client:
-            print("开始发送HTTP请求...")
-            response = await client.post(
-                api_url,
-                headers=headers,
-                json=payload
-            )
-            print(f"收到响应，状态码: {response.status_code}")
-        
-        if response.status_code != 200:
-            error_detail = f"自定义API错误 (状态码: {response.status_code})"
-            try:
-                error_data = response.json()
-                if 'error' in error_data:
-                    error_detail = f"自定义API错误: {error_data['error'].get('message', '未知错误')}"
-                elif 'message' in error_data:
-                    error_detail = f"自定义API错误: {error_data['message']}"
-                
-                # 特别处理401错误
-                if response.status_code == 401:
-                    error_detail += " - 认证失败，请检查API密钥和Base URL是否正确"
-                
-                print(f"自定义API详细错误: {error_data}")
-            except:
-                error_detail = f"自定义API错误: HTTP {response.status_code}"
-                if response.status_code == 401:
-                    error_detail += " - 认证失败，请检查API密钥、Base URL和认证方式"
-            
-            print(f"自定义API错误详情: {error_detail}")
-            raise HTTPException(status_code=response.status_code, detail=error_detail)
-        
-        data = response.json()
-        print(f"响应数据结构: {list(data.keys()) if isinstance(data, dict) else type(data)}")
-        
-        # 支持多种响应格式
-        message_content = ""
-        
-        if 'choices' in data and len(data['choices']) > 0:
-            # OpenAI兼容格式
-            choice = data['choices'][0]
-            if 'message' in choice and 'content' in choice['message']:
-                message_content = choice['message']['content']
-            elif 'text' in choice:
-                message_content = choice['text']
-        elif 'content' in data:
-            # 直接内容格式
-            if isinstance(data['content'], list) and len(data['content']) > 0:
-                message_content = data['content'][0].get('text', str(data['content']))
-            else:
-                message_content = str(data['content'])
-        elif 'response' in data:
-            # 另一种常见格式
-            message_content = str(data['response'])
-        else:
-            print(f"无法识别的响应格式: {data}")
-            raise HTTPException(status_code=500, detail="自定义API返回了无法识别的响应格式")
-        
-        if not message_content:
-            raise HTTPException(status_code=500, detail="自定义API返回了空的响应内容")
-        
-        print(f"成功获取响应内容，长度: {len(message_content)}")
-        
-        return ChatResponse(
-            message=ChatMessage(role="assistant", content=message_content),
-            usage=data.get("usage")
-        )
-        
-    except httpx.TimeoutException as e:
-        error_msg = f"请求自定义API超时: {str(e)} - 请检查网络连接或尝试稍后再试"
-        print(f"超时错误: {error_msg}")
-        raise HTTPException(status_code=408, detail=error_msg)
-    except httpx.ConnectError as e:
-        error_msg = f"连接自定义API失败: {str(e)} - 请检查Base URL是否正确或网络连接"
-        print(f"连接错误: {error_msg}")
-        raise HTTPException(status_code=503, detail=error_msg)
-
-# 流式API调用函数
-async def call_openai_streaming_api(request: ChatRequest, config: dict) -> AsyncGenerator[dict, None]:
-    """调用OpenAI流式API"""
-    if not config.get('api_key'):
-        yield {"error": True, "message": "未配置OpenAI API密钥"}
-        return
+        send = lambda: send_via(pool, send_to)
     
-    headers = {
-        "Authorization": f"Bearer {config['api_key']}",
-        "Content-Type": "application/json"
-    }
+    if ticket is None:
+        return send
     
-    payload = {
-        "model": request.model,
-        "messages": [{"role": msg.role, "content": msg.content} for msg in request.messages],
-        "temperature": request.temperature,
-        "max_tokens": request.max_tokens,
-        "stream": True
-    }
+    async def observed() -> httpx.Response:
+        response = await send()
+        ticket.observe(response.status_code, response.headers)
+        return response
     
+    return observed
+
+async def call_demo_api(request: ChatRequest, config: dict) -> ChatResponse:
+    """演示API - 返回模拟回复（参数见 services/demo.py）"""
+    reply = DemoReply(_demo_options(config), _last_user_message(request), stream=False)
     try:
-        timeout = httpx.Timeout(60.0)
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            async with client.stream(
-                "POST",
-                f"{config['base_url']}/chat/completions",
-                headers=headers,
-                json=payload
-            ) as response:
-                if response.status_code != 200:
-                    error_detail = f"OpenAI API错误 (状态码: {response.status_code})"
-                    yield {"error": True, "message": error_detail}
-                    return
-                
-                content_buffer = ""
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        data_str = line[6:]
-                        if data_str.strip() == "[DONE]":
-                            break
-                        
-                        try:
-                            chunk_data = json.loads(data_str)
-                            if "choices" in chunk_data and len(chunk_data["choices"]) > 0:
-                                delta = chunk_data["choices"][0].get("delta", {})
-                                if "content" in delta and delta["content"] is not None:
-                                    content = delta["content"]
-                                    content_buffer += content
-                                    yield {
-                                        "type": "content",
-                                        "content": content,
-                                        "full_content": content_buffer
-                                    }
-                        except json.JSONDecodeError:
-                            continue
-                            
-    except Exception as e:
-        print(f"Debug: OpenAI streaming error: {e}")
-        yield {"error": True, "message": f"请求OpenAI流式API失败: {str(e)}"}
+        content, usage = await reply.complete()
+    except DemoFailure as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return ChatResponse(message=ChatMessage(role="assistant", content=content), usage=usage)
 
-async def call_anthropic_streaming_api(request: ChatRequest, config: dict) -> AsyncGenerator[dict, None]:
-    """调用Anthropic流式API"""
-    if not config.get('api_key'):
-        yield {"error": True, "message": "未配置Anthropic API密钥"}
-        return
-    
-    headers = {
-        "x-api-key": config['api_key'],
-        "Content-Type": "application/json",
-        "anthropic-version": "2023-06-01"
-    }
-    
-    # 转换消息格式为Anthropic格式
-    anthropic_messages = []
-    system_message = ""
-    
-    for msg in request.messages:
-        if msg.role == "system":
-            system_message = msg.content
-        elif msg.role in ["user", "assistant"]:
-            anthropic_messages.append({
-                "role": msg.role,
-                "content": msg.content
-            })
-    
-    payload = {
-        "model": request.model,
-        "max_tokens": request.max_tokens,
-        "temperature": request.temperature,
-        "messages": anthropic_messages,
-        "stream": True
-    }
-    
-    if system_message:
-        payload["system"] = system_message
-    
+def _demo_options(config: dict) -> DemoOptions:
     try:
-        timeout = httpx.Timeout(60.0)
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            async with client.stream(
-                "POST",
-                f"{config['base_url']}/v1/messages",
-                headers=headers,
-                json=payload
-            ) as response:
-                if response.status_code != 200:
-                    error_detail = f"Anthropic API错误 (状态码: {response.status_code})"
-                    yield {"error": True, "message": error_detail}
-                    return
-                
-                content_buffer = ""
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        data_str = line[6:]
-                        if data_str.strip() == "[DONE]":
-                            break
-                        
-                        try:
-                            chunk_data = json.loads(data_str)
-                            if chunk_data.get("type") == "content_block_delta":
-                                delta = chunk_data.get("delta", {})
-                                if "text" in delta and delta["text"] is not None:
-                                    content = delta["text"]
-                                    content_buffer += content
-                                    yield {
-                                        "type": "content",
-                                        "content": content,
-                                        "full_content": content_buffer
-                                    }
-                        except json.JSONDecodeError:
-                            continue
-                            
-    except Exception as e:
-        yield {"error": True, "message": f"请求Anthropic流式API失败: {str(e)}"}
+        return DemoOptions.model_validate(config.get("demo") or {})
+    except ValidationError as e:
+        problems = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+        raise HTTPException(status_code=422, detail=f"演示参数无效 - {problems}")
+
+def _last_user_message(request: ChatRequest) -> str:
+    return request.messages[-1].content if request.messages else "你好"
 
-async def call_custom_streaming_api(request: ChatRequest, config: dict) -> AsyncGenerator[dict, None]:
-    """调用自定义流式API（如硅基流动等）"""
-    if not config.get('api_key'):
-        yield {"error": True, "message": "未配置自定义API密钥"}
+# 流式API调用函数
+async def call_provider_streaming_api(adapter: ProviderAdapter, request: ChatRequest,
+                                      pool: Optional[EndpointPool] = None,
+                                      ticket: Optional[Ticket] = None) -> AsyncGenerator[dict, None]:
+    """通过提供商适配器调用上游流式接口"""
+    if not adapter.api_key:
+        yield {"error": True, "message": f"未配置{adapter.label} API密钥"}
         return
     
-    if not config.get('base_url'):
-        yield {"error": True, "message": "未配置自定义API地址"}
+    if not adapter.base_url:
+        yield {"error": True, "message": f"未配置{adapter.label} API地址"}
         return
     
-    headers = {
-        "Authorization": f"Bearer {config['api_key']}",
-        "Content-Type": "application/json",
-        "User-Agent": "AI-Chat-App/1.0"
-    }
+    payload = adapter.build_payload(request, stream=True)
+    send = _upstream_sender(adapter, payload, pool, stream=True, ticket=ticket)
     
-    payload = {
-        "model": request.model,
-        "messages": [{"role": msg.role, "content": msg.content} for msg in request.messages],
-        "temperature": request.temperature,
-        "max_tokens": request.max_tokens,
-        "stream": True
-    }
-    
-    try:
-        base_url = config['base_url'].rstrip('/')
-        if not base_url.endswith('/chat/completions'):
-            api_url = f"{base_url}/chat/completions"
-        else:
-            api_url = base_url
-        
-        print(f"正在请求流式API: {api_url}")
-        
-        timeout = httpx.Timeout(60.0)
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            async with client.stream(
-                "POST",
-                api_url,
-                headers=headers,
-                json=payload
-            ) as response:
+    # 建立连接时的重试（resilience.send 内部）和正文中断后的重试共用一个次数上限
+    retries = RetryState()
+    while True:
+        emitted = False
+        try:
+            response = await upstream_resilience.send(adapter.name, request.model, send, stream=True, state=retries)
+            try:
                 if response.status_code != 200:
-                    error_detail = f"自定义API错误 (状态码: {response.status_code})"
-                    yield {"error": True, "message": error_detail}
+                    await response.aread()
+                    yield {"error": True, "message": adapter.parse_error(response)}
                     return
                 
-                content_buffer = ""
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        data_str = line[6:]
-                        if data_str.strip() == "[DONE]":
-                            break
-                        
-                        try:
-                            chunk_data = json.loads(data_str)
-                            if "choices" in chunk_data and len(chunk_data["choices"]) > 0:
-                                delta = chunk_data["choices"][0].get("delta", {})
-                                if "content" in delta and delta["content"] is not None:
-                                    content = delta["content"]
-                                    content_buffer += content
-                                    yield {
-                                        "type": "content",
-                                        "content": content,
-                                        "full_content": content_buffer
-                                    }
-                        except json.JSONDecodeError:
-                            continue
-                            
-    except Exception as e:
-        print(f"Debug: Custom API streaming error: {e}")
-        yield {"error": True, "message": f"请求自定义流式API失败: {str(e)}"}
+                usage = {}
+                async for sse in aiter_sse(response):
+                    if sse.event == "ping":
+                        continue
+                    if sse.data.strip() == b"[DONE]":
+                        break
+                    
+                    try:
+                        chunk_data = sse.json()
+                    except ValueError:
+                        metrics.upstream_malformed_events.inc(adapter.name)
+                        logger.warning("%s 流式响应中有无法解析的事件: %r", adapter.label, sse.data[:200])
+                        continue
+                    if sse.event == "error":
+                        # Anthropic 在流中途用 error 事件报告过载等错误
+                        error = chunk_data.get("error") if isinstance(chunk_data, dict) else None
+                        message = error.get("message") if isinstance(error, dict) else sse.data.decode("utf-8", "replace")
+                        yield {"error": True, "message": f"{adapter.label} 流式响应错误: {message}"}
+                        return
+                    for event in adapter.parse_stream_event(chunk_data, usage):
+                        emitted = True
+                        yield event
+            finally:
+                await response.aclose()
+            return
+        
+        except STREAM_RETRYABLE_ERRORS as e:
+            # 还没有输出任何内容时，流中途断开可以安全地重新请求
+            if emitted or not upstream_resilience.can_retry(retries.attempt):
+                logger.warning("%s 流式请求错误: %s", adapter.label, e)
+                yield {"error": True, "message": f"请求{adapter.label}流式API失败: {str(e)}"}
+                return
+            delay = upstream_resilience.retry.backoff(retries.attempt)
+            retries.attempt += 1
+            metrics.upstream_retries.inc(adapter.name, type(e).__name__)
+            logger.info("%s 流式请求在首个token前中断（%s），%.2f 秒后重试", adapter.label, e, delay)
+            await asyncio.sleep(delay)
+        except Exception as e:
+            logger.warning("%s 流式请求错误: %s", adapter.label, e)
+            yield {"error": True, "message": f"请求{adapter.label}流式API失败: {str(e)}"}
+            return
 
 async def call_demo_streaming_api(request: ChatRequest, config: dict) -> AsyncGenerator[dict, None]:
-    """演示流式API - 模拟字符逐个输出"""
-    import random
-    
-    # 获取用户最后一条消息
-    user_message = request.messages[-1].content if request.messages else "你好"
-    
-    # 预定义一些模拟回复
-    demo_responses = [
-        f"你好！我是演示AI助手。我收到了你的消息：\"{user_message}\"。这是一个模拟的流式回复，用于测试应用功能。",
-        f"非常感谢你的问题：\"{user_message}\"。作为演示模式，我可以告诉你，这个应用的流式聊天功能工作正常！要使用真实的AI，请配置真实的API密钥。",
-        f"我正在演示模式下运行。你问了：\"{user_message}\"。如果这是真实的AI服务，我会给出更加智能和有用的回答。现在你可以体验应用的流式输出界面。"
-    ]
+    """演示流式API - 按参数模拟逐个输出（参数见 services/demo.py）"""
+    try:
+        options = _demo_options(config)
+    except HTTPException as e:
+        yield {"error": True, "message": e.detail}
+        return
+    async for chunk in DemoReply(options, _last_user_message(request), stream=True).stream():
+        yield chunk
+
+# 模型列表获取函数
+async def _fetch_model_list(adapter: ProviderAdapter):
+    """请求上游 /models 端点，返回解析后的JSON"""
+    logger.debug("正在请求模型列表API: %s", adapter.models_url)
     
-    # 随机选择一个回复
-    response_content = random.choice(demo_responses)
+    client = http_clients.get_client(adapter.name, adapter.models_url)
+    response = await client.get(
+        adapter.models_url,
+        headers=adapter.headers,
+        timeout=httpx.Timeout(30.0),
+        follow_redirects=adapter.follow_redirects
+    )
     
-    # 模拟流式输出
-    content_buffer = ""
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail=adapter.parse_error(response))
     
-    # 按字符逐个输出，模拟真实的流式体验
-    for char in response_content:
-        content_buffer += char
-        yield {
-            "type": "content",
-            "content": char,
-            "full_content": content_buffer
-        }
-        # 随机延迟，模拟网络传输
-        await asyncio.sleep(random.uniform(0.01, 0.05))
+    return response.json()
 
-# 模型列表获取函数
 async def get_openai_models(config: APIConfig) -> ModelsResponse:
     """获取OpenAI模型列表"""
-    headers = {
-        "Authorization": f"Bearer {config.api_key}",
-        "Content-Type": "application/json"
-    }
+    adapter = get_adapter("openai", config.dict())
     
     try:
-        timeout = httpx.Timeout(30.0)
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            response = await client.get(
-                f"{config.base_url}/models",
-                headers=headers
-            )
-        
-        if response.status_code != 200:
-            error_detail = f"OpenAI API错误 (状态码: {response.status_code})"
-            try:
-                error_data = response.json()
-                if 'error' in error_data:
-                    error_detail = f"OpenAI API错误: {error_data['error'].get('message', '未知错误')}"
-            except:
-                pass
-            raise HTTPException(status_code=response.status_code, detail=error_detail)
-        
-        data = response.json()
+        data = await _fetch_model_list(adapter)
         models = []
         
         for model in data.get('data', []):
@@ -1048,42 +1212,11 @@ async def get_anthropic_models(config: APIConfig) -> ModelsResponse:
 
 async def get_custom_models(config: APIConfig) -> ModelsResponse:
     """获取自定API模型列表（支持硅基流动等）"""
-    headers = {
-        "Authorization": f"Bearer {config.api_key}",
-        "Content-Type": "application/json",
-        "User-Agent": "AI-Chat-App/1.0"
-    }
+    # 使用标准的OpenAI兼容模型列表端点
+    adapter = get_adapter(config.provider, config.dict())
     
     try:
-        # 尝试使用标准的OpenAI兼容模型列表端点
-        base_url = config.base_url.rstrip('/')
-        if base_url.endswith('/chat/completions'):
-            base_url = base_url.replace('/chat/completions', '')
-        
-        api_url = f"{base_url}/models"
-        
-        print(f"正在请求模型列表API: {api_url}")
-        
-        timeout = httpx.Timeout(30.0)
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            response = await client.get(
-                api_url,
-                headers=headers
-            )
-        
-        if response.status_code != 200:
-            error_detail = f"自定API错误 (状态码: {response.status_code})"
-            try:
-                error_data = response.json()
-                if 'error' in error_data:
-                    error_detail = f"自定API错误: {error_data['error'].get('message', '未知错误')}"
-                elif 'detail' in error_data:
-                    error_detail = f"自定API错误: {error_data['detail']}"
-            except:
-                pass
-            raise HTTPException(status_code=response.status_code, detail=error_detail)
-        
-        data = response.json()
+        data = await _fetch_model_list(adapter)
         models = []
         
         # 处理不同的响应格式
@@ -1145,33 +1278,17 @@ async def get_custom_models(config: APIConfig) -> ModelsResponse:
                 )
             ]
         
-        print(f"成功获取到 {len(models)} 个模型")
+        logger.debug("成功获取到 %d 个模型", len(models))
         return ModelsResponse(data=models)
         
     except httpx.RequestError as e:
         raise HTTPException(status_code=500, detail=f"请求自定API失败: {str(e)}")
     except Exception as e:
-        print(f"获取自定模型列表错误: {e}")
+        logger.warning("获取自定模型列表错误: %s", e)
         raise HTTPException(status_code=500, detail=f"解析模型列表失败: {str(e)}")
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+startup.mark("app")
 
 if __name__ == "__main__":
-    import uvicorn
-    
-    host = os.getenv("BACKEND_HOST", "127.0.0.1")
-    port = int(os.getenv("BACKEND_PORT", "8000"))
-    debug = os.getenv("DEBUG", "true").lower() == "true"
-    
-    uvicorn.run(
-        "main:app",
-        host=host,
-        port=port,
-        reload=debug,
-        log_level="info"
-    )
\ No newline at end of file
+    # BACKEND_MODE / BACKEND_WORKERS 等见 services/server.py
+    run_server(app)
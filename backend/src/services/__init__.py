@@ -0,0 +1 @@
+# 后端服务模块（上游连接、缓存等与路由无关的基础设施）
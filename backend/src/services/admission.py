@@ -0,0 +1,423 @@
+"""上游请求准入控制
+
+每个提供商一个先进先出的等待队列，请求要同时满足三个限制才放行：
+    提供商并发      ADMISSION_CONCURRENCY（ADMISSION_PROVIDER_CONCURRENCY 按提供商覆盖）
+    模型并发        ADMISSION_MODEL_CONCURRENCY，默认与提供商并发相同
+    模型 TPM        ADMISSION_MODEL_TPM 按模型配置的令牌桶；未配置时从上游响应头学习
+令牌按 提示词估算 + max_tokens 预扣，请求结束后按实际用量多退少补；请求失败、
+上游返回错误或在第一个 token 之前取消时全部退还，上游没有报告用量时按预扣的算。
+队列满（ADMISSION_QUEUE_SIZE）时立即拒绝，排队超过 ADMISSION_QUEUE_TIMEOUT 秒也拒绝。
+
+上游响应头（OpenAI 的 x-ratelimit-*，Anthropic 的 anthropic-ratelimit-*）用来
+校准：limit-tokens 作为学到的 TPM，remaining-tokens 压低本地令牌桶，
+remaining-requests 为 0 时暂停该模型到 reset 时间。429 时模型并发减半，
+之后每个成功请求加 1/并发（AIMD），逐步恢复到配置值。
+"""
+import asyncio
+import email.utils
+import os
+import re
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import AsyncIterator, Deque, Dict, Mapping, Optional, Tuple
+
+from services import metrics
+
+
+class AdmissionRejected(Exception):
+    """队列已满或排队超时"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _parse_limits(spec: str) -> Dict[str, int]:
+    """解析 "name=value,name2=value" 格式"""
+    limits = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, value = item.split("=", 1)
+            limits[name.strip()] = int(value)
+    return limits
+
+
+@dataclass(frozen=True)
+class AdmissionSettings:
+    """准入控制配置，并发为 0 表示不限制"""
+    concurrency: int = 32
+    model_concurrency: int = 0
+    queue_size: int = 100
+    queue_timeout: float = 60.0
+    provider_concurrency: Dict[str, int] = field(default_factory=dict)
+    model_tpm: Dict[str, int] = field(default_factory=dict)
+
+    @classmethod
+    def from_env(cls) -> "AdmissionSettings":
+        return cls(
+            concurrency=int(os.getenv("ADMISSION_CONCURRENCY", "32")),
+            model_concurrency=int(os.getenv("ADMISSION_MODEL_CONCURRENCY", "0")),
+            queue_size=int(os.getenv("ADMISSION_QUEUE_SIZE", "100")),
+            queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "60")),
+            provider_concurrency=_parse_limits(os.getenv("ADMISSION_PROVIDER_CONCURRENCY", "")),
+            model_tpm=_parse_limits(os.getenv("ADMISSION_MODEL_TPM", "")),
+        )
+
+    def concurrency_for(self, provider: str) -> int:
+        return self.provider_concurrency.get(provider, self.concurrency)
+
+
+class TokenBucket:
+    """每分钟 capacity 个令牌的令牌桶，允许欠账（实际用量超过预扣时）"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        """还需要等多久才有 tokens 个令牌（超过桶容量的请求按桶容量算）"""
+        self._refill(now)
+        missing = min(tokens, self.capacity) - self.tokens
+        return max(0.0, missing * 60 / self.capacity)
+
+    def take(self, tokens: int) -> None:
+        self.tokens -= tokens
+
+    def resize(self, per_minute: int) -> None:
+        self.capacity = float(per_minute)
+        self.tokens = min(self.tokens, self.capacity)
+
+
+class Limiter:
+    """一个提供商或 (提供商, 模型) 的并发与 TPM 限制"""
+
+    def __init__(self, concurrency: int, tpm: int = 0):
+        self.max_concurrency = concurrency
+        # AIMD 调整后的当前并发上限
+        self.concurrency = float(concurrency)
+        self.in_flight = 0
+        self.bucket = TokenBucket(tpm) if tpm else None
+        self.configured_tpm = tpm
+        self.paused_until = 0.0
+
+    def delay(self, tokens: int, now: float) -> Optional[float]:
+        """0 表示可以放行；>0 表示需要等待的秒数；None 表示等并发槽位释放"""
+        if self.max_concurrency and self.in_flight >= max(1, int(self.concurrency)):
+            return None
+        wait = max(0.0, self.paused_until - now)
+        if self.bucket is not None:
+            wait = max(wait, self.bucket.wait_time(tokens, now))
+        return wait
+
+    def acquire(self, tokens: int) -> None:
+        self.in_flight += 1
+        if self.bucket is not None:
+            self.bucket.take(tokens)
+
+    def release(self, refund: int) -> None:
+        self.in_flight -= 1
+        if self.bucket is not None and refund:
+            self.bucket.take(-refund)
+
+    def on_success(self) -> None:
+        if self.max_concurrency and self.concurrency < self.max_concurrency:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+
+    def on_throttled(self, retry_after: Optional[float]) -> None:
+        if self.max_concurrency:
+            self.concurrency = max(1.0, self.concurrency / 2)
+        if retry_after:
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    def learn_tpm(self, limit: Optional[int], remaining: Optional[int]) -> None:
+        """按上游报告的 TPM 校准令牌桶；显式配置了 TPM 时只会更严格"""
+        if limit:
+            if self.bucket is None:
+                self.bucket = TokenBucket(limit)
+            elif not self.configured_tpm or limit < self.configured_tpm:
+                self.bucket.resize(limit)
+        if remaining is not None and self.bucket is not None:
+            self.bucket.tokens = min(self.bucket.tokens, remaining)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "concurrency": round(self.concurrency, 2) if self.max_concurrency else None,
+            "max_concurrency": self.max_concurrency or None,
+            "tpm": int(self.bucket.capacity) if self.bucket is not None else None,
+            "tokens_available": int(self.bucket.tokens) if self.bucket is not None else None,
+            "paused_for": round(max(0.0, self.paused_until - time.monotonic()), 2),
+        }
+
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def _parse_reset(value: Optional[str]) -> Optional[float]:
+    """解析 reset 头：OpenAI 用 "6m0s"/"20ms" 这样的时长，Anthropic 用 RFC 3339 时间"""
+    if not value:
+        return None
+    value = value.strip()
+    parts = _DURATION_PART.findall(value)
+    if parts and "".join(n + u for n, u in parts) == value:
+        return sum(float(n) * _DURATION_UNITS[u] for n, u in parts)
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp() - time.time())
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _header_int(headers: Mapping[str, str], *names: str) -> Optional[int]:
+    for name in names:
+        value = headers.get(name)
+        if value:
+            try:
+                return int(float(value))
+            except ValueError:
+                continue
+    return None
+
+
+def _header(headers: Mapping[str, str], *names: str) -> Optional[str]:
+    for name in names:
+        value = headers.get(name)
+        if value:
+            return value
+    return None
+
+
+def used_tokens(usage: Optional[dict]) -> Optional[int]:
+    """上游 usage 中的总 token 数（OpenAI 与 Anthropic 两种字段名）；没有 usage 时返回 None"""
+    if not usage:
+        return None
+    return usage.get("total_tokens") or (
+        (usage.get("prompt_tokens") or usage.get("input_tokens") or 0)
+        + (usage.get("completion_tokens") or usage.get("output_tokens") or 0)
+    )
+
+
+class _Waiter:
+    __slots__ = ("model", "tokens", "admitted", "position", "changed")
+
+    def __init__(self, model: str, tokens: int):
+        self.model = model
+        self.tokens = tokens
+        self.admitted = False
+        self.position = 0
+        self.changed = asyncio.Event()
+
+
+class _ProviderQueue:
+    def __init__(self, provider: str, limiter: Limiter):
+        self.provider = provider
+        self.limiter = limiter
+        self.waiters: Deque[_Waiter] = deque()
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class Ticket:
+    """一次被放行的上游请求；结束时必须 release"""
+
+    def __init__(self, controller: "AdmissionController", provider: str, model: str, tokens: int):
+        self._controller = controller
+        self.provider = provider
+        self.model = model
+        self.tokens = tokens
+        self._released = False
+
+    def observe(self, status_code: int, headers: Mapping[str, str]) -> None:
+        """根据上游响应校准限制"""
+        self._controller.observe(self.provider, self.model, status_code, headers)
+
+    def release(self, used_tokens: Optional[int] = None) -> None:
+        """used_tokens 为实际用量；0 表示没有消耗（全部退还），None 表示未知（按预扣的算）"""
+        if self._released:
+            return
+        self._released = True
+        refund = 0 if used_tokens is None else self.tokens - used_tokens
+        self._controller._release(self.provider, self.model, refund)
+
+
+class AdmissionController:
+    """按提供商排队、按提供商和模型限流"""
+
+    def __init__(self, settings: Optional[AdmissionSettings] = None):
+        self.settings = settings or AdmissionSettings.from_env()
+        self._queues: Dict[str, _ProviderQueue] = {}
+        self._models: Dict[Tuple[str, str], Limiter] = {}
+
+    def _queue(self, provider: str) -> _ProviderQueue:
+        queue = self._queues.get(provider)
+        if queue is None:
+            queue = self._queues[provider] = _ProviderQueue(
+                provider, Limiter(self.settings.concurrency_for(provider)))
+        return queue
+
+    def _model(self, provider: str, model: str) -> Limiter:
+        limiter = self._models.get((provider, model))
+        if limiter is None:
+            concurrency = self.settings.model_concurrency or self.settings.concurrency_for(provider)
+            limiter = self._models[(provider, model)] = Limiter(concurrency, self.settings.model_tpm.get(model, 0))
+        return limiter
+
+    def check(self, provider: str) -> None:
+        """队列已满时立即拒绝（在开始推流之前调用，以便返回 429 状态码）"""
+        queue = self._queues.get(provider)
+        if queue is not None and len(queue.waiters) >= self.settings.queue_size:
+            metrics.admission_rejected.inc(provider, "queue_full")
+            raise AdmissionRejected(f"{provider} 请求排队已满，请稍后重试", self._retry_hint(queue))
+
+    async def admit(self, provider: str, model: str, tokens: int) -> AsyncIterator[object]:
+        """排队直到放行：等待期间产出排队位置（int），最后产出 Ticket
+
+        队列满或超时抛出 AdmissionRejected；迭代被中断时自动退出队列。
+        """
+        self.check(provider)
+        queue = self._queue(provider)
+        waiter = _Waiter(model, tokens)
+        queue.waiters.append(waiter)
+        self._pump(queue)
+        started = time.monotonic()
+        deadline = started + self.settings.queue_timeout
+        try:
+            while not waiter.admitted:
+                yield waiter.position
+                waiter.changed.clear()
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError
+                    await asyncio.wait_for(waiter.changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    if waiter.admitted:
+                        break
+                    metrics.admission_rejected.inc(provider, "timeout")
+                    raise AdmissionRejected(
+                        f"{provider} 请求排队超过 {self.settings.queue_timeout:.0f} 秒，请稍后重试",
+                        self._retry_hint(queue),
+                    )
+        except BaseException:
+            if waiter.admitted:
+                self._release(provider, model, tokens)
+            else:
+                queue.waiters.remove(waiter)
+                self._pump(queue)
+            raise
+        metrics.admission_wait_seconds.observe(time.monotonic() - started, provider)
+        yield Ticket(self, provider, model, tokens)
+
+    async def acquire(self, provider: str, model: str, tokens: int) -> Ticket:
+        """非流式请求：等待放行，不关心排队位置"""
+        async for item in self.admit(provider, model, tokens):
+            if isinstance(item, Ticket):
+                return item
+        raise RuntimeError("准入队列没有返回票据")
+
+    def _pump(self, queue: _ProviderQueue) -> None:
+        """按先后顺序放行当前能放行的请求；某个模型被 TPM 挡住时，它后面的同模型请求不插队"""
+        if queue.timer is not None:
+            queue.timer.cancel()
+            queue.timer = None
+        now = time.monotonic()
+        wake: Optional[float] = None
+        provider_full = False
+        blocked_models = set()
+        position = 0
+        for waiter in list(queue.waiters):
+            if not provider_full and waiter.model not in blocked_models:
+                if queue.limiter.delay(0, now) is None:
+                    # 提供商并发已满，后面的都要等槽位释放
+                    provider_full = True
+                else:
+                    limiter = self._model(queue.provider, waiter.model)
+                    delay = limiter.delay(waiter.tokens, now)
+                    if delay == 0:
+                        queue.waiters.remove(waiter)
+                        queue.limiter.acquire(0)
+                        limiter.acquire(waiter.tokens)
+                        waiter.admitted = True
+                        waiter.changed.set()
+                        continue
+                    blocked_models.add(waiter.model)
+                    if delay is not None:
+                        wake = delay if wake is None else min(wake, delay)
+            position += 1
+            self._set_position(waiter, position)
+        if wake is not None:
+            queue.timer = asyncio.get_running_loop().call_later(wake, self._pump, queue)
+
+    @staticmethod
+    def _set_position(waiter: _Waiter, position: int) -> None:
+        if waiter.position != position:
+            waiter.position = position
+            waiter.changed.set()
+
+    def _release(self, provider: str, model: str, refund: int) -> None:
+        queue = self._queue(provider)
+        queue.limiter.release(0)
+        self._model(provider, model).release(refund)
+        self._pump(queue)
+
+    def observe(self, provider: str, model: str, status_code: int, headers: Mapping[str, str]) -> None:
+        limiter = self._model(provider, model)
+        limiter.learn_tpm(
+            _header_int(headers, "x-ratelimit-limit-tokens", "anthropic-ratelimit-tokens-limit"),
+            _header_int(headers, "x-ratelimit-remaining-tokens", "anthropic-ratelimit-tokens-remaining"),
+        )
+        remaining_requests = _header_int(headers, "x-ratelimit-remaining-requests",
+                                         "anthropic-ratelimit-requests-remaining")
+        if status_code == 429:
+            retry_after = _parse_reset(_header(headers, "retry-after")) or _parse_reset(
+                _header(headers, "x-ratelimit-reset-tokens", "anthropic-ratelimit-tokens-reset"))
+            limiter.on_throttled(retry_after)
+            metrics.admission_throttled.inc(provider, model)
+        elif status_code < 400:
+            limiter.on_success()
+            if remaining_requests == 0:
+                limiter.on_throttled(None)
+                reset = _parse_reset(_header(headers, "x-ratelimit-reset-requests",
+                                             "anthropic-ratelimit-requests-reset"))
+                if reset:
+                    limiter.paused_until = max(limiter.paused_until, time.monotonic() + reset)
+        self._pump(self._queue(provider))
+
+    def _retry_hint(self, queue: _ProviderQueue) -> float:
+        now = time.monotonic()
+        paused = [limiter.paused_until - now for (p, _), limiter in self._models.items() if p == queue.provider]
+        return max([1.0] + paused)
+
+    def stats(self) -> dict:
+        providers = {}
+        for provider, queue in self._queues.items():
+            providers[provider] = {
+                "queued": len(queue.waiters),
+                **queue.limiter.stats(),
+                "models": {
+                    model: limiter.stats()
+                    for (p, model), limiter in self._models.items() if p == provider
+                },
+            }
+        return {
+            "queue_size": self.settings.queue_size,
+            "queue_timeout": self.settings.queue_timeout,
+            "providers": providers,
+        }
+
+
+admission_controller = AdmissionController()
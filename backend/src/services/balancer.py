@@ -0,0 +1,232 @@
+"""同一提供商多个端点/密钥之间的负载均衡
+
+提供商配置里可以给出一组端点：
+    {"endpoints": [{"base_url": "...", "api_key": "...", "weight": 2}, ...]}
+每次向上游发送请求（包括重试和对冲）都重新选择端点：
+    least_in_flight（默认）  (在途请求数 + 1) / 权重 最小者
+    ewma                   响应头延迟的 EWMA × (在途请求数 + 1) / 权重 最小者，
+                           还没有样本的端点优先
+返回 401/403（密钥无效或被吊销）、429、5xx 或连接失败的端点会被暂时摘除，
+时长按连续失败次数指数增长，并且不短于响应里的 Retry-After；所有端点都被
+摘除时直接拒绝，告诉调用方最早什么时候可以重试。
+"""
+import os
+import random
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+import httpx
+
+from services.model_catalog import key_fingerprint
+from services.resilience import retry_after_seconds
+
+STRATEGY_LEAST_IN_FLIGHT = "least_in_flight"
+STRATEGY_EWMA = "ewma"
+STRATEGIES = (STRATEGY_LEAST_IN_FLIGHT, STRATEGY_EWMA)
+# 除 5xx 外需要摘除端点的状态码：认证失败和限流
+_EJECT_STATUSES = frozenset((401, 403, 429))
+
+
+class NoEndpointAvailable(Exception):
+    """所有端点都处于摘除状态"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"所有端点暂时不可用，请在 {retry_after:.0f} 秒后重试")
+        self.retry_after = retry_after
+
+
+class InvalidEndpoints(ValueError):
+    """endpoints 配置格式不对"""
+
+
+class Endpoint:
+    """池中的一个 (base_url, api_key) 端点"""
+
+    __slots__ = ("base_url", "api_key", "weight", "config", "in_flight", "ewma", "ejected_until",
+                 "consecutive_failures", "successes", "failures", "last_status")
+
+    def __init__(self, base_url: str, api_key: str, weight: float, model: str = ""):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.weight = weight if weight > 0 else 1.0
+        # 交给 get_adapter 的配置
+        self.config = {"base_url": base_url, "api_key": api_key, "model": model}
+        self.in_flight = 0
+        self.ewma: Optional[float] = None
+        self.ejected_until = 0.0
+        self.consecutive_failures = 0
+        self.successes = 0
+        self.failures = 0
+        self.last_status: Optional[int] = None
+
+    def stats(self, now: float) -> dict:
+        return {
+            "base_url": self.base_url,
+            "key": key_fingerprint(self.api_key),
+            "weight": self.weight,
+            "in_flight": self.in_flight,
+            "ewma_ms": round(self.ewma * 1000, 2) if self.ewma is not None else None,
+            "ejected_for": round(max(0.0, self.ejected_until - now), 2),
+            "consecutive_failures": self.consecutive_failures,
+            "successes": self.successes,
+            "failures": self.failures,
+            "last_status": self.last_status,
+        }
+
+
+class EndpointPool:
+    """一个提供商配置下的端点池"""
+
+    def __init__(self, endpoints: List[Endpoint], strategy: str = STRATEGY_LEAST_IN_FLIGHT,
+                 base_ejection: float = 5.0, max_ejection: float = 300.0, ewma_alpha: float = 0.3):
+        self.endpoints = endpoints
+        self.strategy = strategy if strategy in STRATEGIES else STRATEGY_LEAST_IN_FLIGHT
+        self.base_ejection = base_ejection
+        self.max_ejection = max_ejection
+        self.ewma_alpha = ewma_alpha
+
+    def _score(self, endpoint: Endpoint) -> float:
+        load = (endpoint.in_flight + 1) / endpoint.weight
+        if self.strategy == STRATEGY_EWMA:
+            return (endpoint.ewma or 0.0) * load
+        return load
+
+    def acquire(self) -> Endpoint:
+        """选出一个端点并计入在途请求"""
+        now = time.monotonic()
+        candidates = [e for e in self.endpoints if e.ejected_until <= now]
+        if not candidates:
+            raise NoEndpointAvailable(min(e.ejected_until for e in self.endpoints) - now)
+        best = min(self._score(e) for e in candidates)
+        endpoint = random.choice([e for e in candidates if self._score(e) == best])
+        endpoint.in_flight += 1
+        return endpoint
+
+    def release(self, endpoint: Endpoint) -> None:
+        endpoint.in_flight -= 1
+
+    def record(self, endpoint: Endpoint, status: Optional[int] = None, latency: Optional[float] = None,
+               retry_after: Optional[float] = None) -> None:
+        """记录一次结果；status 为 None 表示连接失败"""
+        endpoint.last_status = status
+        if status is not None and status not in _EJECT_STATUSES and status < 500:
+            endpoint.successes += 1
+            endpoint.consecutive_failures = 0
+            if latency is not None:
+                endpoint.ewma = latency if endpoint.ewma is None else (
+                    self.ewma_alpha * latency + (1 - self.ewma_alpha) * endpoint.ewma)
+            return
+
+        endpoint.failures += 1
+        endpoint.consecutive_failures += 1
+        duration = min(self.max_ejection, self.base_ejection * 2 ** (endpoint.consecutive_failures - 1))
+        if retry_after is not None:
+            duration = max(duration, retry_after)
+        endpoint.ejected_until = time.monotonic() + duration
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {"strategy": self.strategy, "endpoints": [e.stats(now) for e in self.endpoints]}
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """响应关闭时归还端点的在途计数"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._release is not None:
+                release, self._release = self._release, None
+                release()
+
+
+async def send_via(pool: EndpointPool, send: Callable[[Endpoint], Awaitable[httpx.Response]]) -> httpx.Response:
+    """通过池中选出的端点发送一次请求，并记录结果"""
+    endpoint = pool.acquire()
+    started = time.perf_counter()
+    try:
+        response = await send(endpoint)
+    except httpx.TransportError:
+        pool.record(endpoint)
+        pool.release(endpoint)
+        raise
+    except BaseException:
+        pool.release(endpoint)
+        raise
+    pool.record(endpoint, response.status_code, time.perf_counter() - started, retry_after_seconds(response))
+    if response.is_closed:
+        pool.release(endpoint)
+    else:
+        stream = response.stream
+        assert isinstance(stream, httpx.AsyncByteStream)
+        response.stream = _ReleasingStream(stream, lambda: pool.release(endpoint))
+    return response
+
+
+PoolKey = Tuple[str, str, Tuple[Tuple[str, str, float], ...]]
+
+
+def _signature(endpoints) -> Tuple[Tuple[str, str, float], ...]:
+    """校验 endpoints 并转换成池的键；格式不对时抛出 InvalidEndpoints"""
+    if not isinstance(endpoints, list) or not all(isinstance(e, dict) for e in endpoints):
+        raise InvalidEndpoints("endpoints 应为对象数组，每项包含 base_url、api_key 和可选的 weight")
+    try:
+        return tuple(
+            (str(e.get("base_url") or ""), str(e.get("api_key") or ""), float(e.get("weight") or 1.0))
+            for e in endpoints
+        )
+    except (TypeError, ValueError):
+        raise InvalidEndpoints("endpoints 的 weight 应为数字")
+
+
+class LoadBalancer:
+    """按提供商配置缓存端点池，配置不变时保留端点的统计和摘除状态"""
+
+    def __init__(self, max_pools: int = 64):
+        self.default_strategy = os.getenv("UPSTREAM_BALANCER", STRATEGY_LEAST_IN_FLIGHT)
+        self.base_ejection = float(os.getenv("UPSTREAM_EJECTION_SECONDS", "5"))
+        self.max_ejection = float(os.getenv("UPSTREAM_MAX_EJECTION_SECONDS", "300"))
+        self.max_pools = max_pools
+        self._pools: "OrderedDict[PoolKey, EndpointPool]" = OrderedDict()
+
+    def pool_for(self, provider: str, config: dict) -> Optional[EndpointPool]:
+        """配置里有 endpoints 时返回端点池，否则返回 None（单端点，不做均衡）；endpoints 格式不对时抛出 InvalidEndpoints"""
+        endpoints = config.get("endpoints")
+        if not endpoints:
+            return None
+        strategy = config.get("balancer") or self.default_strategy
+        signature = _signature(endpoints)
+        key = (provider, strategy, signature)
+        pool = self._pools.get(key)
+        if pool is not None:
+            self._pools.move_to_end(key)
+            return pool
+
+        model = config.get("model", "")
+        pool = EndpointPool(
+            [Endpoint(base_url, api_key, weight, model) for base_url, api_key, weight in signature],
+            strategy, self.base_ejection, self.max_ejection,
+        )
+        self._pools[key] = pool
+        if len(self._pools) > self.max_pools:
+            self._pools.popitem(last=False)
+        return pool
+
+    def stats(self) -> list:
+        return [
+            {"provider": provider, **pool.stats()}
+            for (provider, _, _), pool in self._pools.items()
+        ]
+
+
+load_balancer = LoadBalancer()
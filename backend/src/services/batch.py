@@ -0,0 +1,195 @@
+"""批量聊天请求
+
+输入是 (序号, 请求) 的异步迭代器，按提供商限制并发执行，结果按完成顺序
+逐条产出。同时在途的条目数有上限（读取输入也随之暂停），结果产出后即丢弃，
+所以一万条的批次也只占用与并发数成正比的内存。
+
+JSONL 上传先落到临时文件（小于 1MB 时留在内存），推流开始后再逐行读取：
+流式响应期间 Starlette 会占用 receive 监听断开，不能边读请求体边返回结果。
+
+批次可以通过 cancel() 整体取消：停止读取输入，取消所有在途条目，
+最后仍会产出一条汇总。
+"""
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass
+from functools import partial
+from typing import IO, AsyncIterator, Awaitable, Callable, Dict, Iterator, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class BatchSettings:
+    """批量请求配置"""
+    concurrency: int = 8
+    max_concurrency: int = 64
+    max_items: int = 10000
+
+    @classmethod
+    def from_env(cls) -> "BatchSettings":
+        return cls(
+            concurrency=int(os.getenv("BATCH_CONCURRENCY", "8")),
+            max_concurrency=int(os.getenv("BATCH_MAX_CONCURRENCY", "64")),
+            max_items=int(os.getenv("BATCH_MAX_ITEMS", "10000")),
+        )
+
+    def clamp(self, concurrency: Optional[int]) -> int:
+        return max(1, min(concurrency or self.concurrency, self.max_concurrency))
+
+
+async def spool_upload(chunks: AsyncIterator[bytes], max_memory: int = 1024 * 1024) -> IO[bytes]:
+    """把上传内容写入临时文件，返回已回到开头的文件对象"""
+    spool = tempfile.SpooledTemporaryFile(max_size=max_memory)
+    async for chunk in chunks:
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+def jsonl_lines(spool: IO[bytes]) -> Iterator[Tuple[int, bytes]]:
+    """逐行读取 JSONL，跳过空行，产出 (序号, 行内容)"""
+    index = 0
+    for line in spool:
+        line = line.strip()
+        if line:
+            yield index, line
+            index += 1
+    spool.close()
+
+
+# 处理一条请求：参数为 (序号, 请求)，返回结果行，其中 status 为 ok 或 error
+Handler = Callable[[int, object], Awaitable[dict]]
+
+
+class BatchRun:
+    """一个正在执行的批次"""
+
+    def __init__(self, concurrency: int, max_items: int):
+        self.id = uuid.uuid4().hex
+        self.concurrency = concurrency
+        self.max_items = max_items
+        self.started = time.time()
+        self.submitted = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.cancelled_items = 0
+        self.cancelled = False
+        self._tasks: set = set()
+        self._producer: Optional[asyncio.Task] = None
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        if self._producer is not None:
+            self._producer.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+
+    async def run(self, items: AsyncIterator[Tuple[int, object]], provider_of: Callable[[object], str],
+                  handle: Handler) -> AsyncIterator[dict]:
+        """执行批次，按完成顺序产出每条结果，最后产出汇总"""
+        results: asyncio.Queue = asyncio.Queue()
+        # 每个提供商各自的并发上限；window 限制总的在途条目数，也就限制了输入的读取速度
+        semaphores: Dict[str, asyncio.Semaphore] = {}
+        window = asyncio.Semaphore(self.concurrency * 4)
+
+        async def execute(index: int, item: object, provider: str) -> None:
+            async with semaphores.setdefault(provider, asyncio.Semaphore(self.concurrency)):
+                results.put_nowait(await handle(index, item))
+
+        def finished(index: int, task: asyncio.Task) -> None:
+            self._tasks.discard(task)
+            window.release()
+            # 还没开始执行就被取消的任务也要有一行结果
+            if task.cancelled():
+                results.put_nowait({"type": "result", "index": index, "status": "cancelled"})
+            elif task.exception() is not None:
+                results.put_nowait({"type": "result", "index": index, "status": "error",
+                                    "status_code": 500, "error": str(task.exception())})
+
+        async def produce() -> None:
+            try:
+                async for index, item in items:
+                    if self.submitted >= self.max_items:
+                        results.put_nowait({
+                            "type": "error", "index": index,
+                            "error": f"批次最多 {self.max_items} 条，其余条目未执行",
+                        })
+                        break
+                    await window.acquire()
+                    self.submitted += 1
+                    task = asyncio.ensure_future(execute(index, item, provider_of(item)))
+                    self._tasks.add(task)
+                    task.add_done_callback(partial(finished, index))
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                # 输入读取失败（如上传中断）：已提交的条目继续执行
+                results.put_nowait({"type": "error", "error": f"读取批量输入失败: {e}"})
+            while self._tasks:
+                try:
+                    await asyncio.wait(set(self._tasks))
+                except asyncio.CancelledError:
+                    # 等待期间批次被取消，在途条目已一并取消，继续等它们结束
+                    continue
+            results.put_nowait(None)
+
+        self._producer = asyncio.ensure_future(produce())
+        try:
+            while True:
+                result = await results.get()
+                if result is None:
+                    break
+                if result.get("status") == "ok":
+                    self.succeeded += 1
+                elif result.get("status") == "error":
+                    self.failed += 1
+                elif result.get("status") == "cancelled":
+                    self.cancelled_items += 1
+                yield result
+        finally:
+            if not self._producer.done():
+                # 客户端断开：取消整个批次
+                self.cancel()
+        yield self.summary()
+
+    def summary(self) -> dict:
+        return {
+            "type": "summary",
+            "batch_id": self.id,
+            "submitted": self.submitted,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "cancelled_items": self.cancelled_items,
+            "cancelled": self.cancelled,
+            "elapsed": round(time.time() - self.started, 3),
+        }
+
+
+class BatchRegistry:
+    """正在执行的批次，用于按 id 取消和查询进度"""
+
+    def __init__(self, settings: Optional[BatchSettings] = None):
+        self.settings = settings or BatchSettings.from_env()
+        self._runs: Dict[str, BatchRun] = {}
+
+    def create(self, concurrency: Optional[int] = None) -> BatchRun:
+        run = BatchRun(self.settings.clamp(concurrency), self.settings.max_items)
+        self._runs[run.id] = run
+        return run
+
+    def finish(self, run: BatchRun) -> None:
+        self._runs.pop(run.id, None)
+
+    def get(self, batch_id: str) -> Optional[BatchRun]:
+        return self._runs.get(batch_id)
+
+    def stats(self) -> list:
+        return [
+            {**run.summary(), "concurrency": run.concurrency, "in_flight": len(run._tasks)}
+            for run in self._runs.values()
+        ]
+
+
+batch_registry = BatchRegistry()
@@ -0,0 +1,132 @@
+"""相同聊天请求的在途合并
+
+用户重复提交、或多个窗口同时发送同一个提示时，只向上游发起一次生成：
+- 非流式请求共享同一个 future（见 services/singleflight.py）
+- 流式请求共享同一个上游流，后加入的订阅者先收到已经产生的片段，再跟随实时输出
+
+只对 COALESCE_PROVIDERS 中列出的提供商生效；温度非零的请求默认不合并，
+除非设置 COALESCE_ALLOW_NONZERO_TEMPERATURE=true。
+"""
+import asyncio
+import os
+from typing import AsyncGenerator, AsyncIterator, Callable, Dict, Hashable, List, Optional
+
+from services.singleflight import SingleFlight
+
+
+class CoalescingPolicy:
+    """哪些请求允许合并"""
+
+    def __init__(self, providers: frozenset = frozenset(), allow_nonzero_temperature: bool = False):
+        self.providers = providers
+        self.allow_nonzero_temperature = allow_nonzero_temperature
+
+    @classmethod
+    def from_env(cls) -> "CoalescingPolicy":
+        providers = frozenset(
+            p.strip() for p in os.getenv("COALESCE_PROVIDERS", "").split(",") if p.strip()
+        )
+        allow = os.getenv("COALESCE_ALLOW_NONZERO_TEMPERATURE", "false").lower() == "true"
+        return cls(providers, allow)
+
+    def enabled_for(self, request) -> bool:
+        if "*" not in self.providers and request.provider not in self.providers:
+            return False
+        return request.temperature == 0 or self.allow_nonzero_temperature
+
+
+class StreamBroadcast:
+    """一个上游流，多个订阅者"""
+
+    def __init__(self, source: AsyncIterator[dict]):
+        self._source = source
+        self.chunks: List[dict] = []
+        self.done = False
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self._task = asyncio.ensure_future(self._pump())
+
+    async def _pump(self) -> None:
+        try:
+            async for chunk in self._source:
+                self.chunks.append(chunk)
+                self._notify()
+        except Exception as e:
+            self.chunks.append({"error": True, "message": f"流式聊天请求失败: {str(e)}"})
+        finally:
+            self.done = True
+            self._notify()
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def add_done_callback(self, callback: Callable[[asyncio.Task], None]) -> None:
+        self._task.add_done_callback(callback)
+
+    async def subscribe(self) -> AsyncGenerator[dict, None]:
+        """从头回放已产生的片段，然后跟随实时输出"""
+        self.subscribers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(self.chunks):
+                    yield self.chunks[index]
+                    index += 1
+                if self.done:
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            # 最后一个订阅者离开时，停止上游生成
+            if self.subscribers == 0 and not self.done:
+                self._task.cancel()
+
+
+class RequestCoalescer:
+    """在途请求注册表"""
+
+    def __init__(self, policy: Optional[CoalescingPolicy] = None):
+        self.policy = policy or CoalescingPolicy.from_env()
+        self._flights = SingleFlight()
+        self._streams: Dict[Hashable, StreamBroadcast] = {}
+        self.counters = {"requests_started": 0, "requests_joined": 0, "streams_started": 0, "streams_joined": 0}
+
+    def enabled_for(self, request) -> bool:
+        return self.policy.enabled_for(request)
+
+    async def run(self, key: Hashable, fn):
+        """合并非流式请求"""
+        if self._flights.in_flight(key):
+            self.counters["requests_joined"] += 1
+        else:
+            self.counters["requests_started"] += 1
+        return await self._flights.do(key, fn)
+
+    def stream(self, key: Hashable, factory: Callable[[], AsyncIterator[dict]]) -> AsyncGenerator[dict, None]:
+        """合并流式请求，返回当前调用者的订阅"""
+        broadcast = self._streams.get(key)
+        if broadcast is None or broadcast.done:
+            broadcast = StreamBroadcast(factory())
+            self._streams[key] = broadcast
+            broadcast.add_done_callback(lambda _: self._forget(key, broadcast))
+            self.counters["streams_started"] += 1
+        else:
+            self.counters["streams_joined"] += 1
+        return broadcast.subscribe()
+
+    def _forget(self, key: Hashable, broadcast: StreamBroadcast) -> None:
+        if self._streams.get(key) is broadcast:
+            del self._streams[key]
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "in_flight_requests": len(self._flights),
+            "in_flight_streams": len(self._streams),
+            "providers": sorted(self.policy.providers),
+            "allow_nonzero_temperature": self.policy.allow_nonzero_temperature,
+        }
+
+
+request_coalescer = RequestCoalescer()
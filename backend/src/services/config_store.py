@@ -0,0 +1,167 @@
+"""持久化的 API 配置
+
+POST /api/config 保存的配置写入 SQLite（WAL 模式），多个 uvicorn 工作进程共用
+同一个文件，重启后仍然有效。API 密钥（包括 endpoints 里的）加密后存储，
+见 services/secret_box.py。
+
+读取走进程内缓存：get() 距离上次检查超过 CONFIG_CHECK_INTERVAL_MS（默认 5）
+时查询一次 PRAGMA data_version，其他连接（其他工作进程）提交过修改时该值会变化，
+这时重新加载全部配置；本进程的写入直接更新缓存。其余时候只是一次字典查找。
+
+打开失败（主密钥无效、数据目录不可写等）时存储不可用：get() 不再重试，直接返回
+None，聊天回退到环境变量里的默认配置；保存配置时会重新尝试打开并返回错误。
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from services.secret_box import SecretBox, SecretError
+from services.storage import data_path
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ConfigStoreSettings:
+    """配置存储设置"""
+    db_path: Optional[str] = None
+    key_file: Optional[str] = None
+    # 两次检查其他进程修改之间的最短间隔（秒）
+    check_interval: float = 0.005
+
+    @classmethod
+    def from_env(cls) -> "ConfigStoreSettings":
+        return cls(
+            db_path=os.getenv("CONFIG_DB") or None,
+            key_file=os.getenv("CONFIG_KEY_FILE") or None,
+            check_interval=float(os.getenv("CONFIG_CHECK_INTERVAL_MS", "5")) / 1000,
+        )
+
+
+class ConfigStore:
+    """SQLite 配置存储 + 进程内缓存"""
+
+    def __init__(self, settings: Optional[ConfigStoreSettings] = None):
+        self.settings = settings or ConfigStoreSettings.from_env()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._box: Optional[SecretBox] = None
+        # provider -> 解密后的配置；整体替换，读取方不需要加锁
+        self._cache: Dict[str, dict] = {}
+        self._version: Optional[int] = None
+        self._checked = float("-inf")
+        # 打开失败的原因；成功打开后清空
+        self.error: Optional[str] = None
+
+    # ---- SQLite 层 ----
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            try:
+                self._box = SecretBox.from_env(self.settings.key_file)
+                path = self.settings.db_path or data_path("config.sqlite3")
+                db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS provider_configs ("
+                    " provider TEXT PRIMARY KEY,"
+                    " value TEXT NOT NULL,"
+                    " updated_at REAL NOT NULL)"
+                )
+                db.commit()
+            except (SecretError, sqlite3.Error, OSError) as e:
+                self.error = str(e)
+                raise
+            self._db = db
+            self.error = None
+        return self._db
+
+    def _transform_keys(self, config: dict, convert) -> dict:
+        """对 api_key 和各端点的 api_key 应用 convert，返回新的字典"""
+        result = dict(config)
+        if "api_key" in result:
+            result["api_key"] = convert(result["api_key"] or "")
+        if result.get("endpoints"):
+            result["endpoints"] = [
+                {**endpoint, "api_key": convert(endpoint.get("api_key") or "")} for endpoint in result["endpoints"]
+            ]
+        return result
+
+    def _decrypt(self, provider: str, token: str) -> str:
+        assert self._box is not None
+        try:
+            return self._box.decrypt(token)
+        except SecretError as e:
+            logger.warning("%s 的 API 密钥无法解密，按未配置处理: %s", provider, e)
+            return ""
+
+    def _reload_if_changed(self) -> None:
+        """调用方持有 _db_lock"""
+        db = self._connect()
+        version = db.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._version:
+            return
+        configs = {}
+        for provider, value in db.execute("SELECT provider, value FROM provider_configs"):
+            configs[provider] = self._transform_keys(
+                json.loads(value), lambda token, provider=provider: self._decrypt(provider, token)
+            )
+        self._cache = configs
+        self._version = version
+
+    def _refresh(self) -> None:
+        with self._db_lock:
+            self._reload_if_changed()
+
+    def _save(self, provider: str, config: dict) -> None:
+        with self._db_lock:
+            db = self._connect()
+            assert self._box is not None
+            encoded = json.dumps(self._transform_keys(config, self._box.encrypt), ensure_ascii=False)
+            with db:
+                db.execute(
+                    "INSERT INTO provider_configs (provider, value, updated_at) VALUES (?, ?, ?)"
+                    " ON CONFLICT(provider) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                    (provider, encoded, time.time()),
+                )
+            self._cache = {**self._cache, provider: config}
+
+    # ---- 对外接口 ----
+    async def open(self) -> None:
+        """提前打开数据库并加载配置，启动时调用"""
+        await asyncio.to_thread(self._refresh)
+
+    def get(self, provider: str) -> Optional[dict]:
+        """已保存的配置；没有时返回 None"""
+        if self._db is None and self.error is not None:
+            # 打开失败过：不在每次读取时重试，保存配置时再重新打开
+            return None
+        now = time.monotonic()
+        # 没有其他进程修改时只是一次 PRAGMA，直接在调用方线程执行；
+        # 本进程正在写入时不等锁，先用缓存，下次再检查
+        if now - self._checked >= self.settings.check_interval and self._db_lock.acquire(blocking=False):
+            self._checked = now
+            try:
+                self._reload_if_changed()
+            except (SecretError, sqlite3.Error, OSError, ValueError) as e:
+                logger.warning("读取配置存储失败，使用缓存: %s", e)
+            finally:
+                self._db_lock.release()
+        return self._cache.get(provider)
+
+    async def save(self, provider: str, config: dict) -> None:
+        await asyncio.to_thread(self._save, provider, dict(config))
+
+    def close(self) -> None:
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+config_store = ConfigStore()
@@ -0,0 +1,222 @@
+"""按 token 预算拼接上下文
+
+每条消息的 token 数用离线的近似分词器估算（不依赖 tiktoken 等模型文件），
+结果按内容哈希缓存，同一条历史消息在后续轮次里不会重复计算。拼接时保留全部
+system 消息，再从最新的消息往前取尽可能长的后缀，使总量不超过
+模型上下文窗口 - max_tokens；被丢弃的消息数和 token 数会报告给调用方。
+
+已缓存的消息只需一次字典查找，几百轮的会话拼接耗时在亚毫秒级。
+"""
+import math
+import os
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# 中日韩文字、全角符号：大致一个字符一个 token
+_CJK_PATTERN = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+
+
+class ApproximateTokenizer:
+    """近似分词器：CJK 字符按字计数，其余按平均每 token 字符数折算"""
+
+    def __init__(self, name: str, chars_per_token: float = 4.0, tokens_per_cjk: float = 1.0,
+                 tokens_per_message: int = 4, reply_overhead: int = 3, cache_size: int = 16384):
+        self.name = name
+        self.chars_per_token = chars_per_token
+        self.tokens_per_cjk = tokens_per_cjk
+        self.tokens_per_message = tokens_per_message
+        self.reply_overhead = reply_overhead
+        self.cache_size = cache_size
+        # (长度, 内容哈希) -> token 数
+        self._cache: "OrderedDict[Tuple[int, int], int]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def count_text(self, text: str) -> int:
+        if not text:
+            return 0
+        cjk = len(_CJK_PATTERN.findall(text))
+        other = len(text) - cjk
+        return math.ceil(cjk * self.tokens_per_cjk + other / self.chars_per_token)
+
+    def count_message(self, role: str, content: str) -> int:
+        """单条消息的 token 数（含角色和分隔符开销），按内容哈希缓存"""
+        key = (len(content), hash(content))
+        tokens = self._cache.get(key)
+        if tokens is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+        else:
+            self.misses += 1
+            tokens = self.count_text(content)
+            self._cache[key] = tokens
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tokens + self.tokens_per_message
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._cache),
+        }
+
+
+# provider -> 分词器；Claude 的分词比 cl100k 略碎
+TOKENIZERS: Dict[str, ApproximateTokenizer] = {
+    "openai": ApproximateTokenizer("openai", chars_per_token=4.0, tokens_per_cjk=1.0),
+    "anthropic": ApproximateTokenizer("anthropic", chars_per_token=3.5, tokens_per_cjk=1.2,
+                                      tokens_per_message=3, reply_overhead=1),
+}
+_DEFAULT_TOKENIZER = ApproximateTokenizer("default", chars_per_token=3.5, tokens_per_cjk=1.0)
+
+
+def get_tokenizer(provider: str) -> ApproximateTokenizer:
+    return TOKENIZERS.get(provider, _DEFAULT_TOKENIZER)
+
+
+# 模型名前缀 -> 上下文窗口（按最长前缀匹配）
+CONTEXT_WINDOWS: Dict[str, int] = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4.1": 1047576,
+    "o1": 200000,
+    "o3": 200000,
+    "o4": 200000,
+    "claude": 200000,
+    "deepseek": 64000,
+    "qwen": 32768,
+    "Qwen/": 32768,
+    "glm-4": 128000,
+    "THUDM/glm-4": 32768,
+    "moonshot-v1-8k": 8192,
+    "moonshot-v1-32k": 32768,
+    "moonshot-v1-128k": 128000,
+}
+
+
+def _parse_windows(spec: str) -> Dict[str, int]:
+    """解析 "model=tokens,model2=tokens" 格式"""
+    windows = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, tokens = item.split("=", 1)
+            windows[name.strip()] = int(tokens)
+    return windows
+
+
+@dataclass(frozen=True)
+class ContextSettings:
+    """上下文拼接配置"""
+    default_window: int = 8192
+    windows: Tuple[Tuple[str, int], ...] = ()
+
+    @classmethod
+    def from_env(cls) -> "ContextSettings":
+        windows = dict(CONTEXT_WINDOWS)
+        windows.update(_parse_windows(os.getenv("MODEL_CONTEXT_WINDOWS", "")))
+        # 长前缀优先
+        ordered = tuple(sorted(windows.items(), key=lambda item: len(item[0]), reverse=True))
+        return cls(
+            default_window=int(os.getenv("CONTEXT_DEFAULT_WINDOW", "8192")),
+            windows=ordered,
+        )
+
+    def window_for(self, model: str) -> int:
+        for prefix, tokens in self.windows:
+            if model.startswith(prefix):
+                return tokens
+        return self.default_window
+
+
+@dataclass
+class ContextReport:
+    """一次拼接的结果统计"""
+    window: int
+    budget: int
+    tokens: int
+    kept_messages: int
+    dropped_messages: int
+    dropped_tokens: int
+
+    def to_dict(self) -> dict:
+        return {
+            "window": self.window,
+            "budget": self.budget,
+            "tokens": self.tokens,
+            "kept_messages": self.kept_messages,
+            "dropped_messages": self.dropped_messages,
+            "dropped_tokens": self.dropped_tokens,
+        }
+
+
+def assemble_context(messages: Sequence, budget: int, tokenizer: ApproximateTokenizer) -> Tuple[List, int, int, int]:
+    """保留全部 system 消息和能放进预算的最长后缀
+
+    返回 (保留的消息, 保留的 token 数, 丢弃条数, 丢弃的 token 数)。
+    最新的一条消息总会保留，即使它本身已经超出预算。裁剪后保留的历史从用户消息开始
+    （Anthropic 要求第一条非 system 消息来自用户），后缀开头的助手消息一并丢弃。
+    """
+    counts = [tokenizer.count_message(msg.role, msg.content) for msg in messages]
+    total = tokenizer.reply_overhead
+    for msg, tokens in zip(messages, counts):
+        if msg.role == "system":
+            total += tokens
+
+    # 从最新的消息往前找能放下的最长后缀
+    start = len(messages)
+    for index in range(len(messages) - 1, -1, -1):
+        if messages[index].role == "system":
+            start = index
+            continue
+        if total + counts[index] > budget and index < len(messages) - 1:
+            break
+        total += counts[index]
+        start = index
+
+    trimmed = any(msg.role != "system" for msg in messages[:start])
+    if trimmed:
+        while start < len(messages) - 1 and messages[start].role != "user":
+            if messages[start].role != "system":
+                total -= counts[start]
+            start += 1
+
+    kept = []
+    dropped = dropped_tokens = 0
+    for index, msg in enumerate(messages):
+        if index >= start or msg.role == "system":
+            kept.append(msg)
+        else:
+            dropped += 1
+            dropped_tokens += counts[index]
+    return kept, total, dropped, dropped_tokens
+
+
+class ContextAssembler:
+    """按模型上下文窗口裁剪请求消息"""
+
+    def __init__(self, settings: Optional[ContextSettings] = None):
+        self.settings = settings or ContextSettings.from_env()
+
+    def fit(self, messages: Sequence, provider: str, model: str, max_tokens: int,
+            window: Optional[int] = None) -> Tuple[List, ContextReport]:
+        window = window or self.settings.window_for(model)
+        budget = max(window - max_tokens, 0)
+        tokenizer = get_tokenizer(provider)
+        kept, tokens, dropped, dropped_tokens = assemble_context(messages, budget, tokenizer)
+        return kept, ContextReport(window, budget, tokens, len(kept), dropped, dropped_tokens)
+
+    def stats(self) -> dict:
+        tokenizers = {name: tokenizer.stats() for name, tokenizer in TOKENIZERS.items()}
+        tokenizers[_DEFAULT_TOKENIZER.name] = _DEFAULT_TOKENIZER.stats()
+        return {"default_window": self.settings.default_window, "tokenizers": tokenizers}
+
+
+context_assembler = ContextAssembler()
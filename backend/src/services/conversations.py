@@ -0,0 +1,207 @@
+"""服务端会话存储
+
+会话和消息保存在 SQLite（WAL 模式）里。聊天请求带上 conversation_id 后，
+客户端只需发送新的一轮消息，后端从这里取出历史拼成上下文，生成完成后再把
+本轮的用户消息和助手回复一起追加进去。失败或客户端中途断开的轮次只写入用户消息，
+和客户端显示的对话一致；CONVERSATION_SAVE_PARTIAL=true 时中途断开的轮次还会保存
+已生成的部分回复。
+
+数据库操作通过 asyncio.to_thread 在线程池里执行，不阻塞事件循环。
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple
+
+from services.storage import data_path
+
+
+@dataclass(frozen=True)
+class ConversationSettings:
+    """会话存储配置"""
+    # 拼接上下文时最多取最近的多少条历史消息（之后再按 token 预算裁剪）
+    history_messages: int = 200
+    db_path: Optional[str] = None
+    # 客户端中途断开时是否保存已生成的部分回复
+    save_partial: bool = False
+
+    @classmethod
+    def from_env(cls) -> "ConversationSettings":
+        return cls(
+            history_messages=int(os.getenv("CONVERSATION_HISTORY_MESSAGES", "200")),
+            db_path=os.getenv("CONVERSATION_DB") or None,
+            save_partial=os.getenv("CONVERSATION_SAVE_PARTIAL", "false").lower() == "true",
+        )
+
+
+def _title_from(content: str, max_length: int = 30) -> str:
+    """用第一条用户消息生成会话标题"""
+    title = " ".join(content.split())
+    return title if len(title) <= max_length else title[:max_length] + "…"
+
+
+class ConversationStore:
+    """SQLite 会话存储"""
+
+    def __init__(self, settings: Optional[ConversationSettings] = None):
+        self.settings = settings or ConversationSettings.from_env()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            path = self.settings.db_path or data_path("conversations.sqlite3")
+            db = sqlite3.connect(path, check_same_thread=False)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("PRAGMA foreign_keys=ON")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                " id TEXT PRIMARY KEY,"
+                " title TEXT NOT NULL DEFAULT '',"
+                " provider TEXT NOT NULL DEFAULT '',"
+                " model TEXT NOT NULL DEFAULT '',"
+                " message_count INTEGER NOT NULL DEFAULT 0,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " conversation_id TEXT NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,"
+                " role TEXT NOT NULL,"
+                " content TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages(conversation_id, id)")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_conversations_updated ON conversations(updated_at)")
+            db.commit()
+            self._db = db
+        return self._db
+
+    def _open(self) -> None:
+        with self._db_lock:
+            self._connect()
+
+    # ---- 同步实现（在线程池里执行） ----
+    def _create(self, title: str, provider: str, model: str) -> dict:
+        now = time.time()
+        conversation_id = uuid.uuid4().hex
+        with self._db_lock:
+            db = self._connect()
+            db.execute(
+                "INSERT INTO conversations (id, title, provider, model, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (conversation_id, title, provider, model, now, now),
+            )
+            db.commit()
+            row = db.execute("SELECT * FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+        return dict(row)
+
+    def _list(self, limit: int, offset: int) -> Tuple[List[dict], int]:
+        with self._db_lock:
+            db = self._connect()
+            rows = db.execute(
+                "SELECT * FROM conversations ORDER BY updated_at DESC, id LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+            total = db.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+        return [dict(row) for row in rows], total
+
+    def _get(self, conversation_id: str, limit: int, before: Optional[int]) -> Optional[dict]:
+        with self._db_lock:
+            db = self._connect()
+            row = db.execute("SELECT * FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+            if row is None:
+                return None
+            # 多取一条判断是否还有更早的消息
+            rows = db.execute(
+                "SELECT id, role, content, created_at FROM messages"
+                " WHERE conversation_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (conversation_id, before if before is not None else 2 ** 63 - 1, limit + 1),
+            ).fetchall()
+        conversation = dict(row)
+        conversation["has_more"] = len(rows) > limit
+        conversation["messages"] = [dict(message) for message in reversed(rows[:limit])]
+        return conversation
+
+    def _history(self, conversation_id: str, limit: int) -> Optional[List[Tuple[str, str]]]:
+        with self._db_lock:
+            db = self._connect()
+            if db.execute("SELECT 1 FROM conversations WHERE id = ?", (conversation_id,)).fetchone() is None:
+                return None
+            rows = db.execute(
+                "SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY id DESC LIMIT ?",
+                (conversation_id, limit),
+            ).fetchall()
+        return [(row[0], row[1]) for row in reversed(rows)]
+
+    def _append(self, conversation_id: str, messages: List[Tuple[str, str]], provider: str, model: str) -> bool:
+        now = time.time()
+        with self._db_lock:
+            db = self._connect()
+            row = db.execute("SELECT title FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+            if row is None:
+                return False
+            title = row[0]
+            if not title:
+                first_user = next((content for role, content in messages if role == "user"), "")
+                title = _title_from(first_user)
+            with db:
+                db.executemany(
+                    "INSERT INTO messages (conversation_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                    [(conversation_id, role, content, now) for role, content in messages],
+                )
+                db.execute(
+                    "UPDATE conversations SET title = ?, provider = ?, model = ?,"
+                    " message_count = message_count + ?, updated_at = ? WHERE id = ?",
+                    (title, provider, model, len(messages), now, conversation_id),
+                )
+        return True
+
+    def _delete(self, conversation_id: str) -> bool:
+        with self._db_lock:
+            db = self._connect()
+            with db:
+                cursor = db.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+        return cursor.rowcount > 0
+
+    # ---- 对外接口 ----
+    async def open(self) -> None:
+        """提前打开数据库（建表），启动时调用，第一个请求不用再等"""
+        await asyncio.to_thread(self._open)
+
+    async def create(self, title: str = "", provider: str = "", model: str = "") -> dict:
+        return await asyncio.to_thread(self._create, title, provider, model)
+
+    async def list(self, limit: int = 20, offset: int = 0) -> Tuple[List[dict], int]:
+        """按最近更新时间倒序分页，返回 (当前页, 总数)"""
+        return await asyncio.to_thread(self._list, limit, offset)
+
+    async def get(self, conversation_id: str, limit: int = 50, before: Optional[int] = None) -> Optional[dict]:
+        """会话详情和消息分页：返回 id 小于 before 的最近 limit 条消息（按时间正序）"""
+        return await asyncio.to_thread(self._get, conversation_id, limit, before)
+
+    async def history(self, conversation_id: str, limit: Optional[int] = None) -> Optional[List[Tuple[str, str]]]:
+        """拼接上下文用的最近历史 [(role, content)]；会话不存在时返回 None"""
+        return await asyncio.to_thread(self._history, conversation_id, limit or self.settings.history_messages)
+
+    async def append(self, conversation_id: str, messages: Iterable[Tuple[str, str]],
+                     provider: str = "", model: str = "") -> bool:
+        """在一个事务里追加一轮消息；会话已被删除时返回 False"""
+        return await asyncio.to_thread(self._append, conversation_id, list(messages), provider, model)
+
+    async def delete(self, conversation_id: str) -> bool:
+        return await asyncio.to_thread(self._delete, conversation_id)
+
+    def close(self) -> None:
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+conversation_store = ConversationStore()
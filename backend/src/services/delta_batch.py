@@ -0,0 +1,113 @@
+"""流式文本增量的微批合并
+
+有些提供商每个事件只带一两个字符（演示模式更是逐字输出），逐个编码成 SSE 帧
+意味着每个字符一次 send 和一次前端重新渲染。这里在提供商生成器和 SSE 编码之间
+合并相邻的 content 增量：
+
+- 距离上一帧超过 window 时，新增量立即发出：首个 token 和慢速流不增加延迟
+- 否则先攒着，到 上一帧 + window 时、攒够 max_bytes 字节时或流结束时一起发出
+- 其他事件（usage、queue、错误）之前先发出已攒的内容，保持顺序
+
+STREAM_BATCH_WINDOW_MS=0 关闭合并。合并前后的片段数记在
+chat_stream_deltas_total{stage="received|sent"}，两者速率之差就是每秒省下的帧数。
+"""
+import asyncio
+import os
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Optional
+
+from services import metrics
+
+
+@dataclass(frozen=True)
+class DeltaBatchSettings:
+    """增量合并配置"""
+    # 两个 content 帧之间的最短间隔（秒），0 表示不合并
+    window: float = 0.025
+    max_bytes: int = 512
+
+    @classmethod
+    def from_env(cls) -> "DeltaBatchSettings":
+        return cls(
+            window=float(os.getenv("STREAM_BATCH_WINDOW_MS", "25")) / 1000,
+            max_bytes=int(os.getenv("STREAM_BATCH_MAX_BYTES", "512")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+
+async def batch_deltas(chunks: AsyncIterator[dict], settings: DeltaBatchSettings,
+                       provider: str = "") -> AsyncIterator[dict]:
+    """合并相邻的 content 事件，其他事件原样透传"""
+    source = chunks.__aiter__()
+    loop = asyncio.get_running_loop()
+    window = settings.window
+    parts: List[str] = []
+    size = 0
+    last_sent = float("-inf")
+    received = sent = 0
+    # 攒着内容时，下一个事件放在任务里等待，以便窗口到期时先把内容发出去
+    pending: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if pending is None and not parts:
+                try:
+                    chunk = await source.__anext__()
+                except StopAsyncIteration:
+                    break
+            else:
+                if pending is None:
+                    pending = asyncio.ensure_future(source.__anext__())
+                if parts:
+                    timeout = last_sent + window - loop.time()
+                    if timeout > 0:
+                        await asyncio.wait((pending,), timeout=timeout)
+                    if not pending.done():
+                        sent += 1
+                        last_sent = loop.time()
+                        yield {"type": "content", "content": "".join(parts)}
+                        parts = []
+                        size = 0
+                        continue
+                else:
+                    await asyncio.wait((pending,))
+                task, pending = pending, None
+                try:
+                    chunk = task.result()
+                except StopAsyncIteration:
+                    break
+
+            if chunk.get("type") == "content" and not chunk.get("error"):
+                received += 1
+                content = chunk.get("content") or ""
+                if not parts and loop.time() - last_sent >= window:
+                    sent += 1
+                    last_sent = loop.time()
+                    yield chunk
+                    continue
+                parts.append(content)
+                size += len(content.encode("utf-8"))
+                if size < settings.max_bytes:
+                    continue
+            if parts:
+                sent += 1
+                last_sent = loop.time()
+                yield {"type": "content", "content": "".join(parts)}
+                parts = []
+                size = 0
+            if chunk.get("type") != "content" or chunk.get("error"):
+                yield chunk
+        if parts:
+            sent += 1
+            yield {"type": "content", "content": "".join(parts)}
+    finally:
+        if pending is not None and not pending.done():
+            # 客户端断开等情况下取消等待中的上游读取，异常沿生成器链传播并关闭上游
+            pending.cancel()
+        metrics.stream_deltas.inc(provider, "received", amount=received)
+        metrics.stream_deltas.inc(provider, "sent", amount=sent)
+
+
+delta_batch_settings = DeltaBatchSettings.from_env()
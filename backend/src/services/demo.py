@@ -0,0 +1,117 @@
+"""演示模式的模拟回复
+
+不访问网络，回复和节奏由 api_config 里的 demo 参数决定，可以单独压测
+/api/chat/stream 的整条链路（校验、上下文、SSE 编码、客户端）：
+    seed          随机种子；设置后同样的参数每次得到同样的回复和节奏
+    tokens        回复长度（token 数）；0 表示使用预置的演示回复，按字符输出
+    rate          每秒 token 数
+    ttft          首个 token 前的等待（秒）
+    chunk_size    每个流式事件携带的 token 数
+    jitter        每个事件间隔的随机浮动比例，0 表示严格按 rate
+    failure_rate  按比例注入失败：非流式返回 503，流式在中途输出错误事件
+    no_sleep      不做任何等待，只测后端自身开销
+
+例：{"provider": "demo", "api_config": {"demo": {"seed": 1, "tokens": 500, "no_sleep": true}}}
+不认识的参数名直接报错。不带参数时与之前的演示体验一致：预置回复，流式大约
+每秒 30 个字符，非流式 ttft + 1 秒后返回（预置回复的非流式等待不按 rate 计算）。
+"""
+import asyncio
+import random
+from typing import AsyncIterator, List, Optional, Tuple
+
+from pydantic import BaseModel, ConfigDict, Field
+
+# 预置回复的非流式等待（秒）
+_CANNED_DELAY = 1.0
+_WORDS = ["演示", "回复", "的", "内容", "，", "用于", "测试", "流式", "输出", "。", " the", " quick", " brown",
+          " fox", " jumps", " over", " lazy", " dog", "\n"]
+
+
+class DemoOptions(BaseModel):
+    """演示回复的参数"""
+    model_config = ConfigDict(extra="forbid")
+
+    seed: Optional[int] = None
+    tokens: int = Field(0, ge=0, le=1_000_000)
+    rate: float = Field(30.0, gt=0)
+    ttft: float = Field(0.0, ge=0)
+    chunk_size: int = Field(1, ge=1)
+    jitter: float = Field(0.5, ge=0, le=1)
+    failure_rate: float = Field(0.0, ge=0, le=1)
+    no_sleep: bool = False
+
+
+class DemoFailure(Exception):
+    """failure_rate 注入的失败"""
+
+
+def _canned_replies(user_message: str, stream: bool) -> List[str]:
+    if stream:
+        return [
+            f"你好！我是演示AI助手。我收到了你的消息：\"{user_message}\"。这是一个模拟的流式回复，用于测试应用功能。",
+            f"非常感谢你的问题：\"{user_message}\"。作为演示模式，我可以告诉你，这个应用的流式聊天功能工作正常！要使用真实的AI，请配置真实的API密钥。",
+            f"我正在演示模式下运行。你问了：\"{user_message}\"。如果这是真实的AI服务，我会给出更加智能和有用的回答。现在你可以体验应用的流式输出界面。"
+        ]
+    return [
+        f"你好！我是演示AI助手。我收到了你的消息：\"{user_message}\"。这是一个模拟回复，用于测试应用功能。",
+        f"非常感谢你的问题：\"{user_message}\"。作为演示模式，我可以告诉你，这个应用的聊天功能工作正常！要使用真实的AI，请配置真实的API密钥。",
+        f"我正在演示模式下运行。你问了：\"{user_message}\"。如果这是真实的AI服务，我会给出更加智能和有用的回答。现在你可以体验应用的界面和基本功能。",
+        f"欢迎使用AI聊天应用！你刚才说：\"{user_message}\"。这是演示模式的回复。在真实模式下，AI会根据你的问题提供更加个性化和准确的答案。",
+        f"你好！我正在演示模式下工作。对于你的输入\"{user_message}\"，在真实环境下，我能够：\n1. 回答各种问题\n2. 协助写作和编程\n3. 分析和解决问题\n4. 进行创意讨论\n\n请配置真实的API密钥来解锁完整功能！"
+    ]
+
+
+class DemoReply:
+    """一次演示回复：内容、节奏和注入的失败都在创建时由种子确定"""
+
+    def __init__(self, options: DemoOptions, user_message: str, stream: bool):
+        self.options = options
+        self.rng = random.Random(options.seed)
+        if options.tokens:
+            self.tokens = [self.rng.choice(_WORDS) for _ in range(options.tokens)]
+        else:
+            self.tokens = list(self.rng.choice(_canned_replies(user_message, stream)))
+        self.prompt_tokens = len(user_message)
+        # 失败时在第几个 token 处中断（非流式直接失败）
+        self.fail_at: Optional[int] = None
+        if options.failure_rate and self.rng.random() < options.failure_rate:
+            self.fail_at = self.rng.randrange(len(self.tokens)) if self.tokens else 0
+
+    @property
+    def usage(self) -> dict:
+        completion = len(self.tokens)
+        return {"prompt_tokens": self.prompt_tokens, "completion_tokens": completion,
+                "total_tokens": self.prompt_tokens + completion}
+
+    def _delay(self, tokens: int) -> float:
+        options = self.options
+        delay = tokens / options.rate
+        if options.jitter:
+            delay *= self.rng.uniform(1 - options.jitter, 1 + options.jitter)
+        return delay
+
+    async def complete(self) -> Tuple[str, dict]:
+        """非流式：等待 ttft + 生成时间后返回 (内容, 用量)"""
+        if self.fail_at is not None:
+            raise DemoFailure("演示模式注入的失败")
+        if not self.options.no_sleep:
+            # 预置回复保持原来约 1 秒的等待；指定了 tokens 时按 rate 计算生成时间
+            generation = self._delay(len(self.tokens)) if self.options.tokens else _CANNED_DELAY
+            await asyncio.sleep(self.options.ttft + generation)
+        return "".join(self.tokens), self.usage
+
+    async def stream(self) -> AsyncIterator[dict]:
+        """流式：按 chunk_size 分组输出 content 事件，最后输出用量"""
+        options = self.options
+        sleep = not options.no_sleep
+        if sleep and options.ttft:
+            await asyncio.sleep(options.ttft)
+        size = options.chunk_size
+        for start in range(0, len(self.tokens), size):
+            if self.fail_at is not None and start >= self.fail_at:
+                yield {"error": True, "message": "演示模式注入的失败"}
+                return
+            if sleep and start:
+                await asyncio.sleep(self._delay(size))
+            yield {"type": "content", "content": "".join(self.tokens[start:start + size])}
+        yield {"type": "usage", "usage": self.usage}
@@ -0,0 +1,238 @@
+"""连接诊断
+
+把一次连接测试拆成独立计时的阶段：
+    dns         解析 A/AAAA 记录
+    tcp         happy eyeballs（RFC 8305）：按地址族交错，每隔一小段时间
+                并发发起下一个地址的连接，先连上的胜出
+    tls         在上一步的连接上完成 TLS 握手（仅 https）
+    ttfb        GET /models 的首字节时间
+    completion  一次最小的补全请求
+
+dns → tcp → tls 有先后依赖，顺序执行；ttfb 和 completion 走共享连接池，
+与前者互不影响，三组并发执行。全部使用 asyncio，不阻塞事件循环。
+"""
+import asyncio
+import socket
+import ssl
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Awaitable, Callable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import httpx
+
+STAGES = ("dns", "tcp", "tls", "ttfb", "completion")
+STAGE_LABELS = {
+    "dns": "DNS解析",
+    "tcp": "TCP连接",
+    "tls": "TLS握手",
+    "ttfb": "模型列表请求",
+    "completion": "补全请求",
+}
+
+
+@dataclass
+class StageResult:
+    """单个阶段的结果"""
+    name: str
+    status: str = "skipped"  # ok / failed / skipped
+    duration_ms: Optional[float] = None
+    detail: dict = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+def _error_text(error: BaseException) -> str:
+    if isinstance(error, asyncio.TimeoutError):
+        return "超时"
+    # HTTPException 等带 detail 的异常
+    detail = getattr(error, "detail", None)
+    return str(detail or error) or type(error).__name__
+
+
+async def _run_stage(result: StageResult, fn: Callable[[], Awaitable], timeout: float):
+    """执行并计时一个阶段，失败时记录错误并返回 None"""
+    started = time.perf_counter()
+    try:
+        value = await asyncio.wait_for(fn(), timeout)
+    except Exception as e:
+        result.status = "failed"
+        result.error = _error_text(e)
+        return None
+    finally:
+        result.duration_ms = round((time.perf_counter() - started) * 1000, 2)
+    result.status = "ok"
+    return value
+
+
+def _interleave(addrinfos: List[tuple]) -> List[tuple]:
+    """按地址族交错排列，第一个地址族保持 getaddrinfo 的优先顺序"""
+    by_family = {}
+    for info in addrinfos:
+        by_family.setdefault(info[0], []).append(info)
+    queues = list(by_family.values())
+    ordered = []
+    while any(queues):
+        for queue in queues:
+            if queue:
+                ordered.append(queue.pop(0))
+    return ordered
+
+
+async def _connect(family: int, sockaddr: tuple) -> socket.socket:
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    try:
+        await loop.sock_connect(sock, sockaddr)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+async def happy_eyeballs(addrinfos: List[tuple], delay: float = 0.25) -> Tuple[socket.socket, tuple, List[dict]]:
+    """并发竞速连接，返回 (socket, 胜出地址, 每次尝试的记录)"""
+    remaining = _interleave(addrinfos)
+    pending = {}
+    attempts: List[dict] = []
+    started = time.perf_counter()
+    try:
+        while remaining or pending:
+            if remaining:
+                family, _, _, _, sockaddr = remaining.pop(0)
+                pending[asyncio.ensure_future(_connect(family, sockaddr))] = (sockaddr, time.perf_counter())
+            # 有尝试失败时立即发起下一个，否则最多等 delay
+            done, _ = await asyncio.wait(
+                pending, timeout=delay if remaining else None, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in sorted(done, key=lambda t: t.exception() is not None):
+                sockaddr, attempt_started = pending.pop(task)
+                record = {
+                    "address": sockaddr[0],
+                    "started_ms": round((attempt_started - started) * 1000, 2),
+                    "duration_ms": round((time.perf_counter() - attempt_started) * 1000, 2),
+                }
+                if task.exception() is None:
+                    attempts.append(record)
+                    return task.result(), sockaddr, attempts
+                record["error"] = _error_text(task.exception())
+                attempts.append(record)
+        errors = "; ".join(f"{a['address']}: {a['error']}" for a in attempts)
+        raise ConnectionError(f"所有地址均连接失败（{errors}）")
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            results = await asyncio.gather(*pending, return_exceptions=True)
+            for leftover in results:
+                if isinstance(leftover, socket.socket):
+                    leftover.close()
+
+
+class ConnectionDiagnostics:
+    """多阶段连接诊断"""
+
+    def __init__(self, stage_timeout: float = 10.0, happy_eyeballs_delay: float = 0.25):
+        self.stage_timeout = stage_timeout
+        self.happy_eyeballs_delay = happy_eyeballs_delay
+
+    async def run(self, adapter, client: httpx.AsyncClient,
+                  complete: Callable[[], Awaitable[str]]) -> dict:
+        """执行全部阶段，返回结构化的耗时报告"""
+        url = urlparse(adapter.chat_url)
+        host = url.hostname or ""
+        port = url.port or (443 if url.scheme == "https" else 80)
+        results = {name: StageResult(name) for name in STAGES}
+
+        started = time.perf_counter()
+        reply = (await asyncio.gather(
+            self._network_stages(host, port, url.scheme == "https", results),
+            _run_stage(results["ttfb"], lambda: self._ttfb(adapter, client, results["ttfb"]), self.stage_timeout),
+            _run_stage(results["completion"], complete, self.stage_timeout * 3),
+        ))[2]
+        total_ms = round((time.perf_counter() - started) * 1000, 2)
+
+        failed = [results[name] for name in STAGES if results[name].status == "failed"]
+        if results["completion"].status == "ok":
+            status = "success"
+            message = f"{adapter.label}连接测试成功"
+        else:
+            status = "failed"
+            # 报告最早失败的阶段，通常就是根因
+            first = failed[0]
+            message = f"{STAGE_LABELS[first.name]}失败: {first.error}"
+        return {
+            "status": status,
+            "message": message,
+            "response": (reply or "")[:100],
+            "target": {"scheme": url.scheme, "host": host, "port": port},
+            "total_ms": total_ms,
+            "stages": [asdict(results[name]) for name in STAGES],
+        }
+
+    async def _network_stages(self, host: str, port: int, use_tls: bool, results: dict) -> None:
+        loop = asyncio.get_running_loop()
+        addrinfos = await _run_stage(
+            results["dns"],
+            lambda: loop.getaddrinfo(host, port, type=socket.SOCK_STREAM),
+            self.stage_timeout,
+        )
+        if not addrinfos:
+            return
+        results["dns"].detail = {
+            "addresses": sorted({info[4][0] for info in addrinfos}),
+            "ipv4": any(info[0] == socket.AF_INET for info in addrinfos),
+            "ipv6": any(info[0] == socket.AF_INET6 for info in addrinfos),
+        }
+
+        tcp = results["tcp"]
+        connected = await _run_stage(
+            tcp, lambda: happy_eyeballs(addrinfos, self.happy_eyeballs_delay), self.stage_timeout
+        )
+        if connected is None:
+            return
+        sock, sockaddr, attempts = connected
+        tcp.detail = {"address": sockaddr[0], "port": sockaddr[1], "attempts": attempts}
+
+        if not use_tls:
+            sock.close()
+            return
+        tls = results["tls"]
+        writer = await _run_stage(tls, lambda: self._tls_handshake(sock, host), self.stage_timeout)
+        if writer is None:
+            sock.close()
+            return
+        ssl_object = writer.get_extra_info("ssl_object")
+        cert = ssl_object.getpeercert() or {}
+        tls.detail = {
+            "version": ssl_object.version(),
+            "cipher": ssl_object.cipher()[0],
+            "alpn": ssl_object.selected_alpn_protocol(),
+            "certificate_expires": cert.get("notAfter"),
+        }
+        writer.close()
+
+    @staticmethod
+    async def _tls_handshake(sock: socket.socket, host: str):
+        context = ssl.create_default_context()
+        context.set_alpn_protocols(["h2", "http/1.1"])
+        _, writer = await asyncio.open_connection(sock=sock, ssl=context, server_hostname=host)
+        return writer
+
+    @staticmethod
+    async def _ttfb(adapter, client: httpx.AsyncClient, result: StageResult) -> None:
+        started = time.perf_counter()
+        async with client.stream("GET", adapter.models_url, headers=adapter.headers,
+                                 follow_redirects=adapter.follow_redirects) as response:
+            result.detail = {
+                "url": adapter.models_url,
+                "status_code": response.status_code,
+                "ttfb_ms": round((time.perf_counter() - started) * 1000, 2),
+            }
+            await response.aread()
+        result.detail["bytes"] = len(response.content)
+        if response.status_code >= 400:
+            raise RuntimeError(adapter.parse_error(response))
+
+
+connection_diagnostics = ConnectionDiagnostics()
@@ -0,0 +1,69 @@
+"""客户端断开时立即停止流式响应
+
+ASGI spec_version < 2.4 时 Starlette 会监听断开并取消推流任务；2.4 起改为依赖
+send 抛错，而 uvicorn 向已断开的连接 send 时直接忽略，生成器会一直跑到上游
+结束，白白消耗 token 和连接池位置。
+
+cancel_on_disconnect 包装要推送的帧：后台定期检查 request.is_disconnected()，
+发现断开后取消正在等待上游的推流任务。CancelledError 沿生成器链向上传播，
+途经的 finally（释放准入名额、关闭 httpx 流、记录指标）都会立即执行，之后
+包装器吞掉这次由自己发起的取消，正常结束响应。
+"""
+import asyncio
+import os
+from typing import AsyncGenerator, AsyncIterator, Awaitable, Callable
+
+POLL_INTERVAL = float(os.getenv("STREAM_DISCONNECT_POLL_INTERVAL", "0.25"))
+
+
+async def cancel_on_disconnect(frames: AsyncGenerator[bytes, None], is_disconnected: Callable[[], Awaitable[bool]],
+                               interval: float = POLL_INTERVAL) -> AsyncIterator[bytes]:
+    """逐帧转发 frames，客户端断开后取消上游并结束"""
+    task = asyncio.current_task()
+    assert task is not None
+    loop = asyncio.get_running_loop()
+    pulling = False
+    disconnected = False
+    cancel_requested = False
+
+    def cancel_pull() -> None:
+        # 只在推流任务挂起在上游上时取消，保证 CancelledError 落在生成器链里
+        nonlocal cancel_requested
+        if pulling and not cancel_requested:
+            cancel_requested = True
+            task.cancel()
+
+    async def watch() -> None:
+        nonlocal disconnected
+        while not await is_disconnected():
+            await asyncio.sleep(interval)
+        disconnected = True
+        cancel_pull()
+
+    watcher = asyncio.ensure_future(watch())
+    try:
+        while True:
+            if disconnected:
+                # 断开时推流任务正在 send：等下一次拉取真正挂起时再取消
+                loop.call_soon(cancel_pull)
+            pulling = True
+            try:
+                frame = await frames.__anext__()
+            except StopAsyncIteration:
+                return
+            except asyncio.CancelledError:
+                # 只吞掉自己发起的取消；服务器同时取消推流时继续向上抛
+                if cancel_requested:
+                    cancel_requested = False
+                    if task.uncancel() == 0:
+                        return
+                raise
+            finally:
+                pulling = False
+            if not disconnected:
+                yield frame
+    finally:
+        watcher.cancel()
+        if cancel_requested:
+            task.uncancel()
+        await frames.aclose()
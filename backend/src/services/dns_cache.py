@@ -0,0 +1,112 @@
+"""进程内 DNS 缓存
+
+httpcore 每建立一个新连接都会重新解析域名。这里包装 httpcore 的网络后端：
+connect_tcp 先查缓存（带 TTL），再按解析出的地址依次尝试连接；TLS 的 SNI
+和证书校验仍使用原始域名（由 httpcore 按 origin 传入），不受影响。
+有多个地址时连接超时按剩余地址平分，一个地址不通（如 IPv6 路由黑洞）
+不会用掉全部超时，后面的地址仍有机会连上，总耗时不超过原来的超时。
+
+同一域名的并发解析合并为一次（见 services/singleflight.py）；某个地址连接
+失败会换下一个，全部失败时清除该域名的缓存，下次重新解析。
+"""
+import asyncio
+import ipaddress
+import socket
+import time
+from typing import Dict, Iterable, List, Optional, Tuple, cast
+
+import httpcore
+
+from services.singleflight import SingleFlight
+
+
+def _is_ip_literal(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return True
+
+
+class DNSCache:
+    """按 (host, port) 缓存 getaddrinfo 结果"""
+
+    def __init__(self, ttl: float = 300.0, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # (host, port) -> (过期时间, 地址列表)
+        self._entries: Dict[Tuple[str, int], Tuple[float, List[str]]] = {}
+        self._flights = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    async def resolve(self, host: str, port: int) -> List[str]:
+        key = (host, port)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return await self._flights.do(key, lambda: self._lookup(host, port))
+
+    async def _lookup(self, host: str, port: int) -> List[str]:
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addresses = list(dict.fromkeys(str(info[4][0]) for info in infos))
+        if len(self._entries) >= self.max_entries:
+            self._entries.clear()
+        self._entries[(host, port)] = (time.monotonic() + self.ttl, addresses)
+        return addresses
+
+    def invalidate(self, host: str, port: int) -> None:
+        self._entries.pop((host, port), None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "ttl": self.ttl,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class CachingNetworkBackend(httpcore.AsyncNetworkBackend):
+    """先查 DNS 缓存再连接的 httpcore 网络后端"""
+
+    def __init__(self, cache: DNSCache, backend: Optional[httpcore.AsyncNetworkBackend] = None):
+        self.cache = cache
+        # 未安装 anyio 时 httpcore 提供的是一个构造即报错的占位类，静态类型与网络后端不兼容
+        self._backend = backend or cast(httpcore.AsyncNetworkBackend, httpcore.AnyIOBackend())
+
+    async def connect_tcp(self, host: str, port: int, timeout: Optional[float] = None,
+                          local_address: Optional[str] = None,
+                          socket_options: Optional[Iterable] = None) -> httpcore.AsyncNetworkStream:
+        if _is_ip_literal(host):
+            return await self._backend.connect_tcp(host, port, timeout, local_address, socket_options)
+        try:
+            addresses = await self.cache.resolve(host, port)
+        except OSError as e:
+            raise httpcore.ConnectError(str(e)) from e
+
+        last_error: Optional[Exception] = None
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for index, address in enumerate(addresses):
+            attempt_timeout = None
+            if deadline is not None:
+                attempt_timeout = max(0.0, deadline - time.monotonic()) / (len(addresses) - index)
+            try:
+                return await self._backend.connect_tcp(address, port, attempt_timeout, local_address, socket_options)
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                last_error = e
+        # 缓存的地址全部不可用，下次重新解析
+        self.cache.invalidate(host, port)
+        raise last_error or httpcore.ConnectError(f"无法解析 {host}")
+
+    async def connect_unix_socket(self, path: str, timeout: Optional[float] = None,
+                                  socket_options: Optional[Iterable] = None) -> httpcore.AsyncNetworkStream:
+        return await self._backend.connect_unix_socket(path, timeout, socket_options)
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
@@ -0,0 +1,367 @@
+"""聊天历史全文检索
+
+/api/chat 和 /api/chat/stream 每完成一轮问答（最后一条用户消息 + 助手回复），
+record() 把它放进内存队列就返回；后台任务每 HISTORY_FLUSH_MS 把攒下的问答在
+一个事务里写入 SQLite，并同步更新 FTS5 索引，请求路径上没有磁盘 IO。
+
+中文不按空格分词，索引时把每段连续的 CJK 字符拆成重叠的二元组，再加上最后一个字
+（"流式输出" -> "流式 式输 输出 出"），unicode61 分词器把它们当作普通的词。
+查询时每个关键词转成二元组短语："式输出" 是相邻的 "式输 输出"，单个字用前缀匹配
+（"的"*），任意长度的中文片段都能搜到。中英混合的关键词里，后面还跟着英文的中文片段
+在文档里也一定在这里结束，和索引一样补上最后一个字（"流式output" -> "流式 式 output"）。索引表不保存原文（contentless），
+摘要和高亮只为当前页的结果在 Python 里生成。
+
+检索：
+    sort=relevance  按 bm25 排序，只对最近的 HISTORY_SEARCH_CANDIDATES 条命中打分；
+                    bm25 还要统计每个关键词出现在多少条记录里，耗时随这个数增长
+                    （一百万条消息、关键词出现在四成记录里时约 20-50ms）
+    sort=recent     按时间倒序，直接按 rowid 倒序遍历倒排表，取够一页就停，不打分
+provider / model / 起止时间过滤，游标分页（游标里固定了首次查询时的最大 id，
+翻页期间新写入的记录不会打乱顺序）。
+"""
+import asyncio
+import base64
+import html
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from services import metrics
+from services.storage import data_path
+
+logger = logging.getLogger(__name__)
+
+_CJK = "぀-ヿ㐀-䶿一-鿿가-힯豈-﫿"
+_CJK_RUN = re.compile(f"[{_CJK}]+")
+_TERM_PIECE = re.compile(f"([{_CJK}]+)")
+_WORD = re.compile(rf"[\w{_CJK}]")
+# 多个工作进程写入时 created_at 与 id 顺序的最大偏差（秒），按时间缩小 rowid 范围时留出余量
+_MAX_CLOCK_SKEW = 60.0
+# 摘要长度（字符）
+_SNIPPET_CHARS = 120
+SORTS = ("relevance", "recent")
+
+
+@dataclass(frozen=True)
+class HistorySettings:
+    """历史索引配置"""
+    enabled: bool = True
+    db_path: Optional[str] = None
+    # 攒一批再写入的间隔（秒）
+    flush_interval: float = 0.2
+    # 队列上限，写入跟不上时丢弃新的记录
+    max_pending: int = 10000
+    # relevance 排序最多对多少条命中打分
+    search_candidates: int = 5000
+
+    @classmethod
+    def from_env(cls) -> "HistorySettings":
+        return cls(
+            enabled=os.getenv("HISTORY_ENABLED", "true").lower() == "true",
+            db_path=os.getenv("HISTORY_DB") or None,
+            flush_interval=float(os.getenv("HISTORY_FLUSH_MS", "200")) / 1000,
+            max_pending=int(os.getenv("HISTORY_MAX_PENDING", "10000")),
+            search_candidates=int(os.getenv("HISTORY_SEARCH_CANDIDATES", "5000")),
+        )
+
+
+def _bigrams(run: str) -> List[str]:
+    return [run[i:i + 2] for i in range(len(run) - 1)]
+
+
+def index_text(text: str) -> str:
+    """CJK 片段换成重叠的二元组加最后一个字，其余文本不变"""
+    return _CJK_RUN.sub(lambda m: " " + " ".join(_bigrams(m.group()) + [m.group()[-1]]) + " ", text)
+
+
+def match_query(query: str) -> str:
+    """用户输入转成 FTS5 查询：每个关键词作为短语，全部命中（AND）
+
+    引号转义后放在短语里，用户输入中的 AND / OR / NEAR / * 等不会被当作查询语法。
+    没有可检索的字符时返回空字符串。
+    """
+    phrases = []
+    for term in query.split():
+        if not _WORD.search(term):
+            continue
+        tokens = []
+        prefix = False
+        pieces = [piece for piece in _TERM_PIECE.split(term) if piece]
+        for index, piece in enumerate(pieces):
+            if _CJK_RUN.fullmatch(piece):
+                if index < len(pieces) - 1:
+                    # 后面还有英文：文档里的中文片段也在这里结束，索引里有最后一个字
+                    tokens.extend(_bigrams(piece) + [piece[-1]])
+                    prefix = False
+                    continue
+                # 单个字可能是文档里某个二元组的第一个字；只有在关键词末尾时才需要前缀匹配
+                tokens.extend(_bigrams(piece) or [piece])
+                prefix = len(piece) == 1
+            else:
+                tokens.append(piece)
+                prefix = False
+        phrase = '"' + " ".join(tokens).replace('"', '""') + '"'
+        phrases.append(phrase + " *" if prefix else phrase)
+    return " ".join(phrases)
+
+
+def highlight(text: str, query: str, width: int = _SNIPPET_CHARS) -> Optional[str]:
+    """截取命中最早出现处附近的一段，关键词用 <mark> 包起来（HTML 已转义）；没有命中返回 None"""
+    terms = [term for term in query.split() if _WORD.search(term)]
+    pattern = re.compile("|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+    first = pattern.search(text)
+    if first is None:
+        return None
+    start = max(0, min(first.start() - width // 4, len(text) - width))
+    end = min(len(text), start + width)
+    parts = ["…" if start else ""]
+    position = start
+    for match in pattern.finditer(text, start, end):
+        parts.append(html.escape(text[position:match.start()], quote=False))
+        parts.append("<mark>" + html.escape(match.group(), quote=False) + "</mark>")
+        position = match.end()
+    parts.append(html.escape(text[position:end], quote=False))
+    parts.append("…" if end < len(text) else "")
+    return "".join(parts)
+
+
+def _encode_cursor(data: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> dict:
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError("游标无效")
+    if not (isinstance(state, dict) and isinstance(state.get("upto"), int) and isinstance(state.get("id"), int)):
+        raise ValueError("游标无效")
+    return state
+
+
+class HistoryIndex:
+    """问答历史的持久化和全文检索"""
+
+    def __init__(self, settings: Optional[HistorySettings] = None):
+        self.settings = settings or HistorySettings.from_env()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        # (created_at, conversation_id, provider, model, prompt, reply)
+        self._pending: List[tuple] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._writer: Optional[asyncio.Task] = None
+
+    # ---- SQLite 层（在线程池里执行） ----
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            path = self.settings.db_path or data_path("history.sqlite3")
+            db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(
+                "CREATE TABLE IF NOT EXISTS exchanges ("
+                " id INTEGER PRIMARY KEY,"
+                " created_at REAL NOT NULL,"
+                " conversation_id TEXT,"
+                " provider TEXT NOT NULL,"
+                " model TEXT NOT NULL,"
+                " prompt TEXT NOT NULL,"
+                " reply TEXT NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS idx_exchanges_created ON exchanges(created_at);"
+                # 原文在 exchanges 表里，索引表只保存 index_text 的分词结果；
+                # prefix='1' 为单字查询（"的"*）建前缀索引，否则要合并所有以它开头的二元组
+                "CREATE VIRTUAL TABLE IF NOT EXISTS exchanges_fts USING fts5("
+                " prompt, reply, content='', prefix='1', tokenize='unicode61 remove_diacritics 2');"
+            )
+            self._db = db
+        return self._db
+
+    def _open(self) -> None:
+        with self._db_lock:
+            self._connect()
+
+    def _write(self, rows: List[tuple]) -> None:
+        with self._db_lock:
+            db = self._connect()
+            with db:
+                for row in rows:
+                    cursor = db.execute(
+                        "INSERT INTO exchanges (created_at, conversation_id, provider, model, prompt, reply)"
+                        " VALUES (?, ?, ?, ?, ?, ?)", row)
+                    db.execute("INSERT INTO exchanges_fts (rowid, prompt, reply) VALUES (?, ?, ?)",
+                               (cursor.lastrowid, index_text(row[4]), index_text(row[5])))
+
+    def _id_bounds(self, db: sqlite3.Connection, since: Optional[float], until: Optional[float]) -> Tuple[int, int]:
+        """时间范围对应的 rowid 范围（按 created_at 索引取最早/最晚一条，留出时钟偏差余量）"""
+        low, high = 0, (db.execute("SELECT max(id) FROM exchanges").fetchone()[0] or 0)
+        if since is not None:
+            row = db.execute("SELECT id FROM exchanges WHERE created_at >= ? ORDER BY created_at LIMIT 1",
+                             (since - _MAX_CLOCK_SKEW,)).fetchone()
+            low = row[0] if row else high + 1
+        if until is not None:
+            row = db.execute("SELECT id FROM exchanges WHERE created_at <= ? ORDER BY created_at DESC LIMIT 1",
+                             (until + _MAX_CLOCK_SKEW,)).fetchone()
+            high = min(high, row[0]) if row else 0
+        return low, high
+
+    def _search(self, query: str, provider: Optional[str], model: Optional[str], since: Optional[float],
+                until: Optional[float], sort: str, limit: int, cursor: Optional[str]) -> dict:
+        match = match_query(query)
+        if not match:
+            return {"results": [], "next_cursor": None}
+        state = _decode_cursor(cursor) if cursor else {}
+        if state and state.get("sort") != sort:
+            raise ValueError("游标与排序方式不一致")
+
+        filters, params = [], []
+        for column, value in (("provider", provider), ("model", model)):
+            if value:
+                filters.append(f"e.{column} = ?")
+                params.append(value)
+        if since is not None:
+            filters.append("e.created_at >= ?")
+            params.append(since)
+        if until is not None:
+            filters.append("e.created_at <= ?")
+            params.append(until)
+        # 没有过滤条件时不用连接原表
+        source = "exchanges_fts f" + (" JOIN exchanges e ON e.id = f.rowid" if filters else "")
+        where = "".join(f" AND {condition}" for condition in filters)
+
+        with self._db_lock:
+            db = self._connect()
+            low, high = self._id_bounds(db, since, until)
+            # 第一页时固定上界，之后的页沿用，翻页期间新写入的记录不影响顺序
+            upto = state.get("upto", high)
+            high = min(high, upto)
+            if sort == "recent":
+                if "id" in state:
+                    high = min(high, state["id"] - 1)
+                # rowid 倒序正是倒排表的遍历顺序，取够一页就停；不打分，bm25 要先统计
+                # 每个关键词的文档数，常见词上这一步比整个查询还慢
+                ranked = db.execute(
+                    f"SELECT f.rowid, NULL FROM {source}"
+                    f" WHERE exchanges_fts MATCH ? AND f.rowid BETWEEN ? AND ?{where}"
+                    " ORDER BY f.rowid DESC LIMIT ?",
+                    (match, low, high, *params, limit + 1),
+                ).fetchall()
+            else:
+                after, after_params = "", []
+                if "rank" in state:
+                    after = " WHERE rank > ? OR (rank = ? AND id > ?)"
+                    after_params = [state["rank"], state["rank"], state["id"]]
+                # 只对最近的若干条命中打分排序，命中再多延迟也有上限
+                ranked = db.execute(
+                    "SELECT id, rank FROM ("
+                    f" SELECT f.rowid AS id, f.rank AS rank FROM {source}"
+                    f" WHERE exchanges_fts MATCH ? AND f.rowid BETWEEN ? AND ?{where}"
+                    " ORDER BY f.rowid DESC LIMIT ?)"
+                    f"{after} ORDER BY rank, id LIMIT ?",
+                    (match, low, high, *params, self.settings.search_candidates, *after_params, limit + 1),
+                ).fetchall()
+            page = ranked[:limit]
+            details = {row[0]: row[1:] for row in db.execute(
+                "SELECT id, created_at, conversation_id, provider, model, prompt, reply FROM exchanges"
+                f" WHERE id IN ({','.join('?' * len(page))})",
+                [row[0] for row in page],
+            )} if page else {}
+
+        results = []
+        for exchange_id, rank in page:
+            created_at, conversation_id, provider_name, model_name, prompt, reply = details[exchange_id]
+            results.append({
+                "id": exchange_id,
+                "created_at": created_at,
+                "conversation_id": conversation_id,
+                "provider": provider_name,
+                "model": model_name,
+                "prompt": prompt,
+                "score": -rank if rank is not None else None,
+                # 优先展示回复里的命中，关键词只出现在提问里时展示提问
+                "snippet": highlight(reply, query) or highlight(prompt, query) or html.escape(reply[:_SNIPPET_CHARS]),
+            })
+        next_cursor = None
+        if len(ranked) > limit:
+            exchange_id, rank = page[-1]
+            position = {"id": exchange_id} if sort == "recent" else {"rank": rank, "id": exchange_id}
+            next_cursor = _encode_cursor({"sort": sort, "upto": upto, **position})
+        return {"results": results, "next_cursor": next_cursor}
+
+    # ---- 后台写入 ----
+    async def _write_loop(self, wake: asyncio.Event) -> None:
+        while True:
+            await wake.wait()
+            # 等一个间隔，把这段时间里完成的问答攒成一批
+            await asyncio.sleep(self.settings.flush_interval)
+            wake.clear()
+            await self._flush()
+
+    async def _flush(self) -> None:
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        try:
+            await asyncio.to_thread(self._write, batch)
+            metrics.history_records.inc("written", amount=len(batch))
+        except Exception as e:
+            metrics.history_records.inc("failed", amount=len(batch))
+            logger.warning("写入历史索引失败，丢弃 %d 条: %s", len(batch), e)
+
+    # ---- 对外接口 ----
+    @property
+    def enabled(self) -> bool:
+        return self.settings.enabled
+
+    async def open(self) -> None:
+        """提前打开数据库（建表），启动时调用"""
+        if self.enabled:
+            await asyncio.to_thread(self._open)
+
+    def record(self, provider: str, model: str, prompt: str, reply: str,
+               conversation_id: Optional[str] = None) -> None:
+        """记录一轮完成的问答，只入队不等待写入"""
+        if not self.enabled or not reply:
+            return
+        if len(self._pending) >= self.settings.max_pending:
+            metrics.history_records.inc("dropped")
+            return
+        self._pending.append((time.time(), conversation_id, provider, model, prompt, reply))
+        wake = self._wake
+        if wake is None:
+            wake = self._wake = asyncio.Event()
+            self._writer = asyncio.get_running_loop().create_task(self._write_loop(wake))
+        wake.set()
+
+    async def search(self, query: str, provider: Optional[str] = None, model: Optional[str] = None,
+                     since: Optional[float] = None, until: Optional[float] = None, sort: str = "relevance",
+                     limit: int = 20, cursor: Optional[str] = None) -> dict:
+        """全文检索，返回 {"results": [...], "next_cursor": ...}；游标无效时抛出 ValueError"""
+        started = time.perf_counter()
+        result = await asyncio.to_thread(self._search, query, provider, model, since, until, sort, limit, cursor)
+        result["took_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return result
+
+    async def aclose(self) -> None:
+        """停止后台写入，把队列里剩下的写完"""
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            self._writer = None
+            self._wake = None
+        await self._flush()
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+history_index = HistoryIndex()
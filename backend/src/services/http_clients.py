@@ -0,0 +1,192 @@
+"""上游HTTP客户端注册表
+
+所有对模型提供商的请求都通过这里取得共享的 httpx.AsyncClient，
+同一个 (provider, base_url, TLS设置) 复用同一个连接池，避免每次对话
+都重新做 DNS + TCP + TLS 握手。客户端在 FastAPI lifespan 中创建和关闭。
+
+UPSTREAM_HTTP2_PROVIDERS 中的提供商启用 HTTP/2（需要安装 h2），并发的流
+复用同一个 TLS 连接；服务端在 ALPN 中没有选择 h2 时自动回退到 HTTP/1.1。
+新连接的域名解析走进程内 DNS 缓存（UPSTREAM_DNS_TTL 秒，0 表示关闭）。
+"""
+import importlib.util
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+from services.dns_cache import CachingNetworkBackend, DNSCache
+
+# httpx 的 HTTP/2 支持依赖 h2（httpx[http2]）
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class PoolSettings:
+    """连接池配置"""
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    connect_timeout: float = 30.0
+    read_timeout: float = 120.0
+    write_timeout: float = 30.0
+    pool_timeout: float = 10.0
+    # 启用 HTTP/2 的提供商，"*" 表示全部
+    http2_providers: frozenset = frozenset()
+    dns_ttl: float = 300.0
+
+    @classmethod
+    def from_env(cls) -> "PoolSettings":
+        """从环境变量读取连接池配置"""
+        return cls(
+            max_connections=int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30")),
+            connect_timeout=float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "30")),
+            read_timeout=float(os.getenv("UPSTREAM_READ_TIMEOUT", "120")),
+            write_timeout=float(os.getenv("UPSTREAM_WRITE_TIMEOUT", "30")),
+            pool_timeout=float(os.getenv("UPSTREAM_POOL_TIMEOUT", "10")),
+            http2_providers=frozenset(
+                p.strip() for p in os.getenv("UPSTREAM_HTTP2_PROVIDERS", "").split(",") if p.strip()
+            ),
+            dns_ttl=float(os.getenv("UPSTREAM_DNS_TTL", "300")),
+        )
+
+    def http2_for(self, provider: str) -> bool:
+        return "*" in self.http2_providers or provider in self.http2_providers
+
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(
+            connect=self.connect_timeout,
+            read=self.read_timeout,
+            write=self.write_timeout,
+            pool=self.pool_timeout,
+        )
+
+
+ClientKey = Tuple[str, str, bool]
+
+
+def _origin(base_url: str) -> str:
+    """只按 scheme://host:port 区分连接池，路径不同的端点可以共用连接"""
+    parts = urlsplit(base_url)
+    if not parts.scheme or not parts.netloc:
+        return base_url
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+class HTTPClientRegistry:
+    """按 (provider, origin, verify) 缓存的共享客户端"""
+
+    def __init__(self, settings: Optional[PoolSettings] = None):
+        self.settings = settings or PoolSettings.from_env()
+        self._clients: Dict[ClientKey, httpx.AsyncClient] = {}
+        self._created_at: Dict[ClientKey, float] = {}
+        self._requests: Dict[ClientKey, int] = {}
+        self._http2: Dict[ClientKey, bool] = {}
+        self.dns_cache = DNSCache(self.settings.dns_ttl)
+
+    def key_for(self, provider: str, base_url: str, verify: bool = True) -> ClientKey:
+        return (provider, _origin(base_url), verify)
+
+    def get_client(self, provider: str, base_url: str, verify: bool = True) -> httpx.AsyncClient:
+        """获取（必要时创建）共享客户端
+
+        创建过程没有 await，在事件循环内天然是原子的，不需要加锁。
+        """
+        key = self.key_for(provider, base_url, verify)
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            client, http2 = self._create_client(provider, verify)
+            self._clients[key] = client
+            self._http2[key] = http2
+            self._created_at[key] = time.time()
+            self._requests[key] = 0
+        self._requests[key] += 1
+        return client
+
+    def _create_client(self, provider: str, verify: bool) -> Tuple[httpx.AsyncClient, bool]:
+        http2 = self.settings.http2_for(provider)
+        if http2 and not HTTP2_AVAILABLE:
+            logger.warning("%s 配置了 HTTP/2，但未安装 h2（pip install 'httpx[http2]'），使用 HTTP/1.1", provider)
+            http2 = False
+        client = httpx.AsyncClient(
+            timeout=self.settings.timeout(),
+            limits=self.settings.limits(),
+            verify=verify,
+            http2=http2,
+        )
+        if self.settings.dns_ttl > 0:
+            # 不自己构造 transport，以免丢掉环境变量里的代理设置
+            pool = getattr(getattr(client, "_transport", None), "_pool", None)
+            if pool is not None and hasattr(pool, "_network_backend"):
+                pool._network_backend = CachingNetworkBackend(self.dns_cache, pool._network_backend)
+        return client, http2
+
+    async def aclose(self) -> None:
+        """应用关闭时释放所有连接"""
+        clients = list(self._clients.values())
+        self._clients.clear()
+        self._created_at.clear()
+        self._requests.clear()
+        self._http2.clear()
+        for client in clients:
+            await client.aclose()
+
+    def stats(self) -> dict:
+        """返回每个连接池的使用情况"""
+        pools = []
+        for key, client in self._clients.items():
+            provider, origin, verify = key
+            pools.append({
+                "provider": provider,
+                "origin": origin,
+                "verify": verify,
+                "http2": self._http2.get(key, False),
+                "created_at": self._created_at.get(key, 0.0),
+                "requests": self._requests.get(key, 0),
+                **_connection_stats(client),
+            })
+        return {
+            "limits": {
+                "max_connections": self.settings.max_connections,
+                "max_keepalive_connections": self.settings.max_keepalive_connections,
+                "keepalive_expiry": self.settings.keepalive_expiry,
+            },
+            "http2_available": HTTP2_AVAILABLE,
+            "dns": self.dns_cache.stats(),
+            "pools": pools,
+        }
+
+
+def _connection_stats(client: httpx.AsyncClient) -> dict:
+    """读取 httpcore 连接池中的连接状态（私有属性，取不到时返回0）"""
+    transport = getattr(client, "_transport", None)
+    pool = getattr(transport, "_pool", None)
+    connections = list(getattr(pool, "connections", []) or [])
+    requests = list(getattr(pool, "_requests", []) or [])
+    idle = sum(1 for conn in connections if conn.is_idle())
+    return {
+        "connections": len(connections),
+        # info() 形如 "HTTP/2, ACTIVE, Request Count: 3"，可以看出 h2 是否协商成功
+        "http2_connections": sum(1 for conn in connections if conn.info().startswith("HTTP/2")),
+        "idle_connections": idle,
+        "active_connections": len(connections) - idle,
+        "queued_requests": sum(1 for req in requests if getattr(req, "connection", None) is None),
+    }
+
+
+# 全局注册表，由 main.py 的 lifespan 管理
+http_clients = HTTPClientRegistry()
@@ -0,0 +1,141 @@
+"""结构化日志
+
+请求路径上的代码只做一件事：把 LogRecord 放进队列。格式化、脱敏和写出
+都在后台 QueueListener 线程里完成，Electron 读取 stdout 变慢时不会阻塞
+事件循环。
+
+用法与标准 logging 相同，参数按 %-风格延迟格式化，结构化字段放在 extra：
+    logger.warning("%s API错误详情: %s", label, detail)
+    logger.info("连接测试", extra={"provider": provider, "model": model})
+级别未开启时 logger 直接返回，不会产生任何格式化开销。
+
+环境变量：
+    LOG_LEVEL    根级别，默认 INFO
+    LOG_LEVELS   按模块设置级别，如 "httpx=WARNING,services.http_clients=DEBUG"
+    LOG_FORMAT   text（默认）或 json
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import time
+from typing import Optional
+
+# LogRecord 自带的属性，其余的视为 extra 结构化字段
+_RESERVED_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_SECRET_PATTERNS = [
+    (re.compile(r"(?i)(bearer\s+)[A-Za-z0-9._\-]+"), r"\1***"),
+    (re.compile(r"(sk-(?:ant-)?[A-Za-z0-9]{2})[A-Za-z0-9_\-]{6,}"), r"\1***"),
+    (re.compile(r"(?i)(?<![\w-])((?:api[_-]?key|x-api-key|authorization)['\"]?\s*[:=]\s*['\"]?)[^\s'\",}]+"), r"\1***"),
+]
+
+
+def redact(text: str) -> str:
+    """遮盖文本中的API密钥和认证头"""
+    for pattern, replacement in _SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def _extra_fields(record: logging.LogRecord) -> dict:
+    return {key: value for key, value in record.__dict__.items() if key not in _RESERVED_ATTRS}
+
+
+class RedactingFormatter(logging.Formatter):
+    """文本格式，附带 extra 字段并脱敏"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        extra = _extra_fields(record)
+        if extra:
+            text += " " + " ".join(f"{key}={value}" for key, value in extra.items())
+        return redact(text)
+
+
+class JSONFormatter(logging.Formatter):
+    """每条日志一行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in _extra_fields(record).items():
+            entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return redact(json.dumps(entry, ensure_ascii=False, default=str))
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """不在调用线程里格式化，原样把 record 放进队列"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # 写出线程跟不上时丢弃日志，而不是阻塞请求
+            pass
+
+
+def parse_levels(spec: str) -> dict:
+    """解析 "module=LEVEL,module2=LEVEL" 格式"""
+    levels = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_atexit_registered = False
+
+
+def setup_logging(level: Optional[str] = None, fmt: Optional[str] = None, levels: Optional[str] = None,
+                  max_queue: int = 10000) -> None:
+    """配置根 logger：队列 handler + 后台写出线程（可重复调用）"""
+    global _listener, _atexit_registered
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    fmt = (fmt or os.getenv("LOG_FORMAT", "text")).lower()
+    levels = levels if levels is not None else os.getenv("LOG_LEVELS", "httpx=WARNING")
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if fmt == "json":
+        stream_handler.setFormatter(JSONFormatter())
+    else:
+        stream_handler.setFormatter(RedactingFormatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+
+    shutdown_logging()
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(max_queue)
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=False)
+    _listener.start()
+    if not _atexit_registered:
+        atexit.register(shutdown_logging)
+        _atexit_registered = True
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(log_queue))
+    root.setLevel(level)
+    for name, module_level in parse_levels(levels).items():
+        logging.getLogger(name).setLevel(module_level)
+
+
+def shutdown_logging() -> None:
+    """停止后台写出线程并刷新队列"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
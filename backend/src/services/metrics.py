@@ -0,0 +1,263 @@
+"""Prometheus 文本格式的运行指标
+
+计数器、仪表和直方图都是普通的 dict/list，只在事件循环线程里更新，
+不需要加锁；直方图 observe 只做一次二分查找和两次加法，逐 token 调用
+的开销可以忽略。/metrics 抓取时才生成文本。
+"""
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+    @abstractmethod
+    def render(self) -> List[str]:
+        """Prometheus 文本格式的各行"""
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+    def set(self, *labels: str, value: float) -> None:
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [每个桶的计数..., +Inf 计数, 总和]
+        self.values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}")
+            label_text = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        """抓取前调用的回调，用于刷新按需计算的仪表（如连接池状态）"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+chat_requests = registry.register(Counter(
+    "chat_requests_total", "聊天请求数（按结果分类）", ("provider", "model", "mode", "outcome")))
+generation_seconds = registry.register(Histogram(
+    "chat_generation_seconds", "从收到请求到生成结束的总耗时", ("provider", "model", "mode")))
+time_to_first_token = registry.register(Histogram(
+    "chat_time_to_first_token_seconds", "流式请求首个 token 的延迟", ("provider", "model")))
+inter_token_gap = registry.register(Histogram(
+    "chat_inter_token_gap_seconds", "流式请求相邻 token 的间隔", ("provider", "model"),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)))
+tokens_per_second = registry.register(Histogram(
+    "chat_tokens_per_second", "生成速度（completion tokens/秒）", ("provider", "model"),
+    buckets=(1, 5, 10, 20, 40, 60, 80, 100, 150, 200, 400)))
+upstream_connect_seconds = registry.register(Histogram(
+    "upstream_connect_seconds", "新建上游连接耗时", ("provider", "phase")))
+streams_in_flight = registry.register(Gauge(
+    "chat_streams_in_flight", "进行中的流式请求数", ("provider",)))
+pool_connections = registry.register(Gauge(
+    "upstream_pool_connections", "上游连接池中的连接数", ("provider", "origin", "state")))
+upstream_retries = registry.register(Counter(
+    "upstream_retries_total", "上游请求重试次数", ("provider", "reason")))
+upstream_hedges = registry.register(Counter(
+    "upstream_hedges_total", "对冲请求次数（fired 发出 / won 胜出）", ("provider", "outcome")))
+upstream_malformed_events = registry.register(Counter(
+    "upstream_malformed_events_total", "上游流式响应中无法解析的事件数", ("provider",)))
+stream_cancellations = registry.register(Counter(
+    "chat_stream_cancellations_total", "客户端断开而取消的流式请求数（waiting 未收到首 token / generating 生成中）",
+    ("provider", "model", "stage")))
+stream_deltas = registry.register(Counter(
+    "chat_stream_deltas_total", "流式内容片段数（received 上游产出 / sent 合并后发给客户端）", ("provider", "stage")))
+admission_wait_seconds = registry.register(Histogram(
+    "admission_wait_seconds", "请求在准入队列中的等待时间", ("provider",)))
+admission_rejected = registry.register(Counter(
+    "admission_rejected_total", "准入控制拒绝的请求数（queue_full / timeout）", ("provider", "reason")))
+admission_throttled = registry.register(Counter(
+    "admission_throttled_total", "上游返回 429 后收紧限制的次数", ("provider", "model")))
+history_records = registry.register(Counter(
+    "chat_history_records_total", "写入历史索引的问答数（written 已写入 / dropped 队列已满丢弃 / failed 写入失败）",
+    ("outcome",)))
+
+
+def connect_tracer(provider: str):
+    """返回 httpx trace 回调，记录新建连接的 TCP 和 TLS 耗时"""
+    started: Dict[str, float] = {}
+
+    async def trace(event_name: str, info: dict) -> None:
+        if event_name.endswith(".started"):
+            started[event_name[:-8]] = time.perf_counter()
+        elif event_name.endswith(".complete"):
+            phase = event_name[:-9]
+            begin = started.pop(phase, None)
+            if begin is not None:
+                if phase == "connection.connect_tcp":
+                    upstream_connect_seconds.observe(time.perf_counter() - begin, provider, "tcp")
+                elif phase == "connection.start_tls":
+                    upstream_connect_seconds.observe(time.perf_counter() - begin, provider, "tls")
+
+    return trace
+
+
+class StreamObserver:
+    """记录一次流式生成的首 token 延迟、token 间隔和速度"""
+
+    __slots__ = ("provider", "model", "start", "first", "last", "chunks", "usage", "outcome")
+
+    def __init__(self, provider: str, model: str):
+        self.provider = provider
+        self.model = model
+        self.start = time.perf_counter()
+        self.first: Optional[float] = None
+        self.last = 0.0
+        self.chunks = 0
+        self.usage: Optional[dict] = None
+        self.outcome = "success"
+        streams_in_flight.inc(provider)
+
+    def on_chunk(self, chunk: dict) -> None:
+        chunk_type = chunk.get("type")
+        if chunk_type == "content":
+            now = time.perf_counter()
+            if self.first is None:
+                self.first = now
+                time_to_first_token.observe(now - self.start, self.provider, self.model)
+            else:
+                inter_token_gap.observe(now - self.last, self.provider, self.model)
+            self.last = now
+            self.chunks += 1
+        elif chunk_type == "usage":
+            self.usage = chunk.get("usage")
+        elif chunk.get("error"):
+            self.outcome = "error"
+
+    def finish(self, outcome: Optional[str] = None) -> None:
+        streams_in_flight.dec(self.provider)
+        outcome = outcome or self.outcome
+        elapsed = time.perf_counter() - self.start
+        chat_requests.inc(self.provider, self.model, "stream", outcome)
+        if outcome == "cancelled":
+            stage = "generating" if self.first is not None else "waiting"
+            stream_cancellations.inc(self.provider, self.model, stage)
+        generation_seconds.observe(elapsed, self.provider, self.model, "stream")
+        if self.first is not None and self.last > self.first:
+            tokens = completion_tokens(self.usage) or self.chunks
+            tokens_per_second.observe(tokens / (self.last - self.first), self.provider, self.model)
+
+
+def completion_tokens(usage: Optional[dict]) -> int:
+    if not usage:
+        return 0
+    return usage.get("completion_tokens") or usage.get("output_tokens") or 0
+
+
+def record_request(provider: str, model: str, outcome: str, elapsed: float, usage: Optional[dict] = None) -> None:
+    """记录一次非流式请求"""
+    chat_requests.inc(provider, model, "chat", outcome)
+    generation_seconds.observe(elapsed, provider, model, "chat")
+    tokens = completion_tokens(usage)
+    if tokens and elapsed > 0:
+        tokens_per_second.observe(tokens / elapsed, provider, model)
+
+
+def render() -> str:
+    return registry.render()
+
+
+def collect_pool_stats(pool_stats: Callable[[], dict]) -> Callable[[], None]:
+    """把连接池统计转换为 upstream_pool_connections 仪表"""
+    def collector() -> None:
+        pool_connections.values.clear()
+        for pool in pool_stats().get("pools", []):
+            labels: Iterable[str] = (pool["provider"], pool["origin"])
+            pool_connections.set(*labels, "active", value=pool["active_connections"])
+            pool_connections.set(*labels, "idle", value=pool["idle_connections"])
+            pool_connections.set(*labels, "queued", value=pool["queued_requests"])
+    return collector
@@ -0,0 +1,100 @@
+"""/api/models 的模型列表缓存
+
+按 (provider, base_url, API密钥指纹) 缓存过滤后的 ModelsResponse：
+- TTL 内直接返回
+- 过期但仍在 stale 窗口内：立即返回旧数据，后台刷新（stale-while-revalidate）
+- 超出 stale 窗口或强制刷新：等待重新获取
+并发的获取请求通过 single-flight 合并成一次上游调用。
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from services.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+CatalogKey = Tuple[str, str, str]
+
+
+def key_fingerprint(api_key: str) -> str:
+    """API密钥指纹，避免把明文密钥留在缓存键里"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+class ModelCatalogCache:
+    """带 stale-while-revalidate 的模型列表缓存"""
+
+    def __init__(self, ttl: float = 600.0, stale_ttl: float = 24 * 3600.0):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        # key -> (fetched_at, value)
+        self._entries: Dict[CatalogKey, Tuple[float, Any]] = {}
+        self._flights = SingleFlight()
+        self._background: Set[asyncio.Task] = set()
+        self.counters = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "refresh_errors": 0}
+
+    @classmethod
+    def from_env(cls) -> "ModelCatalogCache":
+        return cls(
+            ttl=float(os.getenv("MODEL_CATALOG_TTL", "600")),
+            stale_ttl=float(os.getenv("MODEL_CATALOG_STALE_TTL", str(24 * 3600))),
+        )
+
+    def key_for(self, provider: str, base_url: str, api_key: str) -> CatalogKey:
+        return (provider, base_url.rstrip("/"), key_fingerprint(api_key))
+
+    async def get(self, key: CatalogKey, fetch: Callable[[], Awaitable[Any]], force_refresh: bool = False) -> Any:
+        """取得模型列表，必要时调用 fetch() 获取"""
+        entry = self._entries.get(key)
+        if entry is not None and not force_refresh:
+            age = time.monotonic() - entry[0]
+            if age < self.ttl:
+                self.counters["hits"] += 1
+                return entry[1]
+            if age < self.ttl + self.stale_ttl:
+                self.counters["stale_hits"] += 1
+                self._refresh_in_background(key, fetch)
+                return entry[1]
+
+        self.counters["misses"] += 1
+        return await self._flights.do(key, lambda: self._fetch(key, fetch))
+
+    async def _fetch(self, key: CatalogKey, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        value = await fetch()
+        self._entries[key] = (time.monotonic(), value)
+        self.counters["refreshes"] += 1
+        return value
+
+    def _refresh_in_background(self, key: CatalogKey, fetch: Callable[[], Awaitable[Any]]) -> None:
+        if self._flights.in_flight(key):
+            return
+
+        async def refresh():
+            try:
+                await self._flights.do(key, lambda: self._fetch(key, fetch))
+            except Exception as e:
+                # 刷新失败时保留旧数据，下次请求再重试
+                self.counters["refresh_errors"] += 1
+                logger.warning("后台刷新模型列表失败 %s: %s", key[:2], e)
+
+        task = asyncio.ensure_future(refresh())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def invalidate(self, provider: Optional[str] = None) -> None:
+        """清除缓存；指定 provider 时只清除该提供商"""
+        if provider is None:
+            self._entries.clear()
+            return
+        for key in [k for k in self._entries if k[0] == provider]:
+            del self._entries[key]
+
+    def stats(self) -> dict:
+        return {**self.counters, "entries": len(self._entries), "ttl": self.ttl, "stale_ttl": self.stale_ttl}
+
+
+model_catalog = ModelCatalogCache.from_env()
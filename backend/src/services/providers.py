@@ -0,0 +1,270 @@
+"""模型提供商适配层
+
+每个提供商的差异（请求头、端点地址、消息格式、响应解析、流式事件解析）
+集中在一个 ProviderAdapter 子类里。适配器按 (provider, api_key, base_url)
+缓存，请求头和端点地址在创建时算好，配置不变就一直复用。
+
+新增 OpenAI 兼容的厂商只需要：
+    register_adapter("vendor", OpenAICompatibleAdapter, label="某厂商")
+注册时适配器的 name 会设为 "vendor"，指标标签、端点池和错误信息都按这个厂商区分。
+"""
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional, Tuple, Type
+
+import httpx
+
+
+class ProviderAdapter:
+    """提供商适配器基类"""
+
+    name = ""
+    label = ""                    # 错误信息里显示的名称
+    chat_path = "/chat/completions"
+    models_path = "/models"
+    auth_hint = " - 认证失败，请检查API密钥"
+    # 请求级超时；USE_CLIENT_DEFAULT 表示使用连接池的默认超时
+    timeout = httpx.USE_CLIENT_DEFAULT
+    follow_redirects = False
+    # 流式请求带上 stream_options.include_usage，上游在最后一帧返回用量，准入控制按实际用量结算；
+    # 很多 OpenAI 兼容厂商不认识这个参数会直接返回 400，所以只对确认支持的提供商开启
+    stream_usage = False
+
+    def __init__(self, config: dict):
+        self.api_key = config.get("api_key", "")
+        self.base_url = config.get("base_url", "")
+        self.headers = self.build_headers()
+        self.chat_url = self.resolve_chat_url()
+        self.models_url = self.resolve_models_url()
+
+    # ---- 预计算部分 ----
+    def build_headers(self) -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def resolve_chat_url(self) -> str:
+        return f"{self.base_url}{self.chat_path}"
+
+    def resolve_models_url(self) -> str:
+        return f"{self.base_url}{self.models_path}"
+
+    def key_error(self) -> Optional[str]:
+        """API密钥格式校验，返回错误信息或 None"""
+        return None
+
+    # ---- 每个请求的部分 ----
+    def build_payload(self, request, stream: bool = False) -> dict:
+        payload = {
+            "model": request.model,
+            "messages": [{"role": msg.role, "content": msg.content} for msg in request.messages],
+            "temperature": request.temperature,
+            "max_tokens": request.max_tokens
+        }
+        if stream:
+            payload["stream"] = True
+            if self.stream_usage:
+                payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    def parse_response(self, data) -> Tuple[str, Optional[dict]]:
+        """解析非流式响应，返回 (内容, 用量)"""
+        if not isinstance(data, dict) or 'choices' not in data or len(data['choices']) == 0:
+            raise ValueError(f"{self.label} API返回了无效的响应")
+        return data["choices"][0]["message"]["content"], data.get("usage")
+
+    def parse_stream_event(self, data: dict, usage: dict) -> Iterator[dict]:
+        """解析一个流式事件，产出 content/usage 事件；usage 是本次流的累计用量"""
+        choices = data.get("choices")
+        if choices:
+            delta = choices[0].get("delta", {})
+            if delta.get("content") is not None:
+                yield {"type": "content", "content": delta["content"]}
+        if data.get("usage"):
+            usage.update(data["usage"])
+            yield {"type": "usage", "usage": dict(usage)}
+
+    def parse_error(self, response: httpx.Response) -> str:
+        """把非200响应转换为错误信息"""
+        try:
+            error_data = response.json()
+        except ValueError:
+            error_detail = f"{self.label} API错误: HTTP {response.status_code}"
+        else:
+            error_detail = f"{self.label} API错误 (状态码: {response.status_code})"
+            if isinstance(error_data, dict):
+                if isinstance(error_data.get('error'), dict):
+                    error_detail = f"{self.label} API错误: {error_data['error'].get('message', '未知错误')}"
+                elif 'message' in error_data:
+                    error_detail = f"{self.label} API错误: {error_data['message']}"
+                elif 'detail' in error_data:
+                    error_detail = f"{self.label} API错误: {error_data['detail']}"
+        if response.status_code == 401:
+            error_detail += self.auth_hint
+        return error_detail
+
+
+class OpenAIAdapter(ProviderAdapter):
+    name = "openai"
+    label = "OpenAI"
+    auth_hint = " - 请检查API密钥是否正确、有效且有余额"
+    timeout = httpx.Timeout(60.0)
+    stream_usage = True
+
+    def key_error(self) -> Optional[str]:
+        if not self.api_key.startswith('sk-'):
+            return "OpenAI API密钥格式不正确，应该以'sk-'开头"
+        return None
+
+
+class AnthropicAdapter(ProviderAdapter):
+    name = "anthropic"
+    label = "Anthropic"
+    chat_path = "/v1/messages"
+    models_path = "/v1/models"
+    auth_hint = " - 请检查API密钥是否正确且有效"
+    timeout = httpx.Timeout(60.0)
+
+    def build_headers(self) -> Dict[str, str]:
+        return {
+            "x-api-key": self.api_key,
+            "Content-Type": "application/json",
+            "anthropic-version": "2023-06-01"
+        }
+
+    def key_error(self) -> Optional[str]:
+        if not self.api_key.startswith('sk-ant-'):
+            return "Anthropic API密钥格式不正确，应该以'sk-ant-'开头"
+        return None
+
+    def build_payload(self, request, stream: bool = False) -> dict:
+        # 转换消息格式为Anthropic格式
+        anthropic_messages = []
+        system_message = ""
+        for msg in request.messages:
+            if msg.role == "system":
+                system_message = msg.content
+            elif msg.role in ("user", "assistant"):
+                anthropic_messages.append({"role": msg.role, "content": msg.content})
+
+        payload = {
+            "model": request.model,
+            "max_tokens": request.max_tokens,
+            "temperature": request.temperature,
+            "messages": anthropic_messages
+        }
+        if system_message:
+            payload["system"] = system_message
+        if stream:
+            payload["stream"] = True
+        return payload
+
+    def parse_response(self, data) -> Tuple[str, Optional[dict]]:
+        if not isinstance(data, dict) or 'content' not in data or len(data['content']) == 0:
+            raise ValueError("Anthropic API返回了无效的响应")
+        # Anthropic返回的content是一个数组，获取第一个text内容
+        return data["content"][0]["text"], data.get("usage")
+
+    def parse_stream_event(self, data: dict, usage: dict) -> Iterator[dict]:
+        event_type = data.get("type")
+        if event_type == "content_block_delta":
+            delta = data.get("delta", {})
+            if delta.get("text") is not None:
+                yield {"type": "content", "content": delta["text"]}
+        elif event_type == "message_start":
+            usage.update(data.get("message", {}).get("usage") or {})
+        elif event_type == "message_delta":
+            usage.update(data.get("usage") or {})
+            yield {"type": "usage", "usage": dict(usage)}
+
+
+class OpenAICompatibleAdapter(ProviderAdapter):
+    """自定义 OpenAI 兼容端点（硅基流动等）"""
+
+    name = "custom"
+    label = "自定义"
+    auth_hint = " - 认证失败，请检查API密钥和Base URL是否正确"
+    follow_redirects = True
+
+    def build_headers(self) -> Dict[str, str]:
+        headers = super().build_headers()
+        headers["User-Agent"] = "AI-Chat-App/1.0"
+        return headers
+
+    def resolve_chat_url(self) -> str:
+        base_url = self.base_url.rstrip('/')
+        if base_url.endswith(self.chat_path):
+            return base_url
+        return f"{base_url}{self.chat_path}"
+
+    def resolve_models_url(self) -> str:
+        base_url = self.base_url.rstrip('/')
+        if base_url.endswith(self.chat_path):
+            base_url = base_url[:-len(self.chat_path)]
+        return f"{base_url}{self.models_path}"
+
+    def parse_response(self, data) -> Tuple[str, Optional[dict]]:
+        # 支持多种响应格式
+        message_content = ""
+        if not isinstance(data, dict):
+            raise ValueError("自定义API返回了无法识别的响应格式")
+        if 'choices' in data and len(data['choices']) > 0:
+            # OpenAI兼容格式
+            choice = data['choices'][0]
+            if 'message' in choice and 'content' in choice['message']:
+                message_content = choice['message']['content']
+            elif 'text' in choice:
+                message_content = choice['text']
+        elif 'content' in data:
+            # 直接内容格式
+            if isinstance(data['content'], list) and len(data['content']) > 0:
+                message_content = data['content'][0].get('text', str(data['content']))
+            else:
+                message_content = str(data['content'])
+        elif 'response' in data:
+            # 另一种常见格式
+            message_content = str(data['response'])
+        else:
+            raise ValueError("自定义API返回了无法识别的响应格式")
+
+        if not message_content:
+            raise ValueError("自定义API返回了空的响应内容")
+        return message_content, data.get("usage")
+
+
+# provider 名称 -> 适配器类；未注册的 provider 按自定义 OpenAI 兼容端点处理
+ADAPTERS: Dict[str, Type[ProviderAdapter]] = {
+    "openai": OpenAIAdapter,
+    "anthropic": AnthropicAdapter,
+    "custom": OpenAICompatibleAdapter,
+}
+
+_ADAPTER_CACHE_SIZE = 64
+_adapter_cache: "OrderedDict[tuple, ProviderAdapter]" = OrderedDict()
+
+
+def register_adapter(provider: str, adapter_cls: Type[ProviderAdapter], label: Optional[str] = None) -> None:
+    """注册新的提供商适配器；复用其他厂商的适配器类时派生一个以 provider 命名的子类"""
+    if adapter_cls.name != provider or label is not None:
+        adapter_cls = type(adapter_cls.__name__, (adapter_cls,), {"name": provider, "label": label or provider})
+    ADAPTERS[provider] = adapter_cls
+    clear_adapter_cache()
+
+
+def clear_adapter_cache() -> None:
+    _adapter_cache.clear()
+
+
+def get_adapter(provider: str, config: dict) -> ProviderAdapter:
+    """按配置取得适配器实例，配置未变化时复用预计算结果"""
+    key = (provider, config.get("api_key", ""), config.get("base_url", ""))
+    adapter = _adapter_cache.get(key)
+    if adapter is not None:
+        _adapter_cache.move_to_end(key)
+        return adapter
+
+    adapter = ADAPTERS.get(provider, OpenAICompatibleAdapter)(config)
+    _adapter_cache[key] = adapter
+    if len(_adapter_cache) > _ADAPTER_CACHE_SIZE:
+        _adapter_cache.popitem(last=False)
+    return adapter
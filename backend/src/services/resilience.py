@@ -0,0 +1,295 @@
+"""上游调用的重试与对冲
+
+重试：请求还没有发出时的连接 / 连接池 / 写入失败，以及 UPSTREAM_RETRY_STATUSES
+中的状态码按带抖动的指数退避重试（full jitter）；响应带 Retry-After 时至少等待
+该时长，超过最大退避时间则不再重试，直接把响应交给调用方。读超时不重试，因为
+已经等了完整的超时时间。请求发出后连接被重置（ReadError / RemoteProtocolError）
+时上游可能已经生成并计费，非流式请求不重试；流式请求只在还没有输出任何 token
+时重试（见 main.py）。一次调用的所有重试，包括流式正文读取失败后的重试，
+共用 RetryState 里的同一个计数，总次数不超过 UPSTREAM_RETRY_ATTEMPTS。
+
+对冲：对 UPSTREAM_HEDGE_PROVIDERS 中的提供商，如果第一个请求在该模型历史
+延迟的 P(UPSTREAM_HEDGE_PERCENTILE) 内还没有返回，就再发一个相同的请求，
+取先返回的非 5xx 响应，取消另一个。样本不足 UPSTREAM_HEDGE_MIN_SAMPLES 时不对冲。
+"""
+import asyncio
+import email.utils
+import logging
+import os
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+import httpx
+
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# 请求还没有完整发出、上游不可能开始生成，可以安全重发的传输层错误
+RETRYABLE_ERRORS = (
+    httpx.ConnectError,
+    httpx.ConnectTimeout,
+    httpx.PoolTimeout,
+    httpx.WriteError,
+)
+# 流式请求在收到第一个正文字节之前断开连接，也可以重发
+STREAM_RETRYABLE_ERRORS = RETRYABLE_ERRORS + (
+    httpx.RemoteProtocolError,
+    httpx.ReadError,
+)
+
+
+def _providers(value: str) -> frozenset:
+    return frozenset(p.strip() for p in value.split(",") if p.strip())
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """重试配置，max_attempts 包含第一次请求"""
+    max_attempts: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 8.0
+    retry_statuses: frozenset = frozenset({429, 500, 502, 503, 504})
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        return cls(
+            max_attempts=max(1, int(os.getenv("UPSTREAM_RETRY_ATTEMPTS", "3"))),
+            base_delay=float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", "0.5")),
+            max_delay=float(os.getenv("UPSTREAM_RETRY_MAX_DELAY", "8")),
+            retry_statuses=frozenset(
+                int(code) for code in os.getenv("UPSTREAM_RETRY_STATUSES", "429,500,502,503,504").split(",")
+                if code.strip()
+            ),
+        )
+
+    def backoff(self, attempt: int) -> float:
+        """第 attempt 次重试前的等待时间（full jitter）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+@dataclass(frozen=True)
+class HedgePolicy:
+    """对冲配置"""
+    providers: frozenset = frozenset()
+    percentile: float = 95.0
+    min_samples: int = 20
+    min_delay: float = 0.5
+
+    @classmethod
+    def from_env(cls) -> "HedgePolicy":
+        return cls(
+            providers=_providers(os.getenv("UPSTREAM_HEDGE_PROVIDERS", "")),
+            percentile=float(os.getenv("UPSTREAM_HEDGE_PERCENTILE", "95")),
+            min_samples=int(os.getenv("UPSTREAM_HEDGE_MIN_SAMPLES", "20")),
+            min_delay=float(os.getenv("UPSTREAM_HEDGE_MIN_DELAY", "0.5")),
+        )
+
+    def enabled_for(self, provider: str) -> bool:
+        return "*" in self.providers or provider in self.providers
+
+
+LatencyKey = Tuple[str, str, bool]
+
+
+class LatencyTracker:
+    """按 (provider, model, 是否流式) 记录最近的响应延迟"""
+
+    def __init__(self, window: int = 256):
+        self.window = window
+        self._samples: Dict[LatencyKey, Deque[float]] = {}
+
+    def observe(self, key: LatencyKey, seconds: float) -> None:
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = self._samples[key] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def percentile(self, key: LatencyKey, percentile: float, min_samples: int = 1) -> Optional[float]:
+        samples = self._samples.get(key)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+        return ordered[index]
+
+    def stats(self) -> list:
+        result = []
+        for (provider, model, stream), samples in self._samples.items():
+            key = (provider, model, stream)
+            result.append({
+                "provider": provider,
+                "model": model,
+                "stream": stream,
+                "samples": len(samples),
+                "p50": self.percentile(key, 50),
+                "p95": self.percentile(key, 95),
+            })
+        return result
+
+
+def retry_after_seconds(response: httpx.Response) -> Optional[float]:
+    """解析 Retry-After（秒数或 HTTP 日期）"""
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+Send = Callable[[], Awaitable[httpx.Response]]
+
+
+@dataclass
+class RetryState:
+    """一次上游调用已经用掉的重试次数，在 send() 和调用方的重试之间共享"""
+    attempt: int = 0
+
+
+class UpstreamResilience:
+    """重试 + 对冲"""
+
+    def __init__(self, retry: Optional[RetryPolicy] = None, hedge: Optional[HedgePolicy] = None):
+        self.retry = retry or RetryPolicy.from_env()
+        self.hedge = hedge or HedgePolicy.from_env()
+        self.latency = LatencyTracker()
+
+    def can_retry(self, attempt: int) -> bool:
+        """attempt 从 0 开始计数，判断是否还能再试一次"""
+        return attempt + 1 < self.retry.max_attempts
+
+    async def send(self, provider: str, model: str, send: Send, stream: bool = False,
+                   state: Optional[RetryState] = None) -> httpx.Response:
+        """发送请求，必要时重试和对冲；返回最后一次的响应（状态码由调用方处理）
+
+        stream=True 时 send 返回的是未读取正文的流式响应，被丢弃的响应会在这里关闭。
+        调用方自己还会重试时传入 state，两边的重试计入同一个次数上限。
+        """
+        key = (provider, model, stream)
+        state = state or RetryState()
+        retryable = STREAM_RETRYABLE_ERRORS if stream else RETRYABLE_ERRORS
+        while True:
+            attempt = state.attempt
+            try:
+                response = await self._hedged(provider, key, send)
+            except retryable as e:
+                if not self.can_retry(attempt):
+                    raise
+                delay = self.retry.backoff(attempt)
+                reason = type(e).__name__
+            else:
+                if response.status_code not in self.retry.retry_statuses or not self.can_retry(attempt):
+                    return response
+                delay = self.retry.backoff(attempt)
+                retry_after = retry_after_seconds(response)
+                if retry_after is not None:
+                    if retry_after > self.retry.max_delay:
+                        return response
+                    delay = max(delay, retry_after)
+                reason = str(response.status_code)
+                await response.aclose()
+
+            state.attempt = attempt = attempt + 1
+            metrics.upstream_retries.inc(provider, reason)
+            logger.info("上游请求失败（%s），%.2f 秒后第 %d 次重试", reason, delay, attempt,
+                        extra={"provider": provider, "model": model})
+            await asyncio.sleep(delay)
+
+    async def _hedged(self, provider: str, key: LatencyKey, send: Send) -> httpx.Response:
+        started = time.perf_counter()
+        delay = None
+        if self.hedge.enabled_for(provider):
+            delay = self.latency.percentile(key, self.hedge.percentile, self.hedge.min_samples)
+            if delay is not None:
+                delay = max(delay, self.hedge.min_delay)
+
+        if delay is None:
+            response = await send()
+        else:
+            response = await self._race(provider, asyncio.ensure_future(send()), send, delay)
+        if response.status_code < 400:
+            self.latency.observe(key, time.perf_counter() - started)
+        return response
+
+    async def _race(self, provider: str, primary: asyncio.Future, send: Send, delay: float) -> httpx.Response:
+        """primary 超过 delay 还没返回时发出第二个请求，取先返回的非 5xx 响应
+
+        一个请求返回 5xx 时继续等另一个；两个都失败时返回 5xx 响应（由 send 决定是否重试），
+        都没有响应时抛出最后一个异常。
+        """
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+        except asyncio.CancelledError:
+            primary.cancel()
+            raise
+        if done:
+            return primary.result()
+
+        metrics.upstream_hedges.inc(provider, "fired")
+        hedge = asyncio.ensure_future(send())
+        pending = {primary, hedge}
+        winner: Optional[httpx.Response] = None
+        failed: List[httpx.Response] = []
+        error: BaseException = RuntimeError("对冲请求没有返回结果")
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    exception = task.exception()
+                    if exception is not None:
+                        error = exception
+                        continue
+                    response = task.result()
+                    if winner is None and response.status_code < 500:
+                        winner = response
+                        if task is hedge:
+                            metrics.upstream_hedges.inc(provider, "won")
+                    else:
+                        failed.append(response)
+            if winner is None:
+                if not failed:
+                    raise error
+                winner = failed.pop()
+            return winner
+        finally:
+            for task in pending:
+                task.cancel()
+                task.add_done_callback(_close_discarded)
+            for response in failed:
+                asyncio.ensure_future(response.aclose())
+
+    def stats(self) -> dict:
+        return {
+            "retry": {
+                "max_attempts": self.retry.max_attempts,
+                "base_delay": self.retry.base_delay,
+                "max_delay": self.retry.max_delay,
+                "statuses": sorted(self.retry.retry_statuses),
+            },
+            "hedge": {
+                "providers": sorted(self.hedge.providers),
+                "percentile": self.hedge.percentile,
+                "min_samples": self.hedge.min_samples,
+                "min_delay": self.hedge.min_delay,
+            },
+            "latency": self.latency.stats(),
+        }
+
+
+def _close_discarded(task: asyncio.Future) -> None:
+    """被取消前已经拿到的响应需要关闭，归还连接"""
+    if task.cancelled() or task.exception() is not None:
+        return
+    asyncio.ensure_future(task.result().aclose())
+
+
+upstream_resilience = UpstreamResilience()
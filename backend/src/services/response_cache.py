@@ -0,0 +1,241 @@
+"""确定性聊天请求的响应缓存
+
+两级缓存：进程内 LRU（按条数和字节数淘汰）+ SQLite 持久层（按总字节数淘汰）。
+两级都带 TTL。只有请求显式开启（ChatRequest.cache=True），或者温度不高于
+RESPONSE_CACHE_MAX_TEMPERATURE 时才会参与缓存。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from services.storage import data_path
+
+
+@dataclass(frozen=True)
+class CacheSettings:
+    """缓存配置"""
+    ttl: float = 24 * 3600
+    max_memory_entries: int = 512
+    max_memory_bytes: int = 16 * 1024 * 1024
+    max_disk_bytes: int = 256 * 1024 * 1024
+    # 温度不高于该值的请求自动缓存；None 表示只缓存显式开启的请求
+    max_temperature: Optional[float] = None
+    db_path: Optional[str] = None
+
+    @classmethod
+    def from_env(cls) -> "CacheSettings":
+        max_temperature = os.getenv("RESPONSE_CACHE_MAX_TEMPERATURE", "")
+        return cls(
+            ttl=float(os.getenv("RESPONSE_CACHE_TTL", str(24 * 3600))),
+            max_memory_entries=int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES", "512")),
+            max_memory_bytes=int(os.getenv("RESPONSE_CACHE_MEMORY_BYTES", str(16 * 1024 * 1024))),
+            max_disk_bytes=int(os.getenv("RESPONSE_CACHE_DISK_BYTES", str(256 * 1024 * 1024))),
+            max_temperature=float(max_temperature) if max_temperature else None,
+            db_path=os.getenv("RESPONSE_CACHE_DB") or None,
+        )
+
+
+def request_cache_key(request, config: dict) -> str:
+    """请求的规范化哈希：同一上游、模型、消息和采样参数得到同一个键"""
+    canonical = {
+        "provider": request.provider,
+        "base_url": (config.get("base_url") or "").rstrip("/"),
+        "model": request.model,
+        "messages": [[msg.role, msg.content] for msg in request.messages],
+        "temperature": request.temperature,
+        "max_tokens": request.max_tokens,
+    }
+    encoded = json.dumps(canonical, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """内存 LRU + SQLite 两级响应缓存"""
+
+    def __init__(self, settings: Optional[CacheSettings] = None):
+        self.settings = settings or CacheSettings.from_env()
+        # key -> (expires_at, size, value)
+        self._memory: "OrderedDict[str, Tuple[float, int, dict]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+            "expired": 0,
+        }
+
+    def enabled_for(self, request) -> bool:
+        """请求是否参与缓存"""
+        if request.cache is not None:
+            return request.cache
+        threshold = self.settings.max_temperature
+        return threshold is not None and request.temperature <= threshold
+
+    # ---- 内存层 ----
+    def _memory_get(self, key: str) -> Optional[dict]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        expires_at, size, value = entry
+        if expires_at < time.time():
+            self._memory_pop(key)
+            self.counters["expired"] += 1
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    def _memory_put(self, key: str, value: dict, size: int, expires_at: float) -> None:
+        if size > self.settings.max_memory_bytes:
+            return
+        self._memory_pop(key)
+        self._memory[key] = (expires_at, size, value)
+        self._memory_bytes += size
+        while (len(self._memory) > self.settings.max_memory_entries
+               or self._memory_bytes > self.settings.max_memory_bytes):
+            _, (_, old_size, _) = self._memory.popitem(last=False)
+            self._memory_bytes -= old_size
+            self.counters["memory_evictions"] += 1
+
+    def _memory_pop(self, key: str) -> None:
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= entry[1]
+
+    # ---- SQLite 层（在线程池里执行） ----
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            path = self.settings.db_path or data_path("response_cache.sqlite3")
+            db = sqlite3.connect(path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS idx_responses_access ON responses(last_access)")
+            self._db = db
+        return self._db
+
+    def _open(self) -> None:
+        with self._db_lock:
+            self._connect()
+
+    def _disk_get(self, key: str) -> Optional[Tuple[float, str]]:
+        with self._db_lock:
+            db = self._connect()
+            row = db.execute("SELECT value, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if row[1] < now:
+                db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                db.commit()
+                self.counters["expired"] += 1
+                return None
+            db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            db.commit()
+            return row[1], row[0]
+
+    def _disk_put(self, key: str, encoded: str, size: int, expires_at: float) -> None:
+        with self._db_lock:
+            db = self._connect()
+            now = time.time()
+            db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, encoded, size, expires_at, now),
+            )
+            db.execute("DELETE FROM responses WHERE expires_at < ?", (now,))
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            excess = total - self.settings.max_disk_bytes
+            if excess > 0:
+                victims = []
+                for victim_key, victim_size in db.execute(
+                        "SELECT key, size FROM responses ORDER BY last_access"):
+                    victims.append((victim_key,))
+                    excess -= victim_size
+                    if excess <= 0:
+                        break
+                db.executemany("DELETE FROM responses WHERE key = ?", victims)
+                self.counters["disk_evictions"] += len(victims)
+            db.commit()
+
+    def _disk_clear(self) -> None:
+        with self._db_lock:
+            db = self._connect()
+            db.execute("DELETE FROM responses")
+            db.commit()
+
+    # ---- 对外接口 ----
+    async def open(self) -> None:
+        """提前打开数据库（建表），启动时调用，第一个请求不用再等"""
+        await asyncio.to_thread(self._open)
+
+    async def get(self, key: str) -> Optional[dict]:
+        value = self._memory_get(key)
+        if value is not None:
+            self.counters["memory_hits"] += 1
+            return value
+        row = await asyncio.to_thread(self._disk_get, key)
+        if row is None:
+            self.counters["misses"] += 1
+            return None
+        expires_at, encoded = row
+        value = json.loads(encoded)
+        self._memory_put(key, value, len(encoded.encode("utf-8")), expires_at)
+        self.counters["disk_hits"] += 1
+        return value
+
+    async def set(self, key: str, value: dict) -> None:
+        encoded = json.dumps(value, ensure_ascii=False)
+        size = len(encoded.encode("utf-8"))
+        expires_at = time.time() + self.settings.ttl
+        self._memory_put(key, value, size, expires_at)
+        await asyncio.to_thread(self._disk_put, key, encoded, size, expires_at)
+        self.counters["stores"] += 1
+
+    async def clear(self) -> None:
+        self._memory.clear()
+        self._memory_bytes = 0
+        await asyncio.to_thread(self._disk_clear)
+
+    def close(self) -> None:
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def stats(self) -> dict:
+        hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+        lookups = hits + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "ttl": self.settings.ttl,
+            "max_temperature": self.settings.max_temperature,
+        }
+
+
+def replay_chunks(content: str, chunk_size: int = 64):
+    """把缓存的完整回答切成流式 content 事件"""
+    for start in range(0, len(content), chunk_size):
+        yield {"type": "content", "content": content[start:start + chunk_size]}
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,96 @@
+"""API 密钥的本地加密
+
+主密钥来自 CONFIG_SECRET_KEY（base64 的 32 字节），没有设置时在数据目录下
+生成 config.key（仅当前用户可读）。数据库文件被复制、同步或备份时，里面的
+密钥是密文；主密钥要和数据库分开保管时设置 CONFIG_SECRET_KEY。
+
+加密用 cryptography 的 Fernet（AES-128-CBC + HMAC-SHA256），密文带 "f1:" 格式前缀。
+"""
+import base64
+import logging
+import os
+import secrets
+from typing import Optional, Union
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from services.storage import data_path
+
+logger = logging.getLogger(__name__)
+
+_FERNET_PREFIX = "f1:"
+_KEY_BYTES = 32
+
+
+class SecretError(Exception):
+    """主密钥无效，或密文无法解密（主密钥不对、数据损坏）"""
+
+
+def _decode_key(value: Union[str, bytes], source: str) -> bytes:
+    try:
+        key = base64.urlsafe_b64decode(value)
+    except ValueError:
+        key = b""
+    if len(key) != _KEY_BYTES:
+        raise SecretError(f"{source} 不是 base64 编码的 {_KEY_BYTES} 字节密钥")
+    return key
+
+
+def _create_key_file(path: str) -> None:
+    """生成密钥文件：先写完临时文件再硬链接到目标位置，其他进程要么看不到文件，要么读到完整的密钥
+
+    多个工作进程同时首次启动时只有一个链接成功，其余进程丢弃自己生成的密钥，使用已有的。
+    """
+    temp_path = f"{path}.{os.getpid()}.{secrets.token_hex(4)}.tmp"
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(Fernet.generate_key())
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.link(temp_path, path)
+        except FileExistsError:
+            return
+        logger.info("已生成配置加密密钥 %s", path)
+    finally:
+        os.unlink(temp_path)
+
+
+def _load_master_key(key_file: Optional[str] = None) -> bytes:
+    configured = os.getenv("CONFIG_SECRET_KEY", "").strip()
+    if configured:
+        return _decode_key(configured, "CONFIG_SECRET_KEY")
+    path = key_file or data_path("config.key")
+    if not os.path.exists(path):
+        _create_key_file(path)
+    with open(path, "rb") as f:
+        return _decode_key(f.read().strip(), path)
+
+
+class SecretBox:
+    """加密/解密短文本"""
+
+    def __init__(self, master_key: bytes):
+        if len(master_key) != _KEY_BYTES:
+            raise SecretError(f"主密钥必须是 {_KEY_BYTES} 字节")
+        self._fernet = Fernet(base64.urlsafe_b64encode(master_key))
+
+    @classmethod
+    def from_env(cls, key_file: Optional[str] = None) -> "SecretBox":
+        return cls(_load_master_key(key_file))
+
+    def encrypt(self, plaintext: str) -> str:
+        if not plaintext:
+            return ""
+        return _FERNET_PREFIX + self._fernet.encrypt(plaintext.encode("utf-8")).decode("ascii")
+
+    def decrypt(self, token: str) -> str:
+        if not token:
+            return ""
+        if not token.startswith(_FERNET_PREFIX):
+            raise SecretError("未知的密文格式")
+        try:
+            return self._fernet.decrypt(token[len(_FERNET_PREFIX):].encode("ascii")).decode("utf-8")
+        except (InvalidToken, UnicodeError):
+            raise SecretError("密钥校验失败")
@@ -0,0 +1,83 @@
+"""JSON 序列化后端
+
+按 JSON_BACKEND（auto / orjson / msgspec / json）选择实现，auto 时依次尝试
+orjson、msgspec，都没有安装时用标准库。dumps 直接返回 UTF-8 字节（不转义
+非 ASCII、紧凑分隔符），loads 接受 bytes 或 str。
+
+FastJSONResponse 直接序列化 Pydantic 模型（pydantic-core 生成字节），
+用于已经在构造时校验过的 ChatResponse / ModelsResponse，跳过 FastAPI
+response_model 的二次校验和 jsonable_encoder。
+"""
+import json
+import logging
+import os
+from typing import Any, Callable, Tuple, Union
+
+from pydantic import BaseModel
+from starlette.responses import Response
+
+logger = logging.getLogger(__name__)
+
+Dumps = Callable[[Any], bytes]
+Loads = Callable[[Union[bytes, str]], Any]
+
+
+def _stdlib() -> Tuple[str, Dumps, Loads]:
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+    decoder = json.JSONDecoder()
+
+    def dumps(obj: Any) -> bytes:
+        return encoder.encode(obj).encode("utf-8")
+
+    def loads(data: Union[bytes, str]) -> Any:
+        # 跳过 json.loads 对字节输入的编码探测，这里的输入固定是 UTF-8
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytes(data).decode("utf-8")
+        return decoder.decode(data)
+
+    return "json", dumps, loads
+
+
+def _orjson() -> Tuple[str, Dumps, Loads]:
+    import orjson
+    return "orjson", orjson.dumps, orjson.loads
+
+
+def _msgspec() -> Tuple[str, Dumps, Loads]:
+    import msgspec
+    encoder = msgspec.json.Encoder()
+    decoder = msgspec.json.Decoder()
+    return "msgspec", encoder.encode, decoder.decode
+
+
+_BACKENDS = {"orjson": _orjson, "msgspec": _msgspec, "json": _stdlib}
+
+
+def select_backend(name: str = "auto") -> Tuple[str, Dumps, Loads]:
+    """返回 (后端名, dumps, loads)；指定的后端未安装时回退到自动选择"""
+    name = (name or "auto").strip().lower()
+    if name in _BACKENDS:
+        try:
+            return _BACKENDS[name]()
+        except ImportError:
+            logger.warning("JSON_BACKEND=%s 未安装，自动选择其他实现", name)
+    for factory in (_orjson, _msgspec):
+        try:
+            return factory()
+        except ImportError:
+            continue
+    return _stdlib()
+
+
+BACKEND, dumps, loads = select_backend(os.getenv("JSON_BACKEND", "auto"))
+
+
+class FastJSONResponse(Response):
+    """用当前后端序列化的 JSON 响应；内容是 Pydantic 模型时不再校验"""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, BaseModel):
+            return content.__pydantic_serializer__.to_json(content)
+        return dumps(content)
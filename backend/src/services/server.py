@@ -0,0 +1,158 @@
+"""后端进程的启动方式和启动耗时
+
+BACKEND_MODE 决定 `python src/main.py` 怎样运行 uvicorn：
+    development   默认，与之前一致：DEBUG=true 时开启自动重载，单进程
+    production    关闭重载，BACKEND_WORKERS 个工作进程（auto 为 CPU 核数）
+
+BACKEND_LOOP / BACKEND_HTTP 为 auto 时，安装了 uvloop / httptools 就使用，
+否则回退到 asyncio / h11。单进程且不重载时直接把已导入的 app 交给 uvicorn，
+不会再按 "main:app" 重新导入一遍；多进程时每个工作进程各自导入。
+
+注意：API 配置保存在共享的配置库里（services/config_store.py），但指标、
+准入计数和内存缓存仍然是每个工作进程各自一份，桌面端保持默认的 1 个即可。
+
+startup 记录各启动阶段的耗时，lifespan 启动完成后打日志，/ready 返回。
+本模块只依赖标准库，启动器进程不需要导入 FastAPI。
+"""
+import importlib.util
+import logging
+import os
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+_MODES = ("development", "production")
+
+
+def _available(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+@dataclass(frozen=True)
+class ServerSettings:
+    """uvicorn 启动参数"""
+    host: str = "127.0.0.1"
+    port: int = 8000
+    mode: str = "development"
+    debug: bool = True
+    workers: int = 1
+    # auto / uvloop / asyncio
+    loop: str = "auto"
+    # auto / httptools / h11
+    http: str = "auto"
+    log_level: str = "info"
+
+    @classmethod
+    def from_env(cls) -> "ServerSettings":
+        mode = os.getenv("BACKEND_MODE", "development").lower()
+        if mode not in _MODES:
+            logger.warning("未知的 BACKEND_MODE=%s，按 development 处理", mode)
+            mode = "development"
+        workers = os.getenv("BACKEND_WORKERS", "1").lower()
+        return cls(
+            host=os.getenv("BACKEND_HOST", "127.0.0.1"),
+            port=int(os.getenv("BACKEND_PORT", "8000")),
+            mode=mode,
+            debug=os.getenv("DEBUG", "true").lower() == "true",
+            workers=(os.cpu_count() or 1) if workers == "auto" else max(1, int(workers)),
+            loop=os.getenv("BACKEND_LOOP", "auto").lower(),
+            http=os.getenv("BACKEND_HTTP", "auto").lower(),
+            log_level=os.getenv("BACKEND_LOG_LEVEL", "info").lower(),
+        )
+
+    @property
+    def production(self) -> bool:
+        return self.mode == "production"
+
+    @property
+    def reload(self) -> bool:
+        return not self.production and self.debug
+
+    @property
+    def process_workers(self) -> int:
+        """重载模式只能单进程"""
+        return 1 if self.reload else self.workers
+
+    def resolved_loop(self) -> str:
+        if self.loop == "auto":
+            return "uvloop" if _available("uvloop") else "asyncio"
+        return self.loop
+
+    def resolved_http(self) -> str:
+        if self.http == "auto":
+            return "httptools" if _available("httptools") else "h11"
+        return self.http
+
+
+def run_server(app, settings: Optional[ServerSettings] = None, import_string: str = "main:app") -> None:
+    """按配置运行 uvicorn；app 是已导入的应用，单进程不重载时直接使用"""
+    import uvicorn
+
+    settings = settings or ServerSettings.from_env()
+    loop, http = settings.resolved_loop(), settings.resolved_http()
+    workers = settings.process_workers
+    target: Union[str, object] = import_string if settings.reload or workers > 1 else app
+    if isinstance(target, str):
+        # 重载和多进程模式下，uvicorn 用 multiprocessing 的 spawn 启动子进程。spawn 的子进程
+        # 会先按父进程 __main__.__file__ 把启动脚本（src/main.py）作为 __mp_main__ 完整执行
+        # 一遍，再由 uvicorn 按 import_string 导入 main:app，每个工作进程都会把 FastAPI 应用、
+        # 路由和服务单例各建两次。`if __name__ == "__main__"` 挡不住这次执行：应用就定义在
+        # main.py 的模块顶层，__mp_main__ 同样会建出一份。
+        # 以脚本方式启动（__spec__ 为 None）时 multiprocessing 靠 __file__ 找到要重新执行的脚本，
+        # 没有 __file__ 就跳过这一步，所以在启动子进程前去掉它；`python -m` 启动的情况不处理。
+        # 启动器进程之后只运行 uvicorn 的监控循环，不再用到 __main__.__file__。
+        main_module = sys.modules["__main__"]
+        if getattr(main_module, "__spec__", None) is None and hasattr(main_module, "__file__"):
+            del main_module.__file__
+    logger.info("启动模式 %s: workers=%d, loop=%s, http=%s, reload=%s",
+                settings.mode, workers, loop, http, settings.reload)
+    uvicorn.run(
+        target,
+        host=settings.host,
+        port=settings.port,
+        reload=settings.reload,
+        workers=workers if workers > 1 else None,
+        loop=loop,
+        http=http,
+        log_level=settings.log_level,
+        access_log=not settings.production,
+        app_dir=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+
+
+class StartupTimer:
+    """启动阶段耗时，从导入本模块开始计时"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.phases: Dict[str, float] = {}
+        self.ready = False
+
+    def mark(self, phase: str) -> None:
+        """记录上一个阶段结束到现在的耗时"""
+        now = time.perf_counter()
+        self.phases[phase] = now - self._last
+        self._last = now
+
+    def finish(self) -> None:
+        self.ready = True
+        logger.info("启动完成，总耗时 %.0f ms（%s）", self.total() * 1000,
+                    ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.phases.items()))
+
+    def total(self) -> float:
+        return self._last - self.started
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "pid": os.getpid(),
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()},
+            "total_ms": round(self.total() * 1000, 1),
+        }
+
+
+startup = StartupTimer()
@@ -0,0 +1,130 @@
+"""/api/chat/stream 的 SSE 帧格式
+
+provider 的流式生成器只产出增量事件：
+    {"type": "content", "content": "..."}      文本增量
+    {"type": "usage", "usage": {...}}           token 用量（可选）
+    {"error": True, "message": "..."}          错误
+
+这里负责把这些事件编码成客户端协商的线上格式：
+- full（默认，兼容旧版）：每帧带 content 和截至目前的 full_content
+- delta：每帧只带增量，可选每 N 帧发一次 checkpoint，结束时发一帧 final
+  携带完整文本和用量，整个回答只传输 O(n) 字节
+
+帧直接编码成字节（见 services/serialization.py），StreamingResponse 不再逐帧 encode。
+"""
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+from services.serialization import dumps
+
+STREAM_FORMAT_FULL = "full"
+STREAM_FORMAT_DELTA = "delta"
+STREAM_FORMATS = (STREAM_FORMAT_FULL, STREAM_FORMAT_DELTA)
+
+DATA_PREFIX = b"data: "
+FRAME_END = b"\n\n"
+DONE_FRAME = b"data: [DONE]\n\n"
+
+
+def negotiate_stream_format(query_value: Optional[str], header_value: Optional[str]) -> str:
+    """按 查询参数 > 请求头 > 默认 的顺序确定帧格式，未知值回退到 full"""
+    for value in (query_value, header_value):
+        if value:
+            value = value.strip().lower()
+            if value in STREAM_FORMATS:
+                return value
+    return STREAM_FORMAT_FULL
+
+
+def encode_frame(payload: dict) -> bytes:
+    return DATA_PREFIX + dumps(payload) + FRAME_END
+
+
+class StreamFrameEncoder(ABC):
+    """把 provider 事件编码为 SSE 帧，并累积完整文本"""
+
+    format = STREAM_FORMAT_FULL
+
+    def __init__(self):
+        self.usage: Optional[dict] = None
+
+    @property
+    @abstractmethod
+    def full_content(self) -> str:
+        """截至目前的完整文本"""
+
+    def encode(self, chunk: dict) -> Optional[bytes]:
+        """编码单个事件，不需要输出时返回 None"""
+        if chunk.get("error"):
+            return encode_frame(chunk)
+        chunk_type = chunk.get("type")
+        if chunk_type == "usage":
+            self.usage = chunk.get("usage")
+            return None
+        if chunk_type == "content":
+            return self._encode_content(chunk.get("content") or "")
+        return encode_frame(chunk)
+
+    @abstractmethod
+    def _encode_content(self, content: str) -> Optional[bytes]:
+        """编码一个文本增量"""
+
+    def finish(self) -> List[bytes]:
+        """流结束时需要额外输出的帧（不含 [DONE]）"""
+        return []
+
+
+class FullStreamEncoder(StreamFrameEncoder):
+    """旧版格式：每帧附带完整文本"""
+
+    format = STREAM_FORMAT_FULL
+
+    def __init__(self):
+        super().__init__()
+        self._text = ""
+
+    @property
+    def full_content(self) -> str:
+        return self._text
+
+    def _encode_content(self, content: str) -> Optional[bytes]:
+        self._text += content
+        return encode_frame({"type": "content", "content": content, "full_content": self._text})
+
+
+class DeltaStreamEncoder(StreamFrameEncoder):
+    """增量格式：只传 delta，按需发送 checkpoint 和 final 帧"""
+
+    format = STREAM_FORMAT_DELTA
+
+    def __init__(self, checkpoint_every: int = 0):
+        super().__init__()
+        self.checkpoint_every = max(0, checkpoint_every)
+        self._parts: List[str] = []
+        self._frames = 0
+
+    @property
+    def full_content(self) -> str:
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def _encode_content(self, content: str) -> Optional[bytes]:
+        self._parts.append(content)
+        self._frames += 1
+        frame = encode_frame({"type": "content", "content": content})
+        if self.checkpoint_every and self._frames % self.checkpoint_every == 0:
+            frame += encode_frame({"type": "checkpoint", "full_content": self.full_content})
+        return frame
+
+    def finish(self) -> List[bytes]:
+        final: Dict[str, Any] = {"type": "final", "full_content": self.full_content}
+        if self.usage is not None:
+            final["usage"] = self.usage
+        return [encode_frame(final)]
+
+
+def create_stream_encoder(stream_format: str, checkpoint_every: int = 0) -> StreamFrameEncoder:
+    if stream_format == STREAM_FORMAT_DELTA:
+        return DeltaStreamEncoder(checkpoint_every)
+    return FullStreamEncoder()
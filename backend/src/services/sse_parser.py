@@ -0,0 +1,141 @@
+"""上游 SSE 流的增量解码
+
+直接处理 aiter_bytes() 的原始字节块，按 SSE 规范解析：
+- 行结束符可以是 LF、CRLF 或单独的 CR（块末尾的 CR 会等下一块确认是否跟着 LF）
+- event / data / id / retry 字段，多行 data 用换行拼接，":" 开头的是注释
+- 空行分发事件；没有 data 的事件不分发；id 在事件之间保持
+
+行不会解码成 str，data 以 bytes 交给 JSON 解码器（services/serialization.py，
+安装了 orjson/msgspec 时自动使用）。
+"""
+from typing import AsyncIterator, List, Optional
+
+import httpx
+
+from services.serialization import loads
+
+_BOM = b"\xef\xbb\xbf"
+
+
+class SSEEvent:
+    """一个完整的 SSE 事件"""
+
+    __slots__ = ("event", "data", "id", "retry")
+
+    def __init__(self, event: str, data: bytes, id: Optional[str] = None, retry: Optional[int] = None):
+        self.event = event
+        self.data = data
+        self.id = id
+        self.retry = retry
+
+    def json(self):
+        return loads(self.data)
+
+    def __repr__(self) -> str:
+        return f"SSEEvent(event={self.event!r}, data={self.data!r}, id={self.id!r})"
+
+
+class SSEDecoder:
+    """把字节块增量解码为 SSEEvent"""
+
+    def __init__(self):
+        self._buffer = b""
+        self._skip_lf = False
+        self._started = False
+        self._data: List[bytes] = []
+        self._event: Optional[str] = None
+        self._last_id: Optional[str] = None
+        self._retry: Optional[int] = None
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        """输入一个字节块，返回其中已完整的事件"""
+        if not self._started:
+            if len(self._buffer) + len(chunk) < len(_BOM) and _BOM.startswith(self._buffer + chunk):
+                self._buffer += chunk
+                return []
+            self._started = True
+            chunk = self._buffer + chunk
+            self._buffer = b""
+            if chunk.startswith(_BOM):
+                chunk = chunk[len(_BOM):]
+        if self._skip_lf and chunk:
+            self._skip_lf = False
+            if chunk[0] == 0x0A:
+                chunk = chunk[1:]
+        if b"\r" in chunk:
+            # 少见的 CR/CRLF 流统一转成 LF；块末尾的 CR 先当作行结束，下一块开头的 LF 丢弃
+            if chunk[-1] == 0x0D:
+                self._skip_lf = True
+            chunk = chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        if b"\n" not in chunk:
+            self._buffer += chunk
+            return []
+
+        lines = chunk.split(b"\n")
+        if self._buffer:
+            lines[0] = self._buffer + lines[0]
+        self._buffer = lines.pop()
+        events: List[SSEEvent] = []
+        data = self._data
+        for line in lines:
+            # 热路径：data 行和空行直接在循环里处理，其余字段交给 _process_line
+            if line[:6] == b"data: ":
+                data.append(line[6:])
+            elif line:
+                self._process_line(line, events)
+                data = self._data
+            elif data:
+                events.append(SSEEvent(self._event or "message", data[0] if len(data) == 1 else b"\n".join(data),
+                                       self._last_id, self._retry))
+                data = self._data = []
+                self._event = None
+            else:
+                self._event = None
+        return events
+
+    def flush(self) -> List[SSEEvent]:
+        """流结束：处理没有换行结尾的最后一行，并分发未以空行结束的事件
+
+        规范要求丢弃不完整的事件，这里为兼容不发结尾空行的上游而保留。
+        """
+        events: List[SSEEvent] = []
+        if self._buffer:
+            self._process_line(self._buffer, events)
+            self._buffer = b""
+        self._process_line(b"", events)
+        return events
+
+    def _process_line(self, line: bytes, events: List[SSEEvent]) -> None:
+        if not line:
+            if self._data:
+                data = self._data[0] if len(self._data) == 1 else b"\n".join(self._data)
+                events.append(SSEEvent(self._event or "message", data, self._last_id, self._retry))
+            self._data = []
+            self._event = None
+            return
+        if line[0] == 0x3A:  # ":" 注释（心跳）
+            return
+
+        name, _, value = line.partition(b":")
+        if value[:1] == b" ":
+            value = value[1:]
+        if name == b"data":
+            self._data.append(value)
+        elif name == b"event":
+            self._event = value.decode("utf-8", "replace")
+        elif name == b"id":
+            if b"\0" not in value:
+                self._last_id = value.decode("utf-8", "replace")
+        elif name == b"retry":
+            if value.isdigit():
+                self._retry = int(value)
+
+
+async def aiter_sse(response: httpx.Response) -> AsyncIterator[SSEEvent]:
+    """逐个产出响应中的 SSE 事件"""
+    decoder = SSEDecoder()
+    async for chunk in response.aiter_bytes():
+        for event in decoder.feed(chunk):
+            yield event
+    for event in decoder.flush():
+        yield event
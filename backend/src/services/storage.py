@@ -0,0 +1,14 @@
+"""本地数据目录
+
+缓存、会话等持久化文件统一放在 DATA_DIR（默认 backend/data）下。
+"""
+import os
+
+_DEFAULT_DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "data"))
+
+
+def data_path(filename: str) -> str:
+    """返回数据目录下的文件路径，目录不存在时自动创建"""
+    data_dir = os.getenv("DATA_DIR") or _DEFAULT_DATA_DIR
+    os.makedirs(data_dir, exist_ok=True)
+    return os.path.join(data_dir, filename)
@@ -0,0 +1,33 @@
+"""接口测试共用的 fixture：每个测试使用独立的数据目录和存储实例"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+
+@pytest.fixture
+def app_main(tmp_path, monkeypatch):
+    """导入 main，并把各个本地存储换成数据目录在 tmp_path 下的新实例"""
+    monkeypatch.setenv("DATA_DIR", str(tmp_path))
+    monkeypatch.delenv("CONFIG_SECRET_KEY", raising=False)
+    import main
+    from services.config_store import ConfigStore, ConfigStoreSettings
+    from services.conversations import ConversationSettings, ConversationStore
+    from services.history import HistoryIndex, HistorySettings
+    from services.response_cache import CacheSettings, ResponseCache
+
+    monkeypatch.setattr(main, "config_store", ConfigStore(ConfigStoreSettings()))
+    monkeypatch.setattr(main, "conversation_store", ConversationStore(ConversationSettings()))
+    monkeypatch.setattr(main, "response_cache", ResponseCache(CacheSettings()))
+    monkeypatch.setattr(main, "history_index", HistoryIndex(HistorySettings()))
+    return main
+
+
+@pytest.fixture
+def client(app_main):
+    from fastapi.testclient import TestClient
+
+    with TestClient(app_main.app) as test_client:
+        yield test_client
@@ -0,0 +1,179 @@
+"""services/admission：排队放行、令牌预扣与结算、429 降并发"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services.admission import (  # noqa: E402
+    AdmissionController,
+    AdmissionRejected,
+    AdmissionSettings,
+    Ticket,
+    used_tokens,
+)
+
+
+def _controller(**overrides) -> AdmissionController:
+    settings = {"concurrency": 1, "queue_size": 2, "queue_timeout": 1.0, "model_tpm": {"m": 6000}, **overrides}
+    return AdmissionController(AdmissionSettings(**settings))
+
+
+def _tokens_available(controller: AdmissionController) -> int:
+    return controller.stats()["providers"]["p"]["models"]["m"]["tokens_available"]
+
+
+@pytest.mark.parametrize("usage, expected", [
+    (None, None),
+    ({}, None),
+    ({"total_tokens": 30}, 30),
+    ({"prompt_tokens": 10, "completion_tokens": 5}, 15),
+    ({"input_tokens": 7, "output_tokens": 3}, 10),
+])
+def test_used_tokens(usage, expected):
+    assert used_tokens(usage) == expected
+
+
+@pytest.mark.parametrize("used, available", [
+    (0, 6000),     # 失败或在第一个 token 前取消：全部退还
+    (300, 5700),   # 按实际用量结算
+    (None, 5000),  # 用量未知：按预扣的算
+    (1500, 4500),  # 超出预扣：补扣
+])
+def test_release_settles_tokens(used, available):
+    async def scenario():
+        controller = _controller()
+        ticket = await controller.acquire("p", "m", 1000)
+        assert _tokens_available(controller) == pytest.approx(5000, abs=5)
+        ticket.release(used)
+        ticket.release(0)  # 重复 release 不生效
+        return _tokens_available(controller)
+
+    assert asyncio.run(scenario()) == pytest.approx(available, abs=5)
+
+
+def test_queue_until_slot_released():
+    async def scenario():
+        controller = _controller()
+        first = await controller.acquire("p", "m", 10)
+        positions = []
+
+        async def second():
+            async for item in controller.admit("p", "m", 10):
+                if isinstance(item, Ticket):
+                    return item
+                positions.append(item)
+
+        task = asyncio.ensure_future(second())
+        await asyncio.sleep(0.01)
+        queued = controller.stats()["providers"]["p"]["queued"]
+        first.release(10)
+        ticket = await asyncio.wait_for(task, 1)
+        ticket.release(10)
+        return positions, queued
+
+    positions, queued = asyncio.run(scenario())
+    assert positions == [1] and queued == 1
+
+
+def test_full_queue_and_timeout_rejected():
+    async def scenario():
+        controller = _controller(queue_size=1, queue_timeout=0.05)
+        ticket = await controller.acquire("p", "m", 10)
+        waiting = asyncio.ensure_future(controller.acquire("p", "m", 10))
+        await asyncio.sleep(0.01)
+        with pytest.raises(AdmissionRejected):
+            controller.check("p")
+        with pytest.raises(AdmissionRejected):
+            await waiting
+        ticket.release(10)
+        return controller.stats()["providers"]["p"]
+
+    stats = asyncio.run(scenario())
+    assert stats["queued"] == 0 and stats["in_flight"] == 0
+
+
+def test_throttled_halves_model_concurrency():
+    async def scenario():
+        controller = _controller(concurrency=8)
+        ticket = await controller.acquire("p", "m", 10)
+        ticket.observe(429, {"retry-after": "2"})
+        model = controller.stats()["providers"]["p"]["models"]["m"]
+        ticket.release(0)
+        return model
+
+    model = asyncio.run(scenario())
+    assert model["concurrency"] == 4.0
+    assert model["paused_for"] == pytest.approx(2.0, abs=0.2)
+
+
+def test_learns_tpm_from_headers():
+    async def scenario():
+        controller = _controller(model_tpm={})
+        ticket = await controller.acquire("p", "m", 10)
+        ticket.observe(200, {"x-ratelimit-limit-tokens": "1000", "x-ratelimit-remaining-tokens": "400"})
+        ticket.release(10)
+        return controller.stats()["providers"]["p"]["models"]["m"]
+
+    model = asyncio.run(scenario())
+    assert model["tpm"] == 1000 and model["tokens_available"] <= 400
+
+
+class _Spy:
+    def __init__(self, monkeypatch):
+        self.released = []
+        release = Ticket.release
+
+        def spy(ticket, used=None):
+            self.released.append(used)
+            release(ticket, used)
+
+        monkeypatch.setattr(Ticket, "release", spy)
+
+
+def _stream_settlement(app_main, monkeypatch, chunks, cancel_after=None):
+    """用假的上游流跑一次 _stream_chat_chunks，返回 Ticket.release 收到的用量"""
+    spy = _Spy(monkeypatch)
+    monkeypatch.setattr(app_main, "admission_controller", _controller(concurrency=4))
+
+    async def upstream(adapter, request, pool=None, ticket=None):
+        for chunk in chunks:
+            yield chunk
+
+    monkeypatch.setattr(app_main, "call_provider_streaming_api", upstream)
+    request = app_main.ChatRequest(
+        provider="openai", model="m", max_tokens=64, messages=[{"role": "user", "content": "你好"}],
+        api_config={"api_key": "sk-test", "base_url": "https://api.openai.com/v1"},
+    )
+
+    async def scenario():
+        stream = app_main._stream_chat_chunks(request)
+        received = 0
+        async for _ in stream:
+            received += 1
+            if received == cancel_after:
+                break
+        await stream.aclose()
+
+    asyncio.run(scenario())
+    return spy.released
+
+
+def test_stream_settles_with_reported_usage(app_main, monkeypatch):
+    chunks = [{"type": "content", "content": "好"}, {"type": "usage", "usage": {"total_tokens": 42}}]
+    assert _stream_settlement(app_main, monkeypatch, chunks) == [42]
+
+
+def test_stream_without_usage_keeps_estimate(app_main, monkeypatch):
+    assert _stream_settlement(app_main, monkeypatch, [{"type": "content", "content": "好"}]) == [None]
+
+
+def test_stream_error_before_content_refunds(app_main, monkeypatch):
+    assert _stream_settlement(app_main, monkeypatch, [{"error": True, "message": "HTTP 500"}]) == [0]
+
+
+def test_stream_cancelled_before_content_refunds(app_main, monkeypatch):
+    chunks = [{"type": "queue", "position": 1}, {"type": "content", "content": "好"}]
+    assert _stream_settlement(app_main, monkeypatch, chunks, cancel_after=1) == [0]
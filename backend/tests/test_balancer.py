@@ -0,0 +1,138 @@
+"""services/balancer：端点选择、失败摘除、在途计数和配置校验"""
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services.balancer import (  # noqa: E402
+    Endpoint,
+    EndpointPool,
+    InvalidEndpoints,
+    LoadBalancer,
+    NoEndpointAvailable,
+    send_via,
+)
+
+
+def _pool(*weights, strategy="least_in_flight") -> EndpointPool:
+    endpoints = [Endpoint(f"https://e{i}.example/v1", f"sk-{i}", weight) for i, weight in enumerate(weights)]
+    return EndpointPool(endpoints, strategy, base_ejection=5.0, max_ejection=60.0)
+
+
+def test_least_in_flight_respects_weight():
+    pool = _pool(2.0, 1.0)
+    picked = [pool.acquire().base_url for _ in range(3)]
+    # 权重 2 的端点承担两倍的在途请求
+    assert sorted(picked) == ["https://e0.example/v1", "https://e0.example/v1", "https://e1.example/v1"]
+
+
+def test_ewma_prefers_faster_endpoint():
+    pool = _pool(1.0, 1.0, strategy="ewma")
+    slow, fast = pool.endpoints
+    pool.record(slow, 200, latency=0.5)
+    pool.record(fast, 200, latency=0.1)
+    assert pool.acquire() is fast
+
+
+@pytest.mark.parametrize("status", [None, 401, 403, 429, 500, 503])
+def test_failures_eject_endpoint(status):
+    pool = _pool(1.0, 1.0)
+    bad, good = pool.endpoints
+    pool.record(bad, status)
+    assert bad.consecutive_failures == 1
+    assert all(pool.acquire() is good for _ in range(5))
+
+
+@pytest.mark.parametrize("status", [200, 400, 404, 422])
+def test_other_statuses_count_as_success(status):
+    pool = _pool(1.0)
+    endpoint = pool.endpoints[0]
+    pool.record(endpoint, 500)
+    endpoint.ejected_until = 0.0
+    pool.record(endpoint, status)
+    assert (endpoint.consecutive_failures, endpoint.successes) == (0, 1)
+
+
+def test_ejection_grows_and_honours_retry_after():
+    pool = _pool(1.0)
+    endpoint = pool.endpoints[0]
+    pool.record(endpoint, 503)
+    with pytest.raises(NoEndpointAvailable) as first:
+        pool.acquire()
+    pool.record(endpoint, 503)
+    with pytest.raises(NoEndpointAvailable) as second:
+        pool.acquire()
+    assert first.value.retry_after == pytest.approx(5.0, abs=0.5)
+    assert second.value.retry_after == pytest.approx(10.0, abs=0.5)
+    pool.record(endpoint, 429, retry_after=30.0)
+    with pytest.raises(NoEndpointAvailable) as third:
+        pool.acquire()
+    assert third.value.retry_after == pytest.approx(30.0, abs=0.5)
+
+
+def test_send_via_releases_after_stream_closed():
+    async def body():
+        yield b"data: {}\n\n"
+
+    def handler(request):
+        return httpx.Response(200, content=body())
+
+    async def scenario():
+        pool = _pool(1.0)
+        endpoint = pool.endpoints[0]
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            async def send(target):
+                return await client.send(client.build_request("POST", target.base_url), stream=True)
+
+            response = await send_via(pool, send)
+            in_flight_while_open = endpoint.in_flight
+            await response.aread()
+            await response.aclose()
+            return in_flight_while_open, endpoint.in_flight, endpoint.successes
+
+    assert asyncio.run(scenario()) == (1, 0, 1)
+
+
+def test_send_via_records_connect_failure():
+    async def scenario():
+        pool = _pool(1.0)
+
+        async def send(target):
+            raise httpx.ConnectError("refused")
+
+        with pytest.raises(httpx.ConnectError):
+            await send_via(pool, send)
+        return pool.endpoints[0]
+
+    endpoint = asyncio.run(scenario())
+    assert endpoint.in_flight == 0 and endpoint.failures == 1
+
+
+def test_pool_for_caches_by_config():
+    balancer = LoadBalancer()
+    config = {"endpoints": [{"base_url": "https://e0.example/v1", "api_key": "sk-0", "weight": 2}]}
+    pool = balancer.pool_for("openai", config)
+    assert pool is not None and pool.endpoints[0].weight == 2.0
+    assert balancer.pool_for("openai", {"endpoints": [dict(config["endpoints"][0])]}) is pool
+    assert balancer.pool_for("openai", {}) is None
+
+
+@pytest.mark.parametrize("endpoints", [["https://e0.example/v1"], {"base_url": "x"}, [{"weight": "heavy"}]])
+def test_pool_for_rejects_invalid_endpoints(endpoints):
+    with pytest.raises(InvalidEndpoints):
+        LoadBalancer().pool_for("openai", {"endpoints": endpoints})
+
+
+@pytest.mark.parametrize("path", ["/api/chat", "/api/chat/stream"])
+def test_invalid_endpoints_return_400(client, path):
+    response = client.post(path, json={
+        "provider": "openai",
+        "messages": [{"role": "user", "content": "你好"}],
+        "api_config": {"api_key": "sk-test", "base_url": "https://api.openai.com/v1", "endpoints": ["x"]},
+    })
+    assert response.status_code == 400
+    assert "endpoints" in response.json()["detail"]
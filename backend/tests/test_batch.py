@@ -0,0 +1,98 @@
+"""/api/chat/batch：输入格式、并发参数校验、逐条结果、汇总和取消"""
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services.batch import BatchRun  # noqa: E402
+
+DEMO = {"demo": {"seed": 1, "no_sleep": True}}
+
+
+def _item(content, **extra):
+    return {"provider": "demo", "messages": [{"role": "user", "content": content}], "api_config": DEMO, **extra}
+
+
+def _lines(response):
+    return [json.loads(line) for line in response.text.splitlines() if line]
+
+
+def test_json_batch_results_and_summary(client):
+    response = client.post("/api/chat/batch", json={"requests": [_item("一"), {"messages": "bad"}, _item("三")],
+                                                    "concurrency": 2})
+    assert response.status_code == 200
+    lines = _lines(response)
+    assert lines[0]["type"] == "start" and lines[0]["concurrency"] == 2
+    results = sorted((line for line in lines if line["type"] == "result"), key=lambda line: line["index"])
+    assert [r["status"] for r in results] == ["ok", "error", "ok"]
+    assert results[1]["status_code"] == 422
+    assert "一" in results[0]["response"]["message"]["content"]
+    summary = lines[-1]
+    assert summary["type"] == "summary"
+    assert (summary["submitted"], summary["succeeded"], summary["failed"]) == (3, 2, 1)
+
+
+def test_jsonl_batch(client):
+    body = "\n".join(json.dumps(_item(str(i)), ensure_ascii=False) for i in range(3)) + "\n\n"
+    response = client.post("/api/chat/batch?concurrency=1", content=body.encode("utf-8"),
+                           headers={"Content-Type": "application/x-ndjson"})
+    lines = _lines(response)
+    assert lines[0]["concurrency"] == 1
+    assert sorted(line["index"] for line in lines if line["type"] == "result") == [0, 1, 2]
+    assert lines[-1]["succeeded"] == 3
+
+
+def test_array_body(client):
+    lines = _lines(client.post("/api/chat/batch", json=[_item("一")]))
+    assert lines[-1]["succeeded"] == 1
+
+
+@pytest.mark.parametrize("concurrency", ["abc", 0, -1, 1.5, True, [2]])
+def test_invalid_body_concurrency(client, concurrency):
+    response = client.post("/api/chat/batch", json={"requests": [_item("一")], "concurrency": concurrency})
+    assert response.status_code == 400
+
+
+def test_invalid_query_concurrency(client):
+    assert client.post("/api/chat/batch?concurrency=0", json=[_item("一")]).status_code == 422
+
+
+@pytest.mark.parametrize("body", [{"requests": "x"}, "text", 3])
+def test_invalid_body(client, body):
+    assert client.post("/api/chat/batch", json=body).status_code == 400
+
+
+def test_unknown_batch_cannot_be_cancelled(client):
+    assert client.delete("/api/chat/batch/missing").status_code == 404
+
+
+def test_cancel_run_reports_every_item():
+    async def items():
+        for index in range(5):
+            yield index, "demo"
+
+    async def slow(index, item):
+        await asyncio.sleep(10)
+        return {"type": "result", "index": index, "status": "ok"}
+
+    async def scenario():
+        run = BatchRun(concurrency=2, max_items=100)
+        lines = []
+
+        async def consume():
+            async for line in run.run(items(), lambda item: item, slow):
+                lines.append(line)
+
+        consumer = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.05)
+        run.cancel()
+        await asyncio.wait_for(consumer, 2)
+        return lines
+
+    lines = asyncio.run(scenario())
+    assert [line["status"] for line in lines[:-1]] == ["cancelled"] * 5
+    assert lines[-1]["cancelled"] is True and lines[-1]["cancelled_items"] == 5
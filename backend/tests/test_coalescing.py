@@ -0,0 +1,128 @@
+"""services/coalescing 和 singleflight：相同请求的在途合并"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services.coalescing import CoalescingPolicy, RequestCoalescer  # noqa: E402
+from services.singleflight import SingleFlight  # noqa: E402
+
+
+class _Request:
+    def __init__(self, provider="openai", temperature=0.0):
+        self.provider = provider
+        self.temperature = temperature
+
+
+@pytest.mark.parametrize("providers, allow, chat_request, expected", [
+    (frozenset(), False, _Request(), False),
+    (frozenset({"openai"}), False, _Request(), True),
+    (frozenset({"openai"}), False, _Request("anthropic"), False),
+    (frozenset({"*"}), False, _Request("custom"), True),
+    (frozenset({"openai"}), False, _Request(temperature=0.7), False),
+    (frozenset({"openai"}), True, _Request(temperature=0.7), True),
+])
+def test_policy(providers, allow, chat_request, expected):
+    assert CoalescingPolicy(providers, allow).enabled_for(chat_request) is expected
+
+
+def test_singleflight_shares_result_and_survives_cancel():
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "好"
+
+    async def scenario():
+        flights = SingleFlight()
+        first = asyncio.ensure_future(flights.do("k", fn))
+        second = asyncio.ensure_future(flights.do("k", fn))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        result = await second
+        return result, len(flights), first.cancelled()
+
+    assert asyncio.run(scenario()) == ("好", 0, True)
+    assert calls == [1]
+
+
+def test_run_counts_joined_requests():
+    async def fn():
+        await asyncio.sleep(0.01)
+        return 1
+
+    async def scenario():
+        coalescer = RequestCoalescer(CoalescingPolicy(frozenset({"*"})))
+        results = await asyncio.gather(*(coalescer.run("k", fn) for _ in range(3)))
+        return results, coalescer.stats()
+
+    results, stats = asyncio.run(scenario())
+    assert results == [1, 1, 1]
+    assert (stats["requests_started"], stats["requests_joined"], stats["in_flight_requests"]) == (1, 2, 0)
+
+
+def test_late_subscriber_replays_stream():
+    started = []
+
+    async def source():
+        started.append(1)
+        for index in range(3):
+            await asyncio.sleep(0.01)
+            yield {"type": "content", "content": str(index)}
+
+    async def collect(stream):
+        return [chunk["content"] async for chunk in stream]
+
+    async def scenario():
+        coalescer = RequestCoalescer(CoalescingPolicy(frozenset({"*"})))
+        first = asyncio.ensure_future(collect(coalescer.stream("k", source)))
+        await asyncio.sleep(0.025)
+        second = await collect(coalescer.stream("k", source))
+        first = await first
+        await asyncio.sleep(0)  # 让上游任务的完成回调先执行
+        return first, second, coalescer.stats()
+
+    first, second, stats = asyncio.run(scenario())
+    assert first == second == ["0", "1", "2"]
+    assert started == [1]
+    assert (stats["streams_joined"], stats["in_flight_streams"]) == (1, 0)
+
+
+def test_last_subscriber_leaving_cancels_upstream():
+    state = {"closed": False}
+
+    async def source():
+        try:
+            while True:
+                await asyncio.sleep(0.01)
+                yield {"type": "content", "content": "x"}
+        finally:
+            state["closed"] = True
+
+    async def scenario():
+        coalescer = RequestCoalescer(CoalescingPolicy(frozenset({"*"})))
+        stream = coalescer.stream("k", source)
+        await stream.__anext__()
+        await stream.aclose()
+        await asyncio.sleep(0.02)
+        return coalescer.stats()
+
+    stats = asyncio.run(scenario())
+    assert state["closed"] and stats["in_flight_streams"] == 0
+
+
+def test_upstream_error_becomes_error_chunk():
+    async def source():
+        yield {"type": "content", "content": "x"}
+        raise RuntimeError("boom")
+
+    async def scenario():
+        coalescer = RequestCoalescer(CoalescingPolicy(frozenset({"*"})))
+        return [chunk async for chunk in coalescer.stream("k", source)]
+
+    chunks = asyncio.run(scenario())
+    assert chunks[-1]["error"] is True and "boom" in chunks[-1]["message"]
@@ -0,0 +1,113 @@
+"""services/config_store 和 services/secret_box：密钥加密存储、无效主密钥"""
+import base64
+import json
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services.config_store import ConfigStore, ConfigStoreSettings  # noqa: E402
+from services.secret_box import SecretBox, SecretError  # noqa: E402
+
+CONFIG = {
+    "provider": "openai",
+    "api_key": "sk-primary",
+    "base_url": "https://api.openai.com/v1",
+    "model": "gpt-4o-mini",
+    "endpoints": [{"base_url": "https://backup.example/v1", "api_key": "sk-backup", "weight": 1.0}],
+}
+
+
+@pytest.fixture(autouse=True)
+def no_env_key(monkeypatch):
+    monkeypatch.delenv("CONFIG_SECRET_KEY", raising=False)
+
+
+def _settings(tmp_path) -> ConfigStoreSettings:
+    return ConfigStoreSettings(db_path=str(tmp_path / "config.sqlite3"), key_file=str(tmp_path / "config.key"))
+
+
+def test_secret_box_round_trip(tmp_path):
+    box = SecretBox.from_env(str(tmp_path / "config.key"))
+    token = box.encrypt("sk-密钥")
+    assert token.startswith("f1:") and "sk-" not in token
+    assert box.decrypt(token) == "sk-密钥"
+    assert box.encrypt("") == "" and box.decrypt("") == ""
+
+
+def test_secret_box_wrong_key(tmp_path):
+    token = SecretBox.from_env(str(tmp_path / "a.key")).encrypt("sk-test")
+    with pytest.raises(SecretError):
+        SecretBox.from_env(str(tmp_path / "b.key")).decrypt(token)
+    with pytest.raises(SecretError):
+        SecretBox.from_env(str(tmp_path / "a.key")).decrypt("h1:legacy")
+
+
+@pytest.mark.parametrize("value", ["notakey", base64.urlsafe_b64encode(b"x" * 16).decode()])
+def test_invalid_env_key(monkeypatch, tmp_path, value):
+    monkeypatch.setenv("CONFIG_SECRET_KEY", value)
+    with pytest.raises(SecretError):
+        SecretBox.from_env(str(tmp_path / "config.key"))
+
+
+def test_empty_key_file(tmp_path):
+    path = tmp_path / "config.key"
+    path.write_bytes(b"")
+    with pytest.raises(SecretError):
+        SecretBox.from_env(str(path))
+
+
+def test_keys_encrypted_at_rest(tmp_path):
+    store = ConfigStore(_settings(tmp_path))
+    store._save("openai", CONFIG)
+    store.close()
+
+    raw = sqlite3.connect(tmp_path / "config.sqlite3").execute("SELECT value FROM provider_configs").fetchone()[0]
+    assert "sk-primary" not in raw and "sk-backup" not in raw
+    assert json.loads(raw)["base_url"] == CONFIG["base_url"]
+
+    # 新的存储实例（相当于另一个工作进程）用同一个密钥文件解密
+    other = ConfigStore(_settings(tmp_path))
+    assert other.get("openai") == CONFIG
+    assert other.get("anthropic") is None
+    other.close()
+
+
+def test_undecryptable_key_treated_as_unset(tmp_path):
+    store = ConfigStore(_settings(tmp_path))
+    store._save("openai", CONFIG)
+    store.close()
+    os.remove(tmp_path / "config.key")
+
+    other = ConfigStore(_settings(tmp_path))
+    config = other.get("openai")
+    assert config is not None
+    assert config["api_key"] == "" and config["endpoints"][0]["api_key"] == ""
+    other.close()
+
+
+def test_invalid_master_key_disables_store(monkeypatch, tmp_path):
+    monkeypatch.setenv("CONFIG_SECRET_KEY", "notakey")
+    store = ConfigStore(_settings(tmp_path))
+    opened = []
+    connect = store._connect
+    monkeypatch.setattr(store, "_connect", lambda: opened.append(1) or connect())
+
+    assert store.get("openai") is None
+    assert store.error is not None and "CONFIG_SECRET_KEY" in store.error
+    # 打开失败后不再每次读取都重试
+    store._checked = float("-inf")
+    assert store.get("openai") is None
+    assert len(opened) == 1
+    # 保存时重新尝试打开，并报告原因
+    with pytest.raises(SecretError):
+        store._save("openai", CONFIG)
+
+    monkeypatch.setenv("CONFIG_SECRET_KEY", base64.urlsafe_b64encode(b"k" * 32).decode())
+    store._save("openai", CONFIG)
+    assert store.error is None
+    assert store.get("openai") == CONFIG
+    store.close()
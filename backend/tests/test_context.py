@@ -0,0 +1,107 @@
+"""services/context：token 估算、上下文窗口和按预算裁剪"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services.context import (  # noqa: E402
+    ApproximateTokenizer,
+    ContextAssembler,
+    ContextSettings,
+    assemble_context,
+)
+
+
+class _Message:
+    def __init__(self, role, content):
+        self.role = role
+        self.content = content
+
+    def __repr__(self):
+        return f"{self.role}:{self.content}"
+
+
+def _messages(spec: str):
+    """"s:aaaa u:bb a:cc" -> 消息列表，内容长度即 token 数"""
+    roles = {"s": "system", "u": "user", "a": "assistant"}
+    return [_Message(roles[item[0]], item[2:]) for item in spec.split()]
+
+
+def _tokenizer() -> ApproximateTokenizer:
+    # 每个字符一个 token，没有额外开销，方便算账
+    return ApproximateTokenizer("test", chars_per_token=1.0, tokens_per_message=0, reply_overhead=0)
+
+
+def test_count_text_mixed():
+    tokenizer = ApproximateTokenizer("test", chars_per_token=4.0)
+    assert tokenizer.count_text("你好") == 2
+    assert tokenizer.count_text("hello world!") == 3
+    assert tokenizer.count_text("你好 hello") == 4
+    assert tokenizer.count_text("") == 0
+
+
+def test_count_message_cached():
+    tokenizer = ApproximateTokenizer("test", tokens_per_message=4)
+    assert tokenizer.count_message("user", "你好") == 6
+    assert tokenizer.count_message("assistant", "你好") == 6
+    assert (tokenizer.hits, tokenizer.misses) == (1, 1)
+
+
+def test_everything_fits():
+    messages = _messages("s:sys u:aa a:bb u:cc")
+    kept, tokens, dropped, dropped_tokens = assemble_context(messages, 100, _tokenizer())
+    assert kept == messages and tokens == 9 and (dropped, dropped_tokens) == (0, 0)
+
+
+def test_keeps_system_and_longest_suffix():
+    messages = _messages("s:sys u:aaaa a:bbbb u:cc a:dd u:ee")
+    kept, tokens, dropped, dropped_tokens = assemble_context(messages, 9, _tokenizer())
+    assert [m.content for m in kept] == ["sys", "cc", "dd", "ee"]
+    assert (tokens, dropped, dropped_tokens) == (9, 2, 8)
+
+
+def test_trimmed_history_starts_with_user():
+    messages = _messages("u:aaaa a:bb u:cc")
+    kept, tokens, dropped, _ = assemble_context(messages, 4, _tokenizer())
+    # 后缀 [a:bb, u:cc] 放得下，但开头的助手消息要一并丢弃
+    assert [m.role for m in kept] == ["user"] and kept[0].content == "cc"
+    assert (tokens, dropped) == (2, 2)
+
+
+def test_latest_message_always_kept():
+    messages = _messages("s:sys u:aa u:oversized")
+    kept, tokens, dropped, _ = assemble_context(messages, 5, _tokenizer())
+    assert [m.content for m in kept] == ["sys", "oversized"]
+    assert tokens == 12 and dropped == 1
+
+
+def test_window_for_longest_prefix(monkeypatch):
+    monkeypatch.setenv("MODEL_CONTEXT_WINDOWS", "gpt-4o-mini=1000, my-model=2000")
+    settings = ContextSettings.from_env()
+    assert settings.window_for("gpt-4o-mini-2024") == 1000
+    assert settings.window_for("gpt-4o") == 128000
+    assert settings.window_for("gpt-4-0613") == 8192
+    assert settings.window_for("my-model") == 2000
+    assert settings.window_for("unknown") == settings.default_window
+
+
+@pytest.mark.parametrize("max_tokens, dropped", [(100, 0), (8150, 2)])
+def test_assembler_reserves_max_tokens(max_tokens, dropped):
+    assembler = ContextAssembler(ContextSettings(default_window=8192))
+    messages = _messages("u:" + "x" * 120 + " a:" + "y" * 120 + " u:zz")
+    kept, report = assembler.fit(messages, "openai", "unknown", max_tokens)
+    assert report.budget == 8192 - max_tokens
+    assert report.dropped_messages == dropped and report.kept_messages == len(kept)
+
+
+def test_chat_reports_context(client):
+    history = [{"role": "user" if i % 2 == 0 else "assistant", "content": "历史" * 50} for i in range(6)]
+    body = {"provider": "demo", "context_window": 400, "max_tokens": 100,
+            "messages": history + [{"role": "user", "content": "最新的问题"}],
+            "api_config": {"demo": {"no_sleep": True}}}
+    context = client.post("/api/chat", json=body).json()["context"]
+    assert (context["window"], context["budget"]) == (400, 300)
+    assert context["dropped_messages"] > 0 and context["tokens"] <= 300
+    assert context["kept_messages"] + context["dropped_messages"] == 7
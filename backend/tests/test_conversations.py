@@ -0,0 +1,89 @@
+"""服务端会话：只发送新的一轮、保存本轮消息、分页和删除"""
+import time
+
+import pytest
+
+DEMO = {"demo": {"seed": 1, "no_sleep": True}}
+FAILING_DEMO = {"demo": {"seed": 1, "no_sleep": True, "failure_rate": 1}}
+
+
+def _chat(client, conversation_id, content, stream=True, api_config=DEMO):
+    body = {
+        "provider": "demo",
+        "conversation_id": conversation_id,
+        "messages": [{"role": "user", "content": content}],
+        "api_config": api_config,
+    }
+    if stream:
+        return client.post("/api/chat/stream", json=body)
+    return client.post("/api/chat", json=body)
+
+
+def _roles(client, conversation_id, expected_count=None):
+    # 失败和取消的轮次在后台写入，等它落库
+    deadline = time.monotonic() + 2
+    while True:
+        messages = client.get(f"/api/conversations/{conversation_id}").json()["messages"]
+        if expected_count is None or len(messages) >= expected_count or time.monotonic() > deadline:
+            return [(message["role"], message["content"]) for message in messages]
+        time.sleep(0.02)
+
+
+@pytest.fixture
+def conversation_id(client):
+    return client.post("/api/conversations", json={}).json()["id"]
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_completed_turn_saved(client, conversation_id, stream):
+    assert _chat(client, conversation_id, "第一个问题", stream).status_code == 200
+    assert _chat(client, conversation_id, "第二个问题", stream).status_code == 200
+
+    roles = _roles(client, conversation_id)
+    assert [role for role, _ in roles] == ["user", "assistant", "user", "assistant"]
+    assert roles[0][1] == "第一个问题" and "第一个问题" in roles[1][1]
+    conversation = client.get(f"/api/conversations/{conversation_id}").json()
+    assert conversation["title"] == "第一个问题"
+    assert conversation["message_count"] == 4
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_failed_turn_keeps_user_message(client, conversation_id, stream):
+    response = _chat(client, conversation_id, "会失败的问题", stream, FAILING_DEMO)
+    if stream:
+        assert "演示模式注入的失败" in response.text
+    else:
+        assert response.status_code == 503
+    assert _roles(client, conversation_id, 1) == [("user", "会失败的问题")]
+
+    # 下一轮的上下文里有上一条用户消息，和客户端显示的一致
+    assert _chat(client, conversation_id, "再问一次", stream).status_code == 200
+    assert [role for role, _ in _roles(client, conversation_id, 3)] == ["user", "user", "assistant"]
+
+
+def test_missing_conversation(client):
+    assert _chat(client, "missing", "你好").status_code == 404
+    assert _chat(client, "missing", "你好", stream=False).status_code == 404
+
+
+def test_list_paginates_and_delete(client):
+    ids = [client.post("/api/conversations", json={"title": f"会话{i}"}).json()["id"] for i in range(3)]
+    page = client.get("/api/conversations", params={"limit": 2}).json()
+    assert page["total"] == 3 and len(page["data"]) == 2
+    assert client.get("/api/conversations", params={"limit": 2, "offset": 2}).json()["data"][0]["id"] in ids
+
+    assert client.delete(f"/api/conversations/{ids[0]}").status_code == 200
+    assert client.delete(f"/api/conversations/{ids[0]}").status_code == 404
+    assert client.get(f"/api/conversations/{ids[0]}").status_code == 404
+
+
+def test_message_pages(client, conversation_id):
+    for i in range(3):
+        _chat(client, conversation_id, f"问题{i}")
+    latest = client.get(f"/api/conversations/{conversation_id}", params={"limit": 4}).json()
+    assert latest["has_more"] is True
+    assert [m["content"] for m in latest["messages"] if m["role"] == "user"] == ["问题1", "问题2"]
+    earlier = client.get(f"/api/conversations/{conversation_id}",
+                         params={"limit": 4, "before": latest["messages"][0]["id"]}).json()
+    assert earlier["has_more"] is False
+    assert [m["content"] for m in earlier["messages"]][0] == "问题0"
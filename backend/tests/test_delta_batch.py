@@ -0,0 +1,89 @@
+"""services/delta_batch：相邻 content 增量的合并、顺序和窗口到期"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services.delta_batch import DeltaBatchSettings, batch_deltas  # noqa: E402
+
+SETTINGS = DeltaBatchSettings(window=0.05, max_bytes=512)
+
+
+def _content(text):
+    return {"type": "content", "content": text}
+
+
+async def _source(events, gaps=None, state=None):
+    try:
+        for index, event in enumerate(events):
+            if gaps and gaps[index]:
+                await asyncio.sleep(gaps[index])
+            yield event
+    finally:
+        if state is not None:
+            state["closed"] = True
+
+
+def _batch(events, gaps=None, settings=SETTINGS):
+    async def scenario():
+        return [chunk async for chunk in batch_deltas(_source(events, gaps), settings, "test")]
+
+    return asyncio.run(asyncio.wait_for(scenario(), 5))
+
+
+def test_burst_first_token_immediate_rest_merged():
+    out = _batch([_content(c) for c in "你好世界"])
+    assert out == [_content("你"), _content("好世界")]
+
+
+def test_slow_stream_passes_through():
+    out = _batch([_content(c) for c in "abc"], gaps=[0, 0.08, 0.08])
+    assert out == [_content("a"), _content("b"), _content("c")]
+
+
+def test_other_events_flush_in_order():
+    usage = {"type": "usage", "usage": {"total_tokens": 3}}
+    error = {"error": True, "message": "HTTP 500"}
+    out = _batch([_content("a"), _content("b"), _content("c"), usage, _content("d"), error])
+    assert out == [_content("a"), _content("bc"), usage, _content("d"), error]
+
+
+def test_max_bytes_flushes_early():
+    out = _batch([_content("x" * 4) for _ in range(4)], settings=DeltaBatchSettings(window=10, max_bytes=8))
+    assert out == [_content("xxxx"), _content("x" * 8), _content("xxxx")]
+
+
+def test_window_expiry_flushes_before_stall():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        timeline = []
+        events = [_content("a"), _content("b"), _content("c")]
+        async for chunk in batch_deltas(_source(events, gaps=[0, 0, 0.3]), SETTINGS, "test"):
+            timeline.append((chunk["content"], loop.time() - started))
+        return timeline
+
+    timeline = asyncio.run(asyncio.wait_for(scenario(), 5))
+    assert [content for content, _ in timeline] == ["a", "b", "c"]
+    # 上游停顿时，攒着的 b 在窗口到期时发出，不等下一个事件
+    assert timeline[1][1] < 0.2
+
+
+def test_disabled_window_is_not_enabled():
+    assert not DeltaBatchSettings(window=0).enabled
+
+
+def test_closing_consumer_closes_source():
+    state = {"closed": False}
+
+    async def scenario():
+        events = [_content("a"), _content("b"), _content("c")]
+        stream = batch_deltas(_source(events, gaps=[0, 0, 1.0], state=state), SETTINGS, "test")
+        await stream.__anext__()
+        await stream.__anext__()
+        await stream.aclose()
+        await asyncio.sleep(0.01)
+
+    asyncio.run(asyncio.wait_for(scenario(), 5))
+    assert state["closed"]
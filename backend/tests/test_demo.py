@@ -0,0 +1,77 @@
+"""演示模式：参数校验、可复现的回复、失败注入和非流式等待"""
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services import demo  # noqa: E402
+from services.demo import DemoFailure, DemoOptions, DemoReply  # noqa: E402
+
+
+def _body(content, **options):
+    return {"provider": "demo", "messages": [{"role": "user", "content": content}],
+            "api_config": {"demo": {"no_sleep": True, **options}}}
+
+
+def _events(response):
+    return [json.loads(line[6:]) for line in response.text.splitlines() if line.startswith("data: {")]
+
+
+def test_unknown_option_rejected(client):
+    response = client.post("/api/chat", json=_body("你好", zero_sleep=True))
+    assert response.status_code == 422
+    assert "zero_sleep" in response.json()["detail"]
+
+
+def test_unknown_option_reported_in_stream(client):
+    response = client.post("/api/chat/stream", json=_body("你好", zero_sleep=True))
+    errors = [event for event in _events(response) if event.get("error")]
+    assert errors and "zero_sleep" in errors[0]["message"]
+
+
+def test_same_seed_same_reply():
+    options = DemoOptions(seed=7, tokens=50, no_sleep=True)
+    first = asyncio.run(DemoReply(options, "你好", stream=False).complete())
+    second = asyncio.run(DemoReply(options, "你好", stream=False).complete())
+    assert first == second
+    assert first[1]["completion_tokens"] == 50
+
+
+def test_chunk_size_groups_tokens():
+    async def scenario():
+        reply = DemoReply(DemoOptions(seed=1, tokens=10, chunk_size=4, no_sleep=True), "你好", stream=True)
+        return [event async for event in reply.stream()]
+
+    events = asyncio.run(scenario())
+    contents = [event for event in events if event.get("type") == "content"]
+    assert len(contents) == 3
+    assert events[-1] == {"type": "usage", "usage": {"prompt_tokens": 2, "completion_tokens": 10,
+                                                     "total_tokens": 12}}
+
+
+def test_injected_failure(client):
+    assert client.post("/api/chat", json=_body("失败", seed=1, failure_rate=1)).status_code == 503
+    events = _events(client.post("/api/chat/stream", json=_body("失败", seed=1, failure_rate=1)))
+    assert any(event.get("error") for event in events)
+    with pytest.raises(DemoFailure):
+        asyncio.run(DemoReply(DemoOptions(failure_rate=1), "你好", stream=False).complete())
+
+
+@pytest.mark.parametrize("options, expected", [
+    ({}, 1.0),                              # 预置回复：约 1 秒
+    ({"ttft": 0.5}, 1.5),
+    ({"tokens": 60, "jitter": 0}, 2.0),     # 指定 tokens：按 rate 计算
+])
+def test_complete_delay(monkeypatch, options, expected):
+    slept = []
+
+    async def sleep(seconds):
+        slept.append(seconds)
+
+    monkeypatch.setattr(demo.asyncio, "sleep", sleep)
+    asyncio.run(DemoReply(DemoOptions(**options), "你好", stream=False).complete())
+    assert slept == [pytest.approx(expected)]
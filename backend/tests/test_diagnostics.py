@@ -0,0 +1,106 @@
+"""services/diagnostics：地址交错、happy eyeballs 竞速和分阶段报告"""
+import asyncio
+import os
+import socket
+import sys
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services.diagnostics import ConnectionDiagnostics, _interleave, happy_eyeballs  # noqa: E402
+
+V4, V6 = socket.AF_INET, socket.AF_INET6
+
+
+def _info(family, address, port=80):
+    return (family, socket.SOCK_STREAM, 6, "", (address, port))
+
+
+@pytest.fixture
+def listener():
+    """本地监听端口（只 listen，不需要 accept）"""
+    sock = socket.socket(V4, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(8)
+    yield sock.getsockname()[1]
+    sock.close()
+
+
+@pytest.fixture
+def closed_port():
+    sock = socket.socket(V4, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_interleave_families():
+    infos = [_info(V6, "::1"), _info(V6, "::2"), _info(V4, "1.1.1.1"), _info(V4, "1.1.1.2"), _info(V6, "::3")]
+    assert [info[4][0] for info in _interleave(infos)] == ["::1", "1.1.1.1", "::2", "1.1.1.2", "::3"]
+
+
+def test_happy_eyeballs_skips_refused_address(listener, closed_port):
+    async def scenario():
+        infos = [_info(V4, "127.0.0.1", closed_port), _info(V4, "127.0.0.1", listener)]
+        sock, sockaddr, attempts = await happy_eyeballs(infos, delay=1.0)
+        sock.close()
+        return sockaddr, attempts
+
+    sockaddr, attempts = asyncio.run(asyncio.wait_for(scenario(), 5))
+    assert sockaddr[1] == listener
+    assert "error" in attempts[0] and "error" not in attempts[-1]
+
+
+def test_happy_eyeballs_all_refused(closed_port):
+    with pytest.raises(ConnectionError):
+        asyncio.run(happy_eyeballs([_info(V4, "127.0.0.1", closed_port)]))
+
+
+class _Adapter:
+    label = "测试"
+    headers: dict = {}
+    follow_redirects = False
+
+    def __init__(self, port):
+        self.chat_url = f"http://127.0.0.1:{port}/v1/chat/completions"
+        self.models_url = f"http://127.0.0.1:{port}/v1/models"
+
+    @staticmethod
+    def parse_error(response):
+        return f"HTTP {response.status_code}"
+
+
+def _run(port, models_status=200, complete_error=None):
+    def handler(request):
+        return httpx.Response(models_status, json={"data": []})
+
+    async def complete():
+        if complete_error:
+            raise complete_error
+        return "你好"
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await ConnectionDiagnostics(stage_timeout=2).run(_Adapter(port), client, complete)
+
+    report = asyncio.run(scenario())
+    return report, {stage["name"]: stage for stage in report["stages"]}
+
+
+def test_report_success(listener):
+    report, stages = _run(listener)
+    assert report["status"] == "success" and report["response"] == "你好"
+    assert [stages[name]["status"] for name in ("dns", "tcp", "tls", "ttfb", "completion")] == [
+        "ok", "ok", "skipped", "ok", "ok"]
+    assert stages["tcp"]["detail"]["port"] == listener
+    assert stages["ttfb"]["detail"]["status_code"] == 200
+
+
+def test_report_names_first_failed_stage(closed_port):
+    report, stages = _run(closed_port, models_status=401, complete_error=RuntimeError("拒绝"))
+    assert report["status"] == "failed"
+    assert report["message"].startswith("TCP连接失败")
+    assert stages["ttfb"]["error"] == "HTTP 401" and stages["completion"]["error"] == "拒绝"
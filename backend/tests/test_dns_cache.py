@@ -0,0 +1,114 @@
+"""services/dns_cache 和 HTTP/2 开关：解析缓存、逐个地址连接和失效"""
+import asyncio
+import os
+import sys
+
+import httpcore
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services import http_clients  # noqa: E402
+from services.dns_cache import CachingNetworkBackend, DNSCache  # noqa: E402
+from services.http_clients import HTTPClientRegistry, PoolSettings  # noqa: E402
+
+HOST = ("api.example", 443)
+
+
+def _cache(*addresses, ttl=300.0) -> DNSCache:
+    cache = DNSCache(ttl)
+    lookups = []
+
+    async def lookup(host, port):
+        lookups.append(host)
+        await asyncio.sleep(0.01)
+        cache._entries[(host, port)] = (float("inf"), list(addresses))
+        return list(addresses)
+
+    cache._lookup = lookup  # type: ignore[method-assign]
+    cache.lookups = lookups  # type: ignore[attr-defined]
+    return cache
+
+
+class _Backend(httpcore.AsyncNetworkBackend):
+    """记录连接尝试，refused 中的地址连接失败"""
+
+    def __init__(self, refused=()):
+        self.refused = set(refused)
+        self.attempts = []
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        self.attempts.append((host, timeout))
+        if host in self.refused:
+            raise httpcore.ConnectError(f"{host} refused")
+        return host
+
+
+def test_concurrent_resolves_share_lookup():
+    async def scenario():
+        cache = _cache("10.0.0.1")
+        results = await asyncio.gather(*(cache.resolve(*HOST) for _ in range(3)))
+        again = await cache.resolve(*HOST)
+        return cache, results, again
+
+    cache, results, again = asyncio.run(scenario())
+    assert results == [["10.0.0.1"]] * 3 and again == ["10.0.0.1"]
+    assert cache.lookups == ["api.example"]
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_resolves_localhost():
+    cache = DNSCache(300.0)
+    assert asyncio.run(cache.resolve("localhost", 80))
+    assert cache.stats()["entries"] == 1
+
+
+def test_falls_through_to_next_address():
+    cache = _cache("10.0.0.1", "10.0.0.2")
+    backend = _Backend(refused={"10.0.0.1"})
+    stream = asyncio.run(CachingNetworkBackend(cache, backend).connect_tcp(*HOST, timeout=1.0))
+    assert stream == "10.0.0.2"
+    # 两个地址平分超时，第一个不通不会用掉全部时间
+    assert backend.attempts[0][1] == pytest.approx(0.5, abs=0.05)
+
+
+def test_all_addresses_failing_invalidates_entry():
+    async def scenario():
+        cache = _cache("10.0.0.1", "10.0.0.2")
+        backend = CachingNetworkBackend(cache, _Backend(refused={"10.0.0.1", "10.0.0.2"}))
+        with pytest.raises(httpcore.ConnectError):
+            await backend.connect_tcp(*HOST)
+        return cache
+
+    assert asyncio.run(scenario()).stats()["entries"] == 0
+
+
+def test_ip_literal_skips_cache():
+    cache = _cache("10.0.0.1")
+    backend = _Backend()
+    assert asyncio.run(CachingNetworkBackend(cache, backend).connect_tcp("192.0.2.1", 443)) == "192.0.2.1"
+    assert cache.lookups == []
+
+
+def test_registry_installs_dns_cache():
+    registry = HTTPClientRegistry(PoolSettings(dns_ttl=60))
+    client = registry.get_client("openai", "https://api.openai.com/v1")
+    assert isinstance(client._transport._pool._network_backend, CachingNetworkBackend)
+    assert registry.stats()["dns"]["ttl"] == 60
+    asyncio.run(registry.aclose())
+
+
+def test_http2_opt_in_per_provider(monkeypatch):
+    registry = HTTPClientRegistry(PoolSettings(dns_ttl=0, http2_providers=frozenset({"openai"})))
+    registry.get_client("openai", "https://api.openai.com/v1")
+    registry.get_client("anthropic", "https://api.anthropic.com/v1")
+    monkeypatch.setattr(http_clients, "HTTP2_AVAILABLE", False)
+    registry.get_client("openai", "https://proxy.example/v1")
+    pools = {(pool["provider"], pool["origin"]): pool["http2"] for pool in registry.stats()["pools"]}
+    assert pools == {
+        ("openai", "https://api.openai.com"): http_clients.importlib.util.find_spec("h2") is not None,
+        ("anthropic", "https://api.anthropic.com"): False,
+        ("openai", "https://proxy.example"): False,  # 没有 h2 时回退到 HTTP/1.1
+    }
+    assert PoolSettings(http2_providers=frozenset({"*"})).http2_for("custom")
+    asyncio.run(registry.aclose())
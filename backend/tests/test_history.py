@@ -0,0 +1,59 @@
+"""services/history 的分词和检索：中英混合的关键词"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services.history import HistoryIndex, HistorySettings, index_text, match_query  # noqa: E402
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("流式output", '"流式 式 output"'),
+    ("output已开启", '"output 已开 开启"'),
+    ("sqlite索引", '"sqlite 索引"'),
+    ("a流b", '"a 流 b"'),
+    ("流式output已", '"流式 式 output 已" *'),
+    ("流式", '"流式"'),
+    ("的", '"的" *'),
+])
+def test_match_query(query, expected):
+    assert match_query(query) == expected
+
+
+def test_index_text_mixed():
+    assert index_text("流式output已开启").split() == ["流式", "式", "output", "已开", "开启", "启"]
+
+
+@pytest.fixture
+def index(tmp_path):
+    history = HistoryIndex(HistorySettings(db_path=str(tmp_path / "history.sqlite3")))
+    history._write([
+        (1000.0, None, "openai", "gpt-4o-mini", "怎么打开流式输出", "流式output已开启，sqlite索引也建好了"),
+        (1001.0, None, "anthropic", "claude", "input 设置", "流式input已关闭"),
+    ])
+    yield history
+    asyncio.run(history.aclose())
+
+
+def _prompts(index, query):
+    page = asyncio.run(index.search(query, sort="recent"))
+    return [hit["prompt"] for hit in page["results"]]
+
+
+@pytest.mark.parametrize("query", ["流式output", "式output", "output已开", "流式output已开启", "sqlite索引"])
+def test_search_mixed_terms_match_substring(index, query):
+    assert _prompts(index, query) == ["怎么打开流式输出"]
+
+
+def test_search_mixed_terms_relevance(index):
+    page = asyncio.run(index.search("流式output", sort="relevance"))
+    assert [hit["prompt"] for hit in page["results"]] == ["怎么打开流式输出"]
+    assert "<mark>流式output</mark>" in page["results"][0]["snippet"]
+
+
+@pytest.mark.parametrize("query", ["流式outputs", "流式input已开", "式输output"])
+def test_search_mixed_terms_no_false_match(index, query):
+    assert _prompts(index, query) == []
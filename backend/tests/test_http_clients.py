@@ -0,0 +1,60 @@
+"""services/http_clients：共享客户端的复用、区分和关闭"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services.http_clients import HTTPClientRegistry, PoolSettings  # noqa: E402
+
+
+def _registry(**overrides) -> HTTPClientRegistry:
+    return HTTPClientRegistry(PoolSettings(**{"dns_ttl": 0, **overrides}))
+
+
+def test_same_origin_shares_client():
+    registry = _registry()
+    first = registry.get_client("openai", "https://api.openai.com/v1/chat/completions")
+    second = registry.get_client("openai", "https://API.openai.com/v1/models")
+    assert first is second
+    assert registry.stats()["pools"][0]["requests"] == 2
+    asyncio.run(registry.aclose())
+
+
+def test_provider_origin_and_verify_separate_clients():
+    registry = _registry()
+    base = registry.get_client("openai", "https://api.openai.com/v1")
+    others = [
+        registry.get_client("custom", "https://api.openai.com/v1"),
+        registry.get_client("openai", "https://proxy.example/v1"),
+        registry.get_client("openai", "https://api.openai.com/v1", verify=False),
+    ]
+    assert all(client is not base for client in others)
+    assert len(registry.stats()["pools"]) == 4
+    asyncio.run(registry.aclose())
+
+
+def test_pool_settings_applied():
+    registry = _registry(max_connections=7, read_timeout=5.0)
+    client = registry.get_client("openai", "https://api.openai.com/v1")
+    assert client.timeout.read == 5.0
+    assert registry.stats()["limits"]["max_connections"] == 7
+    asyncio.run(registry.aclose())
+
+
+def test_aclose_closes_and_recreates():
+    registry = _registry()
+    client = registry.get_client("openai", "https://api.openai.com/v1")
+    asyncio.run(registry.aclose())
+    assert client.is_closed and registry.stats()["pools"] == []
+    fresh = registry.get_client("openai", "https://api.openai.com/v1")
+    assert fresh is not client and not fresh.is_closed
+    asyncio.run(registry.aclose())
+
+
+def test_settings_from_env(monkeypatch):
+    monkeypatch.setenv("UPSTREAM_MAX_KEEPALIVE", "5")
+    monkeypatch.setenv("UPSTREAM_READ_TIMEOUT", "60")
+    settings = PoolSettings.from_env()
+    assert settings.max_keepalive_connections == 5
+    assert settings.timeout().read == 60.0
@@ -0,0 +1,81 @@
+"""services/log：脱敏、JSON 格式、级别解析和队列写出"""
+import json
+import logging
+import os
+import queue
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services.log import (  # noqa: E402
+    DeferredQueueHandler,
+    JSONFormatter,
+    parse_levels,
+    redact,
+    setup_logging,
+    shutdown_logging,
+)
+
+
+@pytest.mark.parametrize("text, leaked", [
+    ("Authorization: Bearer abc.def-123", "abc.def-123"),
+    ("key sk-proj1234567890abcdef", "1234567890abcdef"),
+    ("key sk-ant-api03abcdefghij", "api03abcdefghij"),
+    ('{"api_key": "secret-value"}', "secret-value"),
+    ("x-api-key=secret-value", "secret-value"),
+])
+def test_redact(text, leaked):
+    redacted = redact(text)
+    assert leaked not in redacted and "***" in redacted
+
+
+def test_redact_keeps_plain_text():
+    assert redact("模型列表获取成功: 12 个") == "模型列表获取成功: 12 个"
+
+
+def test_parse_levels():
+    assert parse_levels("httpx=warning, services.http_clients=DEBUG,bad") == {
+        "httpx": "WARNING", "services.http_clients": "DEBUG"}
+
+
+def test_json_formatter_includes_extra_and_redacts():
+    record = logging.LogRecord("main", logging.INFO, __file__, 1, "连接测试 %s", ("sk-abcdefghijklmn",), None)
+    record.provider = "openai"
+    entry = json.loads(JSONFormatter().format(record))
+    assert entry["level"] == "INFO" and entry["provider"] == "openai"
+    assert entry["message"].startswith("连接测试 sk-ab***")
+
+
+def test_queue_handler_defers_formatting_and_drops_when_full():
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(1)
+    handler = DeferredQueueHandler(log_queue)
+    for _ in range(2):
+        handler.handle(logging.LogRecord("main", logging.INFO, __file__, 1, "%s", ("延迟",), None))
+    record = log_queue.get_nowait()
+    assert record.args == ("延迟",) and not hasattr(record, "message")
+    assert log_queue.empty()
+
+
+@pytest.fixture
+def restore_root_logger():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield
+    shutdown_logging()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+    logging.getLogger("tests.quiet").setLevel(logging.NOTSET)
+
+
+def test_setup_logging_writes_json(restore_root_logger, capsys):
+    setup_logging(level="INFO", fmt="json", levels="tests.quiet=ERROR")
+    logging.getLogger("tests.loud").info("已启动", extra={"port": 8000})
+    logging.getLogger("tests.quiet").warning("不应输出")
+    shutdown_logging()
+    lines = [json.loads(line) for line in capsys.readouterr().err.splitlines()]
+    assert [(line["logger"], line["message"], line["port"]) for line in lines] == [("tests.loud", "已启动", 8000)]
@@ -0,0 +1,68 @@
+"""services/metrics：Prometheus 文本格式、直方图分桶和流式观测"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services import metrics  # noqa: E402
+from services.metrics import Counter, Gauge, Histogram, MetricsRegistry, StreamObserver  # noqa: E402
+
+
+def test_counter_and_gauge_render():
+    counter = Counter("requests_total", "请求数", ("provider",))
+    counter.inc("openai")
+    counter.inc("openai", amount=2)
+    counter.inc('a"b\n')
+    gauge = Gauge("in_flight", "在途")
+    gauge.inc()
+    gauge.dec()
+    assert counter.render() == [
+        "# HELP requests_total 请求数",
+        "# TYPE requests_total counter",
+        'requests_total{provider="openai"} 3',
+        'requests_total{provider="a\\"b\\n"} 1',
+    ]
+    assert gauge.render()[-1] == "in_flight 0"
+
+
+def test_histogram_cumulative_buckets():
+    histogram = Histogram("latency_seconds", "延迟", ("provider",), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, "openai")
+    assert histogram.render()[2:] == [
+        'latency_seconds_bucket{provider="openai",le="0.1"} 2',
+        'latency_seconds_bucket{provider="openai",le="1"} 3',
+        'latency_seconds_bucket{provider="openai",le="+Inf"} 4',
+        'latency_seconds_sum{provider="openai"} 3.65',
+        'latency_seconds_count{provider="openai"} 4',
+    ]
+
+
+def test_registry_runs_collectors_before_render():
+    registry = MetricsRegistry()
+    gauge = registry.register(Gauge("pool", "连接"))
+    registry.add_collector(lambda: gauge.set(value=7))
+    assert registry.render().endswith("pool 7\n")
+
+
+def test_stream_observer_records_ttft_and_cancellation():
+    labels = ("test-provider", "test-model")
+    observer = StreamObserver(*labels)
+    assert metrics.streams_in_flight.values[labels[:1]] == 1
+    for _ in range(3):
+        observer.on_chunk({"type": "content", "content": "x"})
+    observer.finish("cancelled")
+    assert metrics.streams_in_flight.values[labels[:1]] == 0
+    assert sum(metrics.time_to_first_token.values[labels][:-1]) == 1
+    assert sum(metrics.inter_token_gap.values[labels][:-1]) == 2
+    assert metrics.chat_requests.values[labels + ("stream", "cancelled")] == 1
+    assert metrics.stream_cancellations.values[labels + ("generating",)] == 1
+
+
+def test_metrics_endpoint(client):
+    client.post("/api/chat", json={"provider": "demo", "messages": [{"role": "user", "content": "指标"}],
+                                   "api_config": {"demo": {"no_sleep": True}}})
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "# TYPE chat_generation_seconds histogram" in response.text
+    assert 'outcome="success"' in response.text
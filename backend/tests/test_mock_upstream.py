@@ -0,0 +1,72 @@
+"""benchmarks/mock_upstream：后端经由各提供商适配器对接本地模拟上游"""
+import asyncio
+import json
+import os
+import sys
+
+import httpx
+import pytest
+import uvicorn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+
+from mock_upstream import MockSettings, MockUpstream  # noqa: E402
+
+TOKENS = 12
+
+
+async def _serve(app):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning", lifespan="off"))
+    task = asyncio.ensure_future(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, task, f"http://127.0.0.1:{port}"
+
+
+def _run(app_main, provider, path, upstream_path, settings=None):
+    upstream = MockUpstream(settings or MockSettings(tokens=TOKENS, chunk_size=3))
+
+    async def scenario():
+        server, task, url = await _serve(upstream.app)
+        try:
+            async with app_main.app.router.lifespan_context(app_main.app):
+                transport = httpx.ASGITransport(app=app_main.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://backend", timeout=10) as client:
+                    api_key = "sk-ant-mock" if provider == "anthropic" else "sk-mock"
+                    body = {"provider": provider, "messages": [{"role": "user", "content": "你好"}],
+                            "api_config": {"api_key": api_key, "base_url": url + upstream_path, "model": "mock"}}
+                    return await client.post(path, json=body)
+        finally:
+            server.should_exit = True
+            await task
+
+    return asyncio.run(scenario()), upstream.stats
+
+
+def _events(response):
+    return [json.loads(line[6:]) for line in response.text.splitlines() if line.startswith("data: {")]
+
+
+@pytest.mark.parametrize("provider, upstream_path", [("openai", "/v1"), ("anthropic", ""), ("custom", "/v1")])
+def test_stream_through_mock(app_main, provider, upstream_path):
+    response, stats = _run(app_main, provider, "/api/chat/stream", upstream_path)
+    events = _events(response)
+    assert not [event for event in events if event.get("error")]
+    assert "".join(event["content"] for event in events if event.get("type") == "content")
+    assert (stats["streams"], stats["tokens"]) == (1, TOKENS)
+
+
+@pytest.mark.parametrize("provider, upstream_path", [("openai", "/v1"), ("anthropic", "")])
+def test_chat_through_mock(app_main, provider, upstream_path):
+    response, stats = _run(app_main, provider, "/api/chat", upstream_path)
+    assert response.status_code == 200
+    assert response.json()["message"]["content"]
+    assert stats["requests"] == 1
+
+
+def test_injected_client_error_reported(app_main):
+    settings = MockSettings(tokens=TOKENS, error_rate=1.0, error_status=400)
+    response, stats = _run(app_main, "openai", "/api/chat", "/v1", settings)
+    assert response.status_code >= 400 and "injected error" in response.text
+    assert stats["errors"] == 1
@@ -0,0 +1,90 @@
+"""services/model_catalog：TTL、stale-while-revalidate、合并获取和失效"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services.model_catalog import ModelCatalogCache  # noqa: E402
+
+
+class Fetcher:
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return f"models-{self.calls}"
+
+
+def test_fresh_entry_served_from_cache():
+    async def scenario():
+        cache = ModelCatalogCache(ttl=60)
+        fetch = Fetcher()
+        key = cache.key_for("openai", "https://api.openai.com/v1/", "sk-test")
+        assert await cache.get(key, fetch) == "models-1"
+        assert await cache.get(key, fetch) == "models-1"
+        assert await cache.get(key, fetch, force_refresh=True) == "models-2"
+        return fetch.calls, cache.counters
+
+    calls, counters = asyncio.run(scenario())
+    assert calls == 2
+    assert counters["hits"] == 1 and counters["misses"] == 2
+
+
+def test_concurrent_misses_fetch_once():
+    async def scenario():
+        cache = ModelCatalogCache()
+        fetch = Fetcher()
+        key = cache.key_for("openai", "https://api.openai.com/v1", "sk-test")
+        results = await asyncio.gather(*(cache.get(key, fetch) for _ in range(5)))
+        return results, fetch.calls
+
+    results, calls = asyncio.run(scenario())
+    assert results == ["models-1"] * 5
+    assert calls == 1
+
+
+def test_stale_entry_refreshed_in_background():
+    async def scenario():
+        cache = ModelCatalogCache(ttl=0, stale_ttl=60)
+        fetch = Fetcher()
+        key = cache.key_for("openai", "https://api.openai.com/v1", "sk-test")
+        await cache.get(key, fetch)
+        stale = await cache.get(key, fetch)
+        await asyncio.sleep(0.05)
+        return stale, cache._entries[key][1]
+
+    stale, refreshed = asyncio.run(scenario())
+    assert (stale, refreshed) == ("models-1", "models-2")
+
+
+def test_invalidate_provider():
+    async def scenario():
+        cache = ModelCatalogCache()
+        fetch = Fetcher()
+        openai = cache.key_for("openai", "https://api.openai.com/v1", "sk-test")
+        custom = cache.key_for("custom", "https://vendor.example/v1", "sk-test")
+        await cache.get(openai, fetch)
+        await cache.get(custom, fetch)
+        cache.invalidate("openai")
+        return cache, openai, custom
+
+    cache, openai, custom = asyncio.run(scenario())
+    assert openai not in cache._entries and custom in cache._entries
+    cache.invalidate()
+    assert cache.stats()["entries"] == 0
+
+
+def test_save_config_drops_stale_catalogue(app_main, client):
+    key = app_main.model_catalog.key_for("custom", "https://vendor.example/v1", "sk-old")
+    app_main.model_catalog._entries[key] = (0.0, "models")
+    try:
+        response = client.post("/api/config", json={
+            "provider": "custom", "api_key": "sk-new", "base_url": "https://vendor.example/v1", "model": "m"
+        })
+        assert response.status_code == 200
+        assert key not in app_main.model_catalog._entries
+    finally:
+        app_main.model_catalog.invalidate("custom")
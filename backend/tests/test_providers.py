@@ -0,0 +1,123 @@
+"""services/providers：适配器注册、缓存和请求体"""
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services import providers  # noqa: E402
+from services.providers import (  # noqa: E402
+    OpenAIAdapter,
+    OpenAICompatibleAdapter,
+    get_adapter,
+    register_adapter,
+)
+
+CONFIG = {"api_key": "sk-test", "base_url": "https://vendor.example/v1"}
+
+
+@pytest.fixture(autouse=True)
+def restore_registry():
+    adapters = dict(providers.ADAPTERS)
+    yield
+    providers.ADAPTERS.clear()
+    providers.ADAPTERS.update(adapters)
+    providers.clear_adapter_cache()
+
+
+def test_adapter_cached_per_config():
+    adapter = get_adapter("openai", CONFIG)
+    assert isinstance(adapter, OpenAIAdapter)
+    assert get_adapter("openai", dict(CONFIG)) is adapter
+    assert get_adapter("openai", {**CONFIG, "api_key": "sk-other"}) is not adapter
+
+
+def test_unregistered_provider_is_openai_compatible():
+    adapter = get_adapter("siliconflow", CONFIG)
+    assert isinstance(adapter, OpenAICompatibleAdapter)
+    assert adapter.chat_url == "https://vendor.example/v1/chat/completions"
+
+
+def test_register_adapter_names_vendor():
+    register_adapter("vendor", OpenAICompatibleAdapter, label="某厂商")
+    adapter = get_adapter("vendor", CONFIG)
+    assert isinstance(adapter, OpenAICompatibleAdapter)
+    assert (adapter.name, adapter.label) == ("vendor", "某厂商")
+    # 复用的适配器类本身不受影响
+    assert (OpenAICompatibleAdapter.name, OpenAICompatibleAdapter.label) == ("custom", "自定义")
+    assert get_adapter("custom", CONFIG).name == "custom"
+
+
+def test_register_adapter_default_label():
+    register_adapter("vendor", OpenAICompatibleAdapter)
+    assert get_adapter("vendor", CONFIG).label == "vendor"
+
+
+def test_register_adapter_keeps_own_subclass():
+    class VendorAdapter(OpenAICompatibleAdapter):
+        name = "vendor"
+        label = "厂商"
+
+    register_adapter("vendor", VendorAdapter)
+    assert type(get_adapter("vendor", CONFIG)) is VendorAdapter
+
+
+def _request():
+    message = SimpleNamespace(role="user", content="你好")
+    return SimpleNamespace(model="m", messages=[message], temperature=0.5, max_tokens=64)
+
+
+@pytest.mark.parametrize("provider, include_usage", [
+    ("openai", True),
+    ("custom", False),
+    ("siliconflow", False),
+    ("anthropic", False),
+])
+def test_stream_usage_only_where_supported(provider, include_usage):
+    payload = get_adapter(provider, CONFIG).build_payload(_request(), stream=True)
+    assert payload["stream"] is True
+    assert ("stream_options" in payload) == include_usage
+    assert "stream_options" not in get_adapter(provider, CONFIG).build_payload(_request())
+
+
+def test_anthropic_payload_moves_system_prompt():
+    messages = [SimpleNamespace(role="system", content="简短回答"), SimpleNamespace(role="user", content="你好")]
+    request = SimpleNamespace(model="claude", messages=messages, temperature=0.0, max_tokens=64)
+    adapter = get_adapter("anthropic", {"api_key": "sk-ant-test", "base_url": "https://api.anthropic.com"})
+    payload = adapter.build_payload(request)
+    assert payload["system"] == "简短回答"
+    assert payload["messages"] == [{"role": "user", "content": "你好"}]
+    assert adapter.chat_url == "https://api.anthropic.com/v1/messages"
+    assert adapter.headers["x-api-key"] == "sk-ant-test"
+
+
+@pytest.mark.parametrize("base_url", ["https://vendor.example/v1", "https://vendor.example/v1/chat/completions/"])
+def test_custom_urls_accept_full_chat_path(base_url):
+    adapter = get_adapter("custom", {"api_key": "sk-test", "base_url": base_url})
+    assert adapter.chat_url == "https://vendor.example/v1/chat/completions"
+    assert adapter.models_url == "https://vendor.example/v1/models"
+
+
+def test_anthropic_stream_events_accumulate_usage():
+    adapter = get_adapter("anthropic", {"api_key": "sk-ant-test", "base_url": "https://api.anthropic.com"})
+    usage: dict = {}
+    events = [
+        {"type": "message_start", "message": {"usage": {"input_tokens": 10, "output_tokens": 1}}},
+        {"type": "content_block_delta", "delta": {"type": "text_delta", "text": "好"}},
+        {"type": "message_delta", "usage": {"output_tokens": 5}},
+    ]
+    out = [event for data in events for event in adapter.parse_stream_event(data, usage)]
+    assert out == [{"type": "content", "content": "好"},
+                   {"type": "usage", "usage": {"input_tokens": 10, "output_tokens": 5}}]
+
+
+@pytest.mark.parametrize("data, content", [
+    ({"choices": [{"message": {"content": "好"}}]}, "好"),
+    ({"choices": [{"text": "好"}]}, "好"),
+    ({"content": [{"text": "好"}]}, "好"),
+    ({"response": "好"}, "好"),
+])
+def test_custom_response_formats(data, content):
+    assert get_adapter("custom", CONFIG).parse_response(data)[0] == content
@@ -0,0 +1,129 @@
+"""services/resilience：重试次数上限、Retry-After、共享的重试计数和对冲"""
+import asyncio
+import email.utils
+import os
+import sys
+import time
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services.resilience import (  # noqa: E402
+    HedgePolicy,
+    LatencyTracker,
+    RetryPolicy,
+    RetryState,
+    UpstreamResilience,
+    retry_after_seconds,
+)
+
+KEY = ("openai", "m", False)
+
+
+def _resilience(hedge=frozenset(), **retry) -> UpstreamResilience:
+    policy = RetryPolicy(**{"max_attempts": 3, "base_delay": 0.0, **retry})
+    return UpstreamResilience(policy, HedgePolicy(providers=hedge, min_samples=3, min_delay=0.01))
+
+
+def _sender(*outcomes, delays=None):
+    """依次返回给定的状态码或抛出给定的异常"""
+    calls = []
+
+    async def send():
+        index = len(calls)
+        calls.append(index)
+        if delays:
+            await asyncio.sleep(delays[index])
+        outcome = outcomes[min(index, len(outcomes) - 1)]
+        if isinstance(outcome, Exception):
+            raise outcome
+        headers, status = (outcome[1], outcome[0]) if isinstance(outcome, tuple) else ({}, outcome)
+        return httpx.Response(status, headers=headers, json={"call": index})
+
+    return send, calls
+
+
+def test_retries_until_attempts_exhausted():
+    send, calls = _sender(503)
+    response = asyncio.run(_resilience().send("openai", "m", send))
+    assert response.status_code == 503 and len(calls) == 3
+
+
+def test_retry_then_success():
+    send, calls = _sender(httpx.ConnectError("refused"), 502, 200)
+    response = asyncio.run(_resilience().send("openai", "m", send))
+    assert response.status_code == 200 and len(calls) == 3
+
+
+@pytest.mark.parametrize("stream, expected_calls", [(False, 1), (True, 2)])
+def test_read_error_retried_only_for_streams(stream, expected_calls):
+    send, calls = _sender(httpx.ReadError("reset"), 200)
+    resilience = _resilience()
+    if stream:
+        assert asyncio.run(resilience.send("openai", "m", send, stream=True)).status_code == 200
+    else:
+        with pytest.raises(httpx.ReadError):
+            asyncio.run(resilience.send("openai", "m", send))
+    assert len(calls) == expected_calls
+
+
+def test_long_retry_after_returned_immediately():
+    send, calls = _sender((429, {"retry-after": "60"}))
+    response = asyncio.run(_resilience(max_delay=8.0).send("openai", "m", send))
+    assert response.status_code == 429 and len(calls) == 1
+
+
+def test_shared_state_caps_total_attempts():
+    # 调用方已经因为正文中断重试过一次，send 只剩一次重试
+    send, calls = _sender(503)
+    state = RetryState(attempt=1)
+    response = asyncio.run(_resilience().send("openai", "m", send, stream=True, state=state))
+    assert response.status_code == 503 and len(calls) == 2 and state.attempt == 2
+
+
+@pytest.mark.parametrize("value, expected", [("3", 3.0), ("-1", 0.0), ("soon", None), (None, None)])
+def test_retry_after_seconds(value, expected):
+    headers = {"retry-after": value} if value is not None else {}
+    assert retry_after_seconds(httpx.Response(429, headers=headers)) == expected
+
+
+def test_retry_after_http_date():
+    value = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert retry_after_seconds(httpx.Response(429, headers={"retry-after": value})) == pytest.approx(30, abs=2)
+
+
+def test_latency_percentile_needs_samples():
+    tracker = LatencyTracker()
+    for seconds in (0.1, 0.2, 0.3, 0.4):
+        tracker.observe(KEY, seconds)
+    assert tracker.percentile(KEY, 50) == 0.3
+    assert tracker.percentile(KEY, 95, min_samples=5) is None
+
+
+def _hedged(send):
+    async def scenario():
+        resilience = _resilience(hedge=frozenset({"openai"}))
+        for _ in range(3):
+            resilience.latency.observe(KEY, 0.02)
+        response = await resilience.send("openai", "m", send)
+        return response.json()["call"]
+
+    return asyncio.run(asyncio.wait_for(scenario(), 5))
+
+
+def test_hedge_wins_when_primary_slow():
+    send, calls = _sender(200, delays=[1.0, 0.0])
+    assert _hedged(send) == 1 and len(calls) == 2
+
+
+def test_hedge_waits_for_other_after_5xx():
+    send, calls = _sender(500, 200, delays=[0.05, 0.1])
+    assert _hedged(send) == 1
+
+
+def test_no_hedge_without_enough_samples():
+    send, calls = _sender(200, delays=[0.05, 0.0])
+    response = asyncio.run(_resilience(hedge=frozenset({"openai"})).send("openai", "m", send))
+    assert response.json()["call"] == 0 and len(calls) == 1
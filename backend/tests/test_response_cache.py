@@ -0,0 +1,131 @@
+"""services/response_cache：缓存开关、两级读写、过期和淘汰"""
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services.response_cache import (  # noqa: E402
+    CacheSettings,
+    ResponseCache,
+    replay_chunks,
+    request_cache_key,
+)
+
+
+class _Message:
+    def __init__(self, role, content):
+        self.role = role
+        self.content = content
+
+
+class _Request:
+    def __init__(self, content="你好", temperature=0.0, cache=None, model="m"):
+        self.provider = "openai"
+        self.model = model
+        self.messages = [_Message("user", content)]
+        self.temperature = temperature
+        self.max_tokens = 100
+        self.cache = cache
+
+
+def _cache(tmp_path, **overrides) -> ResponseCache:
+    return ResponseCache(CacheSettings(db_path=str(tmp_path / "cache.sqlite3"), **overrides))
+
+
+@pytest.mark.parametrize("cache, temperature, threshold, expected", [
+    (None, 0.0, None, False),   # 默认只缓存显式开启的请求
+    (True, 1.0, None, True),
+    (None, 0.0, 0.2, True),
+    (None, 0.7, 0.2, False),
+    (False, 0.0, 0.2, False),
+])
+def test_enabled_for(tmp_path, cache, temperature, threshold, expected):
+    response_cache = _cache(tmp_path, max_temperature=threshold)
+    assert response_cache.enabled_for(_Request(temperature=temperature, cache=cache)) is expected
+
+
+def test_cache_key_normalises_base_url():
+    config = {"base_url": "https://api.openai.com/v1/"}
+    key = request_cache_key(_Request(), config)
+    assert key == request_cache_key(_Request(), {"base_url": "https://api.openai.com/v1"})
+    assert key != request_cache_key(_Request(model="other"), config)
+    assert key != request_cache_key(_Request(temperature=0.5), config)
+
+
+def test_memory_then_disk_hits(tmp_path):
+    async def scenario():
+        response_cache = _cache(tmp_path)
+        await response_cache.set("k", {"content": "好"})
+        memory = await response_cache.get("k")
+        response_cache._memory.clear()
+        disk = await response_cache.get("k")
+        missing = await response_cache.get("other")
+        response_cache.close()
+        return memory, disk, missing, response_cache.stats()
+
+    memory, disk, missing, stats = asyncio.run(scenario())
+    assert memory == disk == {"content": "好"} and missing is None
+    assert (stats["memory_hits"], stats["disk_hits"], stats["misses"]) == (1, 1, 1)
+
+
+def test_expired_entries_dropped(tmp_path, monkeypatch):
+    async def scenario():
+        response_cache = _cache(tmp_path, ttl=10)
+        await response_cache.set("k", {"content": "好"})
+        now = time.time()
+        monkeypatch.setattr(time, "time", lambda: now + 11)
+        value = await response_cache.get("k")
+        response_cache.close()
+        return value, response_cache.stats()
+
+    value, stats = asyncio.run(scenario())
+    assert value is None and stats["expired"] == 2  # 内存和磁盘各一次
+
+
+def test_memory_lru_eviction(tmp_path):
+    async def scenario():
+        response_cache = _cache(tmp_path, max_memory_entries=2)
+        await response_cache.set("a", {"content": "a"})
+        await response_cache.set("b", {"content": "b"})
+        await response_cache.get("a")
+        await response_cache.set("c", {"content": "c"})
+        response_cache.close()
+        return list(response_cache._memory), response_cache.stats()
+
+    keys, stats = asyncio.run(scenario())
+    assert keys == ["a", "c"] and stats["memory_evictions"] == 1
+
+
+def test_disk_eviction_by_size(tmp_path):
+    async def scenario():
+        response_cache = _cache(tmp_path, max_disk_bytes=100)
+        for key in "abc":
+            await response_cache.set(key, {"content": key * 30})
+        response_cache._memory.clear()
+        values = [await response_cache.get(key) for key in "abc"]
+        response_cache.close()
+        return values, response_cache.stats()
+
+    values, stats = asyncio.run(scenario())
+    assert values[0] is None and values[2] is not None
+    assert stats["disk_evictions"] >= 1
+
+
+def test_replay_chunks():
+    chunks = list(replay_chunks("abcdefg", chunk_size=3))
+    assert [chunk["content"] for chunk in chunks] == ["abc", "def", "g"]
+
+
+def test_chat_served_from_cache(client):
+    body = {"provider": "demo", "cache": True, "messages": [{"role": "user", "content": "缓存"}],
+            "api_config": {"demo": {"no_sleep": True}}}
+    first = client.post("/api/chat", json=body).json()
+    second = client.post("/api/chat", json=body).json()
+    assert first["message"] == second["message"]
+    assert client.get("/api/cache/stats").json()["memory_hits"] == 1
+    client.delete("/api/cache")
+    assert client.get("/api/cache/stats").json()["memory_entries"] == 0
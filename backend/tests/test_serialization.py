@@ -0,0 +1,46 @@
+"""services/serialization：各 JSON 后端输出一致、回退和 FastJSONResponse"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services import serialization  # noqa: E402
+from services.serialization import FastJSONResponse, select_backend  # noqa: E402
+
+# 当前环境里装了的后端
+INSTALLED = [name for name in ("orjson", "msgspec", "json") if select_backend(name)[0] == name]
+PAYLOAD = {"type": "content", "content": "你好 \"quoted\"\n", "usage": {"total_tokens": 3}, "ok": True}
+
+
+@pytest.mark.parametrize("name", INSTALLED)
+def test_backends_compact_utf8_and_round_trip(name):
+    _, dumps, loads = select_backend(name)
+    encoded = dumps(PAYLOAD)
+    assert isinstance(encoded, bytes)
+    assert "你好".encode() in encoded and b", " not in encoded and b": " not in encoded
+    assert loads(encoded) == loads(encoded.decode()) == PAYLOAD
+
+
+def test_backends_agree():
+    outputs = {select_backend(name)[1](PAYLOAD) for name in INSTALLED}
+    assert len(outputs) == 1
+
+
+def test_unavailable_backend_falls_back(monkeypatch):
+    def missing():
+        raise ImportError("not installed")
+
+    monkeypatch.setitem(serialization._BACKENDS, "msgspec", missing)
+    name, dumps, _ = select_backend("msgspec")
+    assert name != "msgspec" and dumps({"a": 1}) == b'{"a":1}'
+    assert select_backend("bogus")[0] in INSTALLED
+
+
+def test_fast_json_response_renders_models(app_main):
+    message = app_main.ChatMessage(role="assistant", content="好")
+    response = FastJSONResponse(app_main.ChatResponse(message=message))
+    assert response.body.startswith(b'{"message":{"role":"assistant","content":"\xe5\xa5\xbd"}')
+    assert response.headers["content-type"] == "application/json"
+    assert FastJSONResponse({"a": "好"}).body == '{"a":"好"}'.encode()
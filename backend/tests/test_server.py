@@ -0,0 +1,77 @@
+"""services/server：启动参数、uvicorn 调用方式、启动计时和 /ready"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services import server  # noqa: E402
+from services.server import ServerSettings, StartupTimer, run_server  # noqa: E402
+
+
+@pytest.mark.parametrize("env, reload, workers", [
+    ({}, True, 1),
+    ({"DEBUG": "false"}, False, 1),
+    ({"BACKEND_WORKERS": "4"}, True, 1),  # 重载模式只能单进程
+    ({"BACKEND_MODE": "production", "BACKEND_WORKERS": "4"}, False, 4),
+    ({"BACKEND_MODE": "staging", "BACKEND_WORKERS": "0"}, True, 1),
+])
+def test_settings_from_env(monkeypatch, env, reload, workers):
+    for name in ("BACKEND_MODE", "BACKEND_WORKERS", "DEBUG"):
+        monkeypatch.delenv(name, raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    settings = ServerSettings.from_env()
+    assert (settings.reload, settings.process_workers) == (reload, workers)
+
+
+def test_auto_loop_and_http_fall_back(monkeypatch):
+    monkeypatch.setattr(server, "_available", lambda module: False)
+    settings = ServerSettings()
+    assert (settings.resolved_loop(), settings.resolved_http()) == ("asyncio", "h11")
+    assert ServerSettings(loop="uvloop", http="httptools").resolved_loop() == "uvloop"
+
+
+@pytest.fixture
+def uvicorn_calls(monkeypatch):
+    import uvicorn
+
+    calls = []
+    monkeypatch.setattr(uvicorn, "run", lambda target, **kwargs: calls.append((target, kwargs)))
+    return calls
+
+
+def test_single_process_runs_imported_app(uvicorn_calls):
+    app = object()
+    run_server(app, ServerSettings(mode="production", workers=1))
+    target, kwargs = uvicorn_calls[0]
+    assert target is app and kwargs["workers"] is None and kwargs["access_log"] is False
+
+
+def test_workers_use_import_string(uvicorn_calls):
+    run_server(object(), ServerSettings(mode="production", workers=3))
+    target, kwargs = uvicorn_calls[0]
+    assert target == "main:app" and kwargs["workers"] == 3 and kwargs["reload"] is False
+
+
+def test_startup_timer_phases():
+    timer = StartupTimer()
+    timer.mark("imports")
+    timer.mark("app")
+    assert not timer.stats()["ready"]
+    timer.finish()
+    stats = timer.stats()
+    assert stats["ready"] and list(stats["phases_ms"]) == ["imports", "app"]
+    assert stats["total_ms"] == pytest.approx(sum(stats["phases_ms"].values()), abs=0.5)
+
+
+def test_ready_follows_lifespan(app_main):
+    from fastapi.testclient import TestClient
+
+    with TestClient(app_main.app) as client:
+        response = client.get("/ready")
+        assert response.status_code == 200 and response.json()["ready"] is True
+        assert "warmup" in response.json()["phases_ms"]
+    # 关闭后不再就绪
+    assert TestClient(app_main.app).get("/ready").status_code == 503
@@ -0,0 +1,65 @@
+"""services/sse：帧格式协商，以及 full / delta 两种编码"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services.sse import (  # noqa: E402
+    DeltaStreamEncoder,
+    FullStreamEncoder,
+    create_stream_encoder,
+    negotiate_stream_format,
+)
+
+
+def _payloads(frames: bytes):
+    return [json.loads(frame[6:]) for frame in frames.decode().split("\n\n") if frame.startswith("data: {")]
+
+
+@pytest.mark.parametrize("query, header, expected", [
+    (None, None, "full"),
+    ("delta", None, "delta"),
+    (None, " Delta ", "delta"),
+    ("full", "delta", "full"),
+    ("bogus", None, "full"),
+])
+def test_negotiate_stream_format(query, header, expected):
+    assert negotiate_stream_format(query, header) == expected
+
+
+def test_full_encoder_carries_full_content():
+    encoder = FullStreamEncoder()
+    frames = b"".join(encoder.encode({"type": "content", "content": c}) or b"" for c in ("你", "好"))
+    assert _payloads(frames)[-1] == {"type": "content", "content": "好", "full_content": "你好"}
+    assert encoder.finish() == []
+
+
+def test_delta_encoder_checkpoint_and_final():
+    encoder = create_stream_encoder("delta", checkpoint_every=2)
+    assert isinstance(encoder, DeltaStreamEncoder)
+    frames = b"".join(encoder.encode({"type": "content", "content": c}) or b"" for c in "abc")
+    assert encoder.encode({"type": "usage", "usage": {"total_tokens": 3}}) is None
+    payloads = _payloads(frames + b"".join(encoder.finish()))
+    assert [p["type"] for p in payloads] == ["content", "content", "checkpoint", "content", "final"]
+    assert all("full_content" not in p for p in payloads if p["type"] == "content")
+    assert payloads[2]["full_content"] == "ab"
+    assert payloads[-1] == {"type": "final", "full_content": "abc", "usage": {"total_tokens": 3}}
+
+
+def test_errors_pass_through():
+    frame = create_stream_encoder("delta").encode({"error": True, "message": "HTTP 500"})
+    assert _payloads(frame or b"") == [{"error": True, "message": "HTTP 500"}]
+
+
+def test_stream_endpoint_delta_format(client):
+    body = {"provider": "demo", "messages": [{"role": "user", "content": "你好"}],
+            "api_config": {"demo": {"seed": 1, "tokens": 5, "no_sleep": True}}}
+    response = client.post("/api/chat/stream?format=delta", json=body)
+    assert response.headers["X-Stream-Format"] == "delta"
+    payloads = [json.loads(line[6:]) for line in response.text.splitlines() if line.startswith("data: {")]
+    content = "".join(p["content"] for p in payloads if p.get("type") == "content")
+    assert payloads[-1]["type"] == "final" and payloads[-1]["full_content"] == content
+    assert response.text.rstrip().endswith("data: [DONE]")
@@ -0,0 +1,69 @@
+"""services/sse_parser：任意切块、各种行结束符、多行 data、注释和字段"""
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services.sse_parser import SSEDecoder, aiter_sse  # noqa: E402
+
+STREAM = (
+    b"\xef\xbb\xbf: keep-alive\n"
+    b"event: message_start\nid: 1\ndata: {\"a\": 1}\n\n"
+    b"data: line1\ndata:line2\nretry: 3000\n\n"
+    b"event: ping\n\n"
+    b"data: {\"text\": \"\xe4\xbd\xa0\xe5\xa5\xbd\"}\n\n"
+)
+EXPECTED = [
+    ("message_start", b'{"a": 1}', "1", None),
+    ("message", b"line1\nline2", "1", 3000),
+    ("message", '{"text": "你好"}'.encode(), "1", 3000),
+]
+
+
+def _decode(chunks):
+    decoder = SSEDecoder()
+    events = [event for chunk in chunks for event in decoder.feed(chunk)] + decoder.flush()
+    return [(event.event, event.data, event.id, event.retry) for event in events]
+
+
+@pytest.mark.parametrize("newline", [b"\n", b"\r\n", b"\r"])
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_any_chunking_and_line_ending(newline, size):
+    stream = STREAM.replace(b"\n", newline)
+    chunks = [stream[i:i + size] for i in range(0, len(stream), size)]
+    assert _decode(chunks) == EXPECTED
+
+
+def test_crlf_split_across_chunks():
+    assert _decode([b"data: a\r", b"\ndata: b\r", b"\n\r", b"\n"]) == [("message", b"a\nb", None, None)]
+
+
+def test_flush_dispatches_unterminated_event():
+    assert _decode([b"data: [DONE]"]) == [("message", b"[DONE]", None, None)]
+
+
+def test_id_with_null_ignored_and_invalid_retry():
+    events = _decode([b"id: 7\ndata: a\n\nid: x\0y\nretry: soon\ndata: b\n\n"])
+    assert [(event[2], event[3]) for event in events] == [("7", None), ("7", None)]
+
+
+def test_json_decodes_bytes():
+    decoder = SSEDecoder()
+    event = decoder.feed(b'data: {"choices": [{"delta": {"content": "\xe5\xa5\xbd"}}]}\n\n')[0]
+    assert event.json()["choices"][0]["delta"]["content"] == "好"
+
+
+def test_aiter_sse_over_response():
+    async def body():
+        for index in range(0, len(STREAM), 5):
+            yield STREAM[index:index + 5]
+
+    async def scenario():
+        response = httpx.Response(200, content=body())
+        return [(event.event, event.data, event.id, event.retry) async for event in aiter_sse(response)]
+
+    assert asyncio.run(scenario()) == EXPECTED
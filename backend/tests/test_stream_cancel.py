@@ -0,0 +1,160 @@
+"""客户端断开后取消上游：services/disconnect 单元测试，以及经过 /api/chat/stream 的端到端测试
+
+端到端测试启动一个慢速的本地 OpenAI 兼容上游和后端（uvicorn，随机端口），
+客户端读到几帧后断开，检查上游连接被关闭、断开后上游没有再生成 token。
+分别在 Starlette 自己监听断开（ASGI 2.3）和依赖 send 抛错（2.4）两种语义下运行。
+"""
+import asyncio
+import functools
+import json
+import os
+import sys
+import time
+
+import httpx
+import pytest
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services.disconnect import cancel_on_disconnect  # noqa: E402
+
+# 上游 token 间隔远大于断开检测间隔，断开后不应该再有 token
+TOKEN_GAP = 0.2
+POLL_INTERVAL = 0.01
+
+
+def test_cancel_on_disconnect_closes_source():
+    state = {"produced": 0, "closed": False, "disconnected": False}
+
+    async def source():
+        try:
+            while True:
+                await asyncio.sleep(TOKEN_GAP)
+                state["produced"] += 1
+                yield b"frame"
+        finally:
+            state["closed"] = True
+
+    async def is_disconnected():
+        return state["disconnected"]
+
+    async def scenario():
+        received = 0
+        async for _ in cancel_on_disconnect(source(), is_disconnected, interval=POLL_INTERVAL):
+            received += 1
+            if received == 2:
+                state["disconnected"] = True
+                produced = state["produced"]
+                started = time.perf_counter()
+        return received, produced, time.perf_counter() - started
+
+    received, produced, elapsed = asyncio.run(asyncio.wait_for(scenario(), 5))
+    assert received == 2
+    assert state["closed"] and elapsed < TOKEN_GAP
+    assert state["produced"] == produced
+
+
+def test_cancel_on_disconnect_passes_through():
+    async def source():
+        for index in range(3):
+            yield str(index).encode()
+
+    async def is_disconnected():
+        return False
+
+    async def scenario():
+        return [frame async for frame in cancel_on_disconnect(source(), is_disconnected, interval=POLL_INTERVAL)]
+
+    assert asyncio.run(scenario()) == [b"0", b"1", b"2"]
+
+
+class SlowUpstream:
+    """逐个 token 慢速输出的 OpenAI 兼容上游，记录发出的 token 数和关闭时间"""
+
+    def __init__(self):
+        self.sent = 0
+        self.closed_at = None
+        self.app = FastAPI()
+        self.app.post("/v1/chat/completions")(self.completions)
+
+    async def completions(self):
+        self.sent = 0
+        self.closed_at = None
+
+        async def generate():
+            try:
+                for index in range(1000):
+                    chunk = {"choices": [{"index": 0, "delta": {"content": f"t{index} "}}]}
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    self.sent += 1
+                    await asyncio.sleep(TOKEN_GAP)
+            finally:
+                self.closed_at = time.perf_counter()
+
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+
+class ForceSpec24:
+    """把 ASGI spec_version 改成 2.4：Starlette 不再监听断开，只能靠 cancel_on_disconnect"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            scope = {**scope, "asgi": {**scope.get("asgi", {}), "spec_version": "2.4"}}
+        await self.app(scope, receive, send)
+
+
+async def _serve(app):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning", lifespan="off"))
+    task = asyncio.ensure_future(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, task, f"http://127.0.0.1:{port}"
+
+
+@pytest.mark.parametrize("spec", ["2.3", "2.4"])
+def test_stream_disconnect_cancels_upstream(app_main, monkeypatch, spec):
+    monkeypatch.setattr(app_main, "cancel_on_disconnect",
+                        functools.partial(cancel_on_disconnect, interval=POLL_INTERVAL))
+    upstream = SlowUpstream()
+    app = ForceSpec24(app_main.app) if spec == "2.4" else app_main.app
+
+    async def scenario():
+        upstream_server, upstream_task, upstream_url = await _serve(upstream.app)
+        server, task, base_url = await _serve(app)
+        try:
+            async with app_main.app.router.lifespan_context(app_main.app):
+                body = {"messages": [{"role": "user", "content": "hi"}], "provider": "custom",
+                        "api_config": {"api_key": "sk-local", "base_url": f"{upstream_url}/v1", "model": "slow"}}
+                frames = 0
+                async with httpx.AsyncClient(base_url=base_url, timeout=10) as client:
+                    async with client.stream("POST", "/api/chat/stream", json=body) as response:
+                        async for line in response.aiter_lines():
+                            if line.startswith("data: ") and '"content"' in line:
+                                frames += 1
+                                if frames == 2:
+                                    break
+                disconnected = time.perf_counter()
+                sent_at_disconnect = upstream.sent
+                while upstream.closed_at is None and time.perf_counter() < disconnected + 2:
+                    await asyncio.sleep(0.005)
+                # 再等一个 token 间隔，确认上游没有继续生成
+                await asyncio.sleep(TOKEN_GAP)
+                return frames, disconnected, sent_at_disconnect
+        finally:
+            server.should_exit = True
+            upstream_server.should_exit = True
+            await task
+            await upstream_task
+
+    frames, disconnected, sent_at_disconnect = asyncio.run(scenario())
+    assert frames == 2
+    assert upstream.closed_at is not None
+    assert upstream.closed_at - disconnected < TOKEN_GAP
+    assert upstream.sent == sent_at_disconnect
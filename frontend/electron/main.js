@@ -5,6 +5,9 @@ const { spawn } = require('child_process')
 let mainWindow
 let backendProcess
 
+// 后端地址（与 backend/.env 中的 BACKEND_HOST / BACKEND_PORT 一致）
+const BACKEND_URL = 'http://127.0.0.1:8000'
+
 function createWindow() {
   console.log('创建Electron窗口...')
   // 创建浏览器窗口
@@ -115,75 +118,97 @@ function createWindow() {
   })
 }
 
-// 启动后端服务
-function startBackend() {
+// 启动后端服务，返回的 Promise 在后端就绪（true）或等待失败（false）后 resolve
+async function startBackend() {
   // 检查是否需要启动后端（可以通过环境变量控制）
   if (process.env.SKIP_BACKEND === 'true') {
     console.log('跳过后端启动（SKIP_BACKEND=true）')
-    return
+    return true
   }
 
-  // 检查后端是否已经在运行
+  // 请求 /ready，返回状态码；连不上时返回 null（/ready 在启动完成前返回 503）
   const checkBackend = async () => {
     try {
       const { net } = require('electron')
-      const request = net.request('http://127.0.0.1:8000')
+      const request = net.request(`${BACKEND_URL}/ready`)
       return new Promise((resolve) => {
-        request.on('response', () => {
-          console.log('后端已在运行，跳过启动')
-          resolve(true)
+        request.on('response', (response) => {
+          resolve(response.statusCode)
         })
         request.on('error', () => {
-          resolve(false)
+          resolve(null)
         })
         request.end()
       })
     } catch {
-      return false
+      return null
     }
   }
 
-  checkBackend().then((isRunning) => {
-    if (isRunning) {
-      console.log('检测到后端已在运行，跳过启动')
-      return
+  // 轮询直到后端就绪或超时；isAlive 返回 false 表示后端进程已退出，不再等待
+  const waitForBackend = async (isAlive, timeout = 30000) => {
+    const started = Date.now()
+    while (Date.now() - started < timeout) {
+      if (!isAlive()) return false
+      if (await checkBackend() === 200) {
+        console.log(`后端已就绪，用时 ${Date.now() - started} ms`)
+        return true
+      }
+      await new Promise((resolve) => setTimeout(resolve, 100))
     }
+    console.error('等待后端就绪超时')
+    return false
+  }
 
-    const backendPath = path.join(__dirname, '../../backend')
-    const pythonPath = path.join(backendPath, '.venv', 'Scripts', 'python.exe')
-    const mainPath = path.join(backendPath, 'src', 'main.py')
-    
-    console.log('正在启动后端服务...')
-    
-    // 启动Python后端服务
-    backendProcess = spawn(pythonPath, [mainPath], {
-      cwd: backendPath,
-      stdio: process.env.NODE_ENV === 'development' ? 'inherit' : 'pipe', // 开发时显示输出，生产时隐藏
-      windowsHide: true // 在Windows上隐藏控制台窗口
-    })
+  // 有任何 HTTP 响应（包括启动中的 503）都说明端口上已有后端，不再启动第二个
+  if (await checkBackend() !== null) {
+    console.log('检测到后端已在运行，跳过启动，等待其就绪')
+    return waitForBackend(() => true)
+  }
 
-    backendProcess.on('error', (err) => {
-      console.error('启动后端服务失败:', err)
-      console.log('提示：您可以手动启动后端服务：cd backend && uv run python src/main.py')
-    })
+  const backendPath = path.join(__dirname, '../../backend')
+  const pythonPath = path.join(backendPath, '.venv', 'Scripts', 'python.exe')
+  const mainPath = path.join(backendPath, 'src', 'main.py')
+  
+  console.log('正在启动后端服务...')
+  
+  // 启动Python后端服务
+  // 开发时保留自动重载，打包运行时使用生产模式（不重载，启动更快）
+  backendProcess = spawn(pythonPath, [mainPath], {
+    cwd: backendPath,
+    env: {
+      ...process.env,
+      BACKEND_MODE: process.env.BACKEND_MODE || (process.env.NODE_ENV === 'development' ? 'development' : 'production')
+    },
+    stdio: process.env.NODE_ENV === 'development' ? 'inherit' : 'pipe', // 开发时显示输出，生产时隐藏
+    windowsHide: true // 在Windows上隐藏控制台窗口
+  })
 
-    backendProcess.on('close', (code) => {
-      console.log(`后端进程退出，代码: ${code}`)
+  backendProcess.on('error', (err) => {
+    console.error('启动后端服务失败:', err)
+    console.log('提示：您可以手动启动后端服务：cd backend && uv run python src/main.py')
+    backendProcess = null
+  })
+
+  backendProcess.on('close', (code) => {
+    console.log(`后端进程退出，代码: ${code}`)
+    backendProcess = null
+  })
+
+  // 监听后端输出（如果需要的话）
+  if (backendProcess.stdout) {
+    backendProcess.stdout.on('data', (data) => {
+      console.log(`后端输出: ${data}`)
     })
+  }
 
-    // 监听后端输出（如果需要的话）
-    if (backendProcess.stdout) {
-      backendProcess.stdout.on('data', (data) => {
-        console.log(`后端输出: ${data}`)
-      })
-    }
+  if (backendProcess.stderr) {
+    backendProcess.stderr.on('data', (data) => {
+      console.error(`后端错误: ${data}`)
+    })
+  }
 
-    if (backendProcess.stderr) {
-      backendProcess.stderr.on('data', (data) => {
-        console.error(`后端错误: ${data}`)
-      })
-    }
-  })
+  return waitForBackend(() => backendProcess !== null)
 }
 
 // 停止后端服务
@@ -195,8 +220,9 @@ function stopBackend() {
 }
 
 // 当 Electron 完成初始化并准备创建浏览器窗口时调用此方法
-app.whenReady().then(() => {
-  startBackend()
+app.whenReady().then(async () => {
+  // 页面加载后立即会请求后端，先等后端就绪；超时也照常打开窗口，由页面提示连接失败
+  await startBackend()
   createWindow()
 
   app.on('activate', () => {
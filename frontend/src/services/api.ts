@@ -55,6 +55,8 @@ export interface ChatRequest {
   max_tokens?: number
   stream?: boolean
   api_config?: any
+  cache?: boolean
+  conversation_id?: string  // 设置后 messages 只需包含新的一轮
 }
 
 export interface ChatResponse {
@@ -62,6 +64,19 @@ export interface ChatResponse {
   usage?: any
 }
 
+// 流式帧（delta格式）：content 只含增量，checkpoint/final 携带完整文本，
+// context 是第一帧，报告按模型上下文窗口裁剪掉的历史消息；
+// queue 表示请求在后端准入队列中等待，position 为当前排队位置
+export interface StreamChunk {
+  type: 'content' | 'checkpoint' | 'final' | 'context' | 'queue'
+  content?: string
+  full_content?: string
+  usage?: any
+  dropped_messages?: number
+  dropped_tokens?: number
+  position?: number
+}
+
 export const chatAPI = {
   // 发送聊天消息（非流式）
   sendMessage: async (request: ChatRequest, signal?: AbortSignal): Promise<ChatResponse> => {
@@ -85,7 +100,7 @@ export const chatAPI = {
   // 发送流式聊天消息
   sendStreamingMessage: async (
     request: ChatRequest,
-    onChunk: (chunk: { type: string; content: string; full_content: string }) => void,
+    onChunk: (chunk: StreamChunk) => void,
     onError: (error: string) => void,
     onComplete: () => void,
     signal?: AbortSignal
@@ -94,7 +109,8 @@ export const chatAPI = {
       // 确保启用流式模式
       const streamRequest = { ...request, stream: true }
       
-      const response = await fetch('http://localhost:8000/api/chat/stream', {
+      // 使用delta帧格式，避免每帧重复传输完整文本
+      const response = await fetch('http://localhost:8000/api/chat/stream?format=delta', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json'
@@ -146,7 +162,7 @@ export const chatAPI = {
                   return
                 }
                 
-                if (chunk.type === 'content') {
+                if (['content', 'checkpoint', 'final', 'context', 'queue'].includes(chunk.type)) {
                   onChunk(chunk)
                 }
               } catch (parseError) {
@@ -187,12 +203,120 @@ export const chatAPI = {
   }
 }
 
+// 会话相关API（历史消息保存在后端）
+export interface Conversation {
+  id: string
+  title: string
+  provider: string
+  model: string
+  message_count: number
+  created_at: number
+  updated_at: number
+}
+
+export interface StoredMessage {
+  id: number
+  role: 'user' | 'assistant'
+  content: string
+  created_at: number
+}
+
+export interface ConversationDetail extends Conversation {
+  messages: StoredMessage[]
+  has_more: boolean
+}
+
+export const conversationAPI = {
+  // 新建会话
+  create: async (title = ''): Promise<Conversation> => {
+    const response = await api.post('/api/conversations', { title })
+    return response.data
+  },
+
+  // 会话列表（按最近更新时间倒序）
+  list: async (limit = 20, offset = 0): Promise<{ data: Conversation[], total: number }> => {
+    const response = await api.get('/api/conversations', { params: { limit, offset } })
+    return response.data
+  },
+
+  // 会话详情，before 为消息id，用于向前翻页
+  get: async (id: string, limit = 50, before?: number): Promise<ConversationDetail> => {
+    const response = await api.get(`/api/conversations/${id}`, { params: { limit, before } })
+    return response.data
+  },
+
+  // 删除会话
+  remove: async (id: string): Promise<any> => {
+    const response = await api.delete(`/api/conversations/${id}`)
+    return response.data
+  }
+}
+
+// 历史问答全文检索
+export interface HistorySearchParams {
+  q: string
+  provider?: string
+  model?: string
+  since?: string  // ISO 8601
+  until?: string
+  sort?: 'relevance' | 'recent'
+  limit?: number
+  cursor?: string
+}
+
+export interface HistoryHit {
+  id: number
+  created_at: number
+  conversation_id: string | null
+  provider: string
+  model: string
+  prompt: string
+  score: number
+  snippet: string  // 已转义的 HTML，关键词用 <mark> 标出
+}
+
+export interface HistorySearchResult {
+  results: HistoryHit[]
+  next_cursor: string | null
+  took_ms: number
+}
+
+export const historyAPI = {
+  // next_cursor 不为空时带上它获取下一页
+  search: async (params: HistorySearchParams): Promise<HistorySearchResult> => {
+    const response = await api.get('/api/history/search', { params })
+    return response.data
+  }
+}
+
 // 配置相关API
+// 多端点/多密钥池中的一个端点
+export interface EndpointConfig {
+  base_url: string
+  api_key: string
+  weight?: number
+}
+
 export interface APIConfig {
   provider: string
   api_key: string
   base_url: string
   model: string
+  endpoints?: EndpointConfig[]
+  balancer?: 'least_in_flight' | 'ewma'
+  demo?: DemoOptions
+}
+
+// 演示模式的回复参数（见 backend/src/services/demo.py），用于无网络压测
+export interface DemoOptions {
+  seed?: number
+  tokens?: number
+  rate?: number
+  ttft?: number
+  chunk_size?: number
+  jitter?: number
+  failure_rate?: number
+  no_sleep?: boolean
 }
 
 // 模型信息接口
@@ -225,9 +349,11 @@ export const configAPI = {
   },
 
   // 获取模型列表
-  getModels: async (config: APIConfig): Promise<ModelsResponse> => {
+  getModels: async (config: APIConfig, forceRefresh = false): Promise<ModelsResponse> => {
     try {
-      const response = await api.post('/api/models', config)
+      const response = await api.post('/api/models', config, {
+        params: forceRefresh ? { force_refresh: true } : undefined
+      })
       return response.data
     } catch (error: any) {
       if (error.response?.data?.detail) {